@@ -2,43 +2,155 @@ import sys
 import os
 import hashlib
 import re
+import bisect
+import heapq
+import functools
 import keyword
+import ast
 import builtins
 import threading
 import subprocess
 import platform
+import pkgutil
+import time
+import json
+import codecs
+import locale
+import signal
+import socket
+import tempfile
+import shutil
+import pstats
+import queue
+import contextlib
+import warnings
+from collections import deque
+try:
+    import pty
+    import termios
+    import fcntl
+except ImportError:
+    # Windows 上没有伪终端，终端退回到每条命令启动一个进程
+    pty = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 命令行批处理不需要界面：在导入 Qt 之前分派，启动更快，也能在没有显示器的机器上运行。
+# 以 pyedit_worker 作为 __main__ 运行：spawn/forkserver 方式下进程池的子进程会重新导入 __main__，
+# 如果仍是 main.py，每个子进程都会导入 Qt
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] in ('check', 'highlight'):
+    import runpy
+    runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyedit_worker.py"), run_name="__main__")
+
 from PyQt6.QtWidgets import *
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
-from qt_material import apply_stylesheet
+from pyedit_worker import PythonTokenizer
+
+
+# 配置和缓存目录
+CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".pyedit")
+# 子进程工作程序（不依赖Qt），与本文件放在同一目录
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyedit_worker.py")
+SETTINGS_PATH = os.path.join(CONFIG_DIR, "settings.json")
+
+DEFAULT_SETTINGS = {
+    # 运行代码的解释器预先导入的模块，如 ["numpy", "pandas"]
+    "run_preload_modules": [],
+    # 预热解释器的数量，0 表示每次运行都启动新的解释器
+    "run_pool_size": 1,
+    # 运行代码的资源上限（仅 Linux 等 POSIX 系统），0 表示不限制
+    "run_cpu_limit_seconds": 0,
+    "run_wall_limit_seconds": 0,
+    "run_memory_limit_mb": 0,
+}
+
+
+def write_json_atomic(path, data):
+    """先写临时文件再替换，避免写到一半时崩溃损坏缓存"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def load_settings():
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(read_json(SETTINGS_PATH, {}))
+    return settings
+
+
+# 高亮引擎：逐条正则规则 / 单遍分词
+HIGHLIGHT_ENGINE_RULES = "rules"
+HIGHLIGHT_ENGINE_TOKENIZER = "tokenizer"
 
 
 class PythonSyntaxHighlighter(QSyntaxHighlighter):
-    def __init__(self, parent=None):
+    # 延迟高亮每批处理的块数和每次空闲回调的时间片（秒）
+    LAZY_BATCH_BLOCKS = 200
+    LAZY_TIME_SLICE = 0.01
+
+    def __init__(self, parent=None, engine=HIGHLIGHT_ENGINE_TOKENIZER):
         super().__init__(parent)
+        self.engine = engine
+        self.tokenizer = PythonTokenizer()
         self.highlighting_rules = []
+        # 分词引擎使用的 token类型 -> 格式 映射
+        self.token_formats = {}
+
+        # 延迟高亮：只立即处理窗口内的块，其余在空闲时分批完成
+        self.lazy_active = False
+        self.lazy_window = None
+        self.visible_window = None
+        self.lazy_next_block = 0
+        # 整体重新高亮期间为 True，编辑器据此忽略随之发出的文档变化
+        self.rehighlighting = False
+        self.lazy_timer = QTimer(self)
+        self.lazy_timer.setInterval(0)
+        self.lazy_timer.timeout.connect(self.highlight_next_batch)
 
         # 1. 首先匹配三引号字符串（最高优先级）
         self.triple_string_format = QTextCharFormat()
         self.triple_string_format.setForeground(QColor("#00AA00"))
         self.triple_single_pattern = QRegularExpression(r"'''[^']*(?:'[^']|'[^'])*'''")
         self.triple_double_pattern = QRegularExpression(r'"""[^"]*(?:"[^"]|"[^"]")*"""')
+        self.token_formats['triple_string'] = self.triple_string_format
 
         # 2. 普通字符串 - 绿色
         string_format = QTextCharFormat()
         string_format.setForeground(QColor("#00AA00"))
+        self.token_formats['string'] = string_format
         self.highlighting_rules.append((QRegularExpression(r'"[^"\\]*(\\.[^"\\]*)*"'), string_format))
         self.highlighting_rules.append((QRegularExpression(r"'[^'\\]*(\\.[^'\\]*)*'"), string_format))
 
         # 3. 注释 - 灰色（在字符串之后）
         comment_format = QTextCharFormat()
         comment_format.setForeground(QColor("#888888"))
+        self.token_formats['comment'] = comment_format
         self.highlighting_rules.append((QRegularExpression(r'#.*'), comment_format))
 
         # 4. 关键字 - 红色（完整单词匹配）
         keyword_format = QTextCharFormat()
         keyword_format.setForeground(QColor("#FF6B9D"))
         keyword_format.setFontWeight(QFont.Weight.Bold)
+        self.token_formats['keyword'] = keyword_format
         keywords = keyword.kwlist
         for word in keywords:
             # 使用单词边界确保完整匹配
@@ -48,6 +160,7 @@ class PythonSyntaxHighlighter(QSyntaxHighlighter):
         # 5. 内置函数 - 蓝色（完整单词匹配）
         builtin_format = QTextCharFormat()
         builtin_format.setForeground(QColor("#6B8EFF"))
+        self.token_formats['builtin'] = builtin_format
         builtins_list = [name for name in dir(builtins) if not name.startswith('_')]
         for word in builtins_list:
             pattern = r'\b' + re.escape(word) + r'\b'
@@ -56,6 +169,7 @@ class PythonSyntaxHighlighter(QSyntaxHighlighter):
         # 6. 布尔值和None - 深红色
         bool_format = QTextCharFormat()
         bool_format.setForeground(QColor("#DC143C"))
+        self.token_formats['bool'] = bool_format
         for word in ['True', 'False', 'None']:
             pattern = r'\b' + re.escape(word) + r'\b'
             self.highlighting_rules.append((QRegularExpression(pattern), bool_format))
@@ -63,27 +177,32 @@ class PythonSyntaxHighlighter(QSyntaxHighlighter):
         # 7. 数字 - 橙色
         number_format = QTextCharFormat()
         number_format.setForeground(QColor("#FF8C00"))
+        self.token_formats['number'] = number_format
         self.highlighting_rules.append((QRegularExpression(r'\b\d+\b'), number_format))
         self.highlighting_rules.append((QRegularExpression(r'\b\d+\.\d+\b'), number_format))
 
         # 8. 函数调用 - 青色（后面有括号的单词）
         function_format = QTextCharFormat()
         function_format.setForeground(QColor("#32CD32"))
+        self.token_formats['function'] = function_format
         self.highlighting_rules.append((QRegularExpression(r'\b\w+(?=\()'), function_format))
 
         # 9. 类名 - 洋红色（class后面的单词）
         class_format = QTextCharFormat()
         class_format.setForeground(QColor("#FF1493"))
+        self.token_formats['class'] = class_format
         self.highlighting_rules.append((QRegularExpression(r'(?<=\bclass\s+)\w+'), class_format))
 
         # 10. 装饰器 - 深橙色
         decorator_format = QTextCharFormat()
         decorator_format.setForeground(QColor("#FF4500"))
+        self.token_formats['decorator'] = decorator_format
         self.highlighting_rules.append((QRegularExpression(r'@\w+'), decorator_format))
 
         # 11. 模块名（import/from后面） - 紫色
         import_format = QTextCharFormat()
         import_format.setForeground(QColor("#9370DB"))
+        self.token_formats['import'] = import_format
         # import module_name
         self.highlighting_rules.append((QRegularExpression(r'(?<=\bimport\s+)\w+'), import_format))
         # from module_name
@@ -92,6 +211,7 @@ class PythonSyntaxHighlighter(QSyntaxHighlighter):
         # 12. 运算符 - 金色（小心匹配，避免匹配单词中的字符）
         operator_format = QTextCharFormat()
         operator_format.setForeground(QColor("#FFD700"))
+        self.token_formats['operator'] = operator_format
         # 只匹配作为独立token的运算符
         operator_patterns = [
             r'\+\+', r'--',  # 先匹配 ++ --
@@ -111,21 +231,103 @@ class PythonSyntaxHighlighter(QSyntaxHighlighter):
         for pattern in operator_patterns:
             self.highlighting_rules.append((QRegularExpression(pattern), operator_format))
 
-    def highlightBlock(self, text):
-        # 先处理三引号字符串
-        triple_single_match = self.triple_single_pattern.match(text)
-        while triple_single_match.hasMatch():
-            start = triple_single_match.capturedStart()
-            length = triple_single_match.capturedLength()
-            self.setFormat(start, length, self.triple_string_format)
-            triple_single_match = self.triple_single_pattern.match(text, start + length)
+    def rehighlight(self):
+        # 重新高亮只改变格式，但会发出覆盖整个文档的 contentsChange
+        self.rehighlighting = True
+        try:
+            super().rehighlight()
+        finally:
+            self.rehighlighting = False
+
+    def set_engine(self, engine):
+        if engine not in (HIGHLIGHT_ENGINE_RULES, HIGHLIGHT_ENGINE_TOKENIZER):
+            raise ValueError(f"未知的高亮引擎: {engine}")
+        self.engine = engine
+        self.rehighlight()
+
+    def timed_rehighlight(self, engine=None):
+        """用指定引擎重新高亮整个文档，返回耗时（秒），便于对比两种引擎"""
+        start = time.perf_counter()
+        if engine is None:
+            self.rehighlight()
+        else:
+            self.set_engine(engine)
+        return time.perf_counter() - start
+
+    def start_lazy(self):
+        """之后的文档变化只高亮已高亮过的块和窗口内的块"""
+        self.lazy_active = True
+        self.lazy_next_block = 0
+        self.visible_window = None
+        self.lazy_timer.stop()
+
+    def stop_lazy(self):
+        self.lazy_active = False
+        self.visible_window = None
+        self.lazy_timer.stop()
+
+    def highlight_range(self, first, last):
+        """立即高亮第 first 到 last 块中尚未高亮的块"""
+        self.lazy_window = (first, last)
+        try:
+            block = self.document().findBlockByNumber(first)
+            while block.isValid() and block.blockNumber() <= last:
+                if block.userState() == -1:
+                    # 块状态从 -1 变化，会连带高亮窗口内紧随其后的块
+                    self.rehighlightBlock(block)
+                block = block.next()
+        finally:
+            self.lazy_window = None
+
+    def highlight_next_batch(self):
+        deadline = time.perf_counter() + self.LAZY_TIME_SLICE
+        while self.lazy_next_block < self.document().blockCount():
+            first = self.lazy_next_block
+            self.lazy_next_block = first + self.LAZY_BATCH_BLOCKS
+            self.highlight_range(first, self.lazy_next_block - 1)
+            if time.perf_counter() >= deadline:
+                return
+        self.stop_lazy()
 
-        triple_double_match = self.triple_double_pattern.match(text)
-        while triple_double_match.hasMatch():
-            start = triple_double_match.capturedStart()
-            length = triple_double_match.capturedLength()
-            self.setFormat(start, length, self.triple_string_format)
-            triple_double_match = self.triple_double_pattern.match(text, start + length)
+    def lazy_block_allowed(self):
+        # 已高亮过的块始终保持最新，保证跨行状态能向后传递
+        if self.currentBlockState() != -1:
+            return True
+        if self.lazy_window is None and self.visible_window is None:
+            return False
+        number = self.currentBlock().blockNumber()
+        for window in (self.lazy_window, self.visible_window):
+            if window and window[0] <= number <= window[1]:
+                return True
+        return False
+
+    def highlightBlock(self, text):
+        if self.lazy_active and not self.lazy_block_allowed():
+            return
+        if self.engine == HIGHLIGHT_ENGINE_TOKENIZER:
+            self.highlight_block_tokens(text)
+        else:
+            self.highlight_block_rules(text)
+
+    def previous_lexer_state(self):
+        state = self.previousBlockState()
+        return state if state >= 0 else PythonTokenizer.STATE_NORMAL
+
+    def highlight_block_tokens(self, text):
+        tokens, end_state = self.tokenizer.tokenize(text, self.previous_lexer_state())
+        for start, length, token_type in tokens:
+            self.setFormat(start, length, self.token_formats[token_type])
+        # 结束状态不变时，QSyntaxHighlighter 不会继续重新高亮后面的块
+        self.setCurrentBlockState(end_state)
+
+    def highlight_block_rules(self, text):
+        # 先处理三引号字符串（含跨行部分），范围由分词器根据块状态给出
+        tokens, end_state = self.tokenizer.tokenize(text, self.previous_lexer_state())
+        triple_spans = [(start, start + length) for start, length, token_type in tokens
+                        if token_type == 'triple_string']
+        for start, end in triple_spans:
+            self.setFormat(start, end - start, self.triple_string_format)
+        self.setCurrentBlockState(end_state)
 
         # 处理其他规则（按优先级）
         for pattern, fmt in self.highlighting_rules:
@@ -135,10 +337,10 @@ class PythonSyntaxHighlighter(QSyntaxHighlighter):
                 start = match.capturedStart()
                 length = match.capturedLength()
 
-                # 检查这个匹配是否已经在三引号字符串中被格式化了
+                # 检查这个匹配是否落在三引号字符串中
                 already_formatted = False
-                for i in range(start, start + length):
-                    if self.format(i).foreground().color() == self.triple_string_format.foreground().color():
+                for span_start, span_end in triple_spans:
+                    if start < span_end and span_start < start + length:
                         already_formatted = True
                         break
 
@@ -165,95 +367,1143 @@ class PythonSyntaxHighlighter(QSyntaxHighlighter):
         return False
 
 
+class CompletionIndex:
+    """按小写名称排序的数组，用二分查找做前缀匹配，并支持驼峰/子序列模糊匹配"""
+
+    # 匹配等级：越小越好
+    MATCH_PREFIX = 0
+    MATCH_PREFIX_IGNORE_CASE = 1
+    MATCH_CAMEL_HUMP = 2
+    MATCH_SUBSEQUENCE = 3
+
+    def __init__(self, names=()):
+        self.entries = sorted((name.lower(), name) for name in set(names))
+        # 首字母 -> 该首字母下所有名称（每个名称前加换行）连接的文本，供模糊匹配的正则一次扫描
+        self.bucket_texts = {}
+
+    def add(self, name):
+        bisect.insort(self.entries, (name.lower(), name))
+        self.bucket_texts.pop(name[:1].lower(), None)
+
+    def remove(self, name):
+        entry = (name.lower(), name)
+        i = bisect.bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            del self.entries[i]
+            self.bucket_texts.pop(name[:1].lower(), None)
+
+    def update(self, added, removed):
+        """先删除 removed 中的名称，再加入 added 中的名称"""
+        # 逐个插入删除每次都要移动数组，增删的名称相对数组较多时整体合并更快
+        if (len(added) + len(removed)) * 16 < len(self.entries) + 256:
+            for name in removed:
+                self.remove(name)
+            for name in added:
+                self.add(name)
+            return
+        kept = set(added) & set(removed)
+        removed = set(removed) - kept
+        entries = [entry for entry in self.entries if entry[1] not in removed] if removed else self.entries
+        # 两段各自有序，Timsort 合并的代价是线性的
+        self.entries = sorted(entries + sorted((name.lower(), name) for name in added if name not in kept))
+        self.bucket_texts = {}
+
+    def key_range(self, lower_prefix):
+        lo = bisect.bisect_left(self.entries, (lower_prefix,))
+        hi = bisect.bisect_left(self.entries, (lower_prefix + '\uffff',))
+        return lo, hi
+
+    def search(self, prefix):
+        """产生前缀匹配的 (匹配等级, 名称)"""
+        lo, hi = self.key_range(prefix.lower())
+        for _, name in self.entries[lo:hi]:
+            if name.startswith(prefix):
+                yield self.MATCH_PREFIX, name
+            else:
+                yield self.MATCH_PREFIX_IGNORE_CASE, name
+
+    def fuzzy_search(self, prefix):
+        """产生模糊匹配的 (匹配等级, 名称)，只在首字母相同的名称中查找"""
+        if len(prefix) < 2:
+            return
+
+        first = prefix[0].lower()
+        text = self.bucket_texts.get(first)
+        if text is None:
+            lo, hi = self.key_range(first)
+            text = self.bucket_texts[first] = ''.join('\n' + name for _, name in self.entries[lo:hi])
+
+        yield from self.scan_fuzzy(prefix, text)
+
+    def match_levels(self, prefix):
+        """返回 {名称: 匹配等级}，模糊匹配只在前缀匹配以外的名称中查找"""
+        lo, hi = self.key_range(prefix.lower())
+        levels = {name: self.MATCH_PREFIX if name.startswith(prefix) else self.MATCH_PREFIX_IGNORE_CASE
+                  for _, name in self.entries[lo:hi]}
+        if len(prefix) >= 2:
+            first_lo, first_hi = self.key_range(prefix[0].lower())
+            text = ''.join('\n' + name for _, name in self.entries[first_lo:lo]) + \
+                ''.join('\n' + name for _, name in self.entries[hi:first_hi])
+            levels.update((name, level) for level, name in self.scan_fuzzy(prefix, text))
+        return levels
+
+    def scan_fuzzy(self, prefix, text):
+        camel_pattern, subsequence_pattern = self.fuzzy_patterns(prefix)
+        candidates = subsequence_pattern.findall(text)
+        if not candidates:
+            return
+
+        # 驼峰匹配一定也是子序列匹配，只需在子序列的结果中再查找
+        camel_names = set(camel_pattern.findall(''.join('\n' + name for name in candidates)))
+        for name in candidates:
+            yield (self.MATCH_CAMEL_HUMP if name in camel_names else self.MATCH_SUBSEQUENCE), name
+
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def fuzzy_patterns(prefix):
+        chars = [(re.escape(ch.lower()), re.escape(ch.upper())) for ch in prefix]
+        first = f'[{chars[0][0]}{chars[0][1]}]'
+        # 驼峰：后续字符紧接上一个字符，或者是下一个单词的首字母（大写字母或 _ 之后）
+        camel = first + ''.join(f'(?:[{lower}{upper}]|[^\\n]*?(?:{upper}|_[{lower}{upper}]))'
+                                for lower, upper in chars[1:])
+        # 子序列：每个字符取其第一次出现的位置，用否定字符类避免回溯
+        subsequence = first + ''.join(f'[^\\n{lower}{upper}]*[{lower}{upper}]' for lower, upper in chars[1:])
+        # 以换行开头让正则引擎直接跳到每个名称的开头
+        return re.compile(f'\\n({camel}[^\\n]*)'), re.compile(f'\\n({subsequence}[^\\n]*)')
+
+
+class UserDefinitionIndex:
+    """按块（行）记录用户定义的名称，并维护每个名称的引用计数"""
+
+    FUNC_PATTERN = re.compile(r'def\s+(\w+)\s*\(')
+    CLASS_PATTERN = re.compile(r'class\s+(\w+)')
+    VAR_PATTERN = re.compile(r'^(\w+)\s*=')
+
+    def __init__(self):
+        # 第 i 项为第 i 块中定义的名称；空文档也有一个块
+        self.block_names = [()]
+        # 名称 -> 定义它的块数
+        self.counts = {}
+        # 当前所有名称的前缀索引
+        self.sorted_names = CompletionIndex()
+
+    def scan_line(self, line):
+        return tuple(self.FUNC_PATTERN.findall(line) + self.CLASS_PATTERN.findall(line) +
+                     self.VAR_PATTERN.findall(line))
+
+    def replace_blocks(self, first, last, lines):
+        """用 lines 替换原来第 first 到 last 块，只扫描这些行"""
+        new_names = [self.scan_line(line) for line in lines]
+
+        removed = []
+        for names in self.block_names[first:last + 1]:
+            for name in names:
+                count = self.counts[name] - 1
+                if count:
+                    self.counts[name] = count
+                else:
+                    del self.counts[name]
+                    removed.append(name)
+
+        added = []
+        for names in new_names:
+            for name in names:
+                count = self.counts.get(name, 0)
+                if not count:
+                    added.append(name)
+                self.counts[name] = count + 1
+
+        self.sorted_names.update(added, removed)
+        self.block_names[first:last + 1] = new_names
+
+    def rebuild(self, text):
+        self.block_names = []
+        self.counts = {}
+        self.sorted_names = CompletionIndex()
+        self.replace_blocks(0, -1, text.split('\n'))
+
+    def __contains__(self, name):
+        return name in self.counts
+
+    def __iter__(self):
+        return iter(self.counts)
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class ImportIndex(UserDefinitionIndex):
+    """按块记录 import / from 语句中出现的模块名"""
+
+    IMPORT_PATTERN = re.compile(r'import\s+(\w+)')
+    FROM_PATTERN = re.compile(r'^\s*from\s+(\w+)')
+
+    def scan_line(self, line):
+        return tuple(self.IMPORT_PATTERN.findall(line) + self.FROM_PATTERN.findall(line))
+
+
+class Scope:
+    """作用域：绑定的名称、行范围（从1开始）和子作用域"""
+
+    __slots__ = ('kind', 'name', 'start', 'end', 'names', 'attributes', 'children')
+
+    def __init__(self, kind, name, start, end):
+        self.kind = kind
+        self.name = name
+        self.start = start
+        self.end = end
+        self.names = set()
+        # 类作用域中记录方法里通过 self.x = ... 赋值的属性
+        self.attributes = set()
+        self.children = []
+
+    def shifted(self, offset):
+        scope = Scope(self.kind, self.name, self.start + offset, self.end + offset)
+        scope.names = self.names
+        scope.attributes = self.attributes
+        scope.children = [child.shifted(offset) for child in self.children]
+        return scope
+
+    def path_at(self, line):
+        """从本作用域到包含该行的最内层作用域"""
+        path = [self]
+        scope = self
+        while True:
+            for child in scope.children:
+                if child.start <= line <= child.end:
+                    path.append(child)
+                    scope = child
+                    break
+            else:
+                return path
+
+    @staticmethod
+    def visible_names(path):
+        names = set()
+        for i, scope in enumerate(path):
+            # 类体中的名称在方法内不可见，只有光标直接位于类体时才可见
+            if scope.kind != 'class' or i == len(path) - 1:
+                names |= scope.names
+        return names
+
+
+class ScopeBuilder(ast.NodeVisitor):
+    """遍历语法树，把名称绑定到所在的作用域"""
+
+    def __init__(self, module, lines):
+        self.lines = lines
+        self.stack = [module]
+        # 与 stack 对应：方法的第一个参数名（self / cls），其他作用域为 None
+        self.receivers = [None]
+
+    def bind(self, name):
+        self.stack[-1].names.add(name)
+
+    def push(self, kind, name, node, receiver=None):
+        scope = Scope(kind, name, node.lineno, node.end_lineno)
+        self.stack[-1].children.append(scope)
+        self.stack.append(scope)
+        self.receivers.append(receiver)
+        return scope
+
+    def pop(self, node=None):
+        scope = self.stack.pop()
+        self.receivers.pop()
+        if node is not None:
+            self.extend_end(scope, node.col_offset)
+
+    def extend_end(self, scope, column):
+        # 函数体后面的空行和缩进更深的行仍属于该作用域，方便在末尾继续输入
+        end = scope.end
+        while end < len(self.lines):
+            line = self.lines[end]
+            stripped = line.lstrip()
+            if stripped and len(line) - len(stripped) <= column:
+                break
+            end += 1
+        scope.end = end
+
+    def bind_arguments(self, args):
+        for arg in args.posonlyargs + args.args + args.kwonlyargs:
+            self.bind(arg.arg)
+        if args.vararg:
+            self.bind(args.vararg.arg)
+        if args.kwarg:
+            self.bind(args.kwarg.arg)
+
+    def visit_argument_defaults(self, args):
+        for default in args.defaults + [d for d in args.kw_defaults if d is not None]:
+            self.visit(default)
+
+    def visit_FunctionDef(self, node):
+        self.bind(node.name)
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        self.visit_argument_defaults(node.args)
+
+        receiver = None
+        positional = node.args.posonlyargs + node.args.args
+        if self.stack[-1].kind == 'class' and positional:
+            receiver = positional[0].arg
+
+        self.push('function', node.name, node, receiver)
+        self.bind_arguments(node.args)
+        for statement in node.body:
+            self.visit(statement)
+        self.pop(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self.visit_argument_defaults(node.args)
+        self.push('lambda', '', node)
+        self.bind_arguments(node.args)
+        self.visit(node.body)
+        self.pop()
+
+    def visit_ClassDef(self, node):
+        self.bind(node.name)
+        for child in node.decorator_list + node.bases + node.keywords:
+            self.visit(child)
+        self.push('class', node.name, node)
+        for statement in node.body:
+            self.visit(statement)
+        self.pop(node)
+
+    def visit_comprehension_scope(self, node, results):
+        # 第一个迭代对象在外层作用域中求值
+        self.visit(node.generators[0].iter)
+        self.push('comprehension', '', node)
+        for i, generator in enumerate(node.generators):
+            self.visit(generator.target)
+            if i:
+                self.visit(generator.iter)
+            for condition in generator.ifs:
+                self.visit(condition)
+        for result in results:
+            self.visit(result)
+        self.pop()
+
+    def visit_ListComp(self, node):
+        self.visit_comprehension_scope(node, [node.elt])
+
+    visit_SetComp = visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node):
+        self.visit_comprehension_scope(node, [node.key, node.value])
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Store):
+            self.bind(node.id)
+
+    def visit_Attribute(self, node):
+        # self.x = ... 记录为所在类的属性
+        if isinstance(node.ctx, ast.Store) and isinstance(node.value, ast.Name):
+            # 方法内嵌套函数中的 self 仍指向方法的第一个参数
+            for i in range(len(self.stack) - 1, 0, -1):
+                if self.receivers[i] is not None:
+                    if self.receivers[i] == node.value.id:
+                        self.stack[i - 1].attributes.add(node.attr)
+                    break
+        self.generic_visit(node)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.bind(alias.asname or alias.name.split('.')[0])
+
+    def visit_ImportFrom(self, node):
+        for alias in node.names:
+            if alias.name != '*':
+                self.bind(alias.asname or alias.name)
+
+    def visit_ExceptHandler(self, node):
+        if node.name:
+            self.bind(node.name)
+        self.generic_visit(node)
+
+    def visit_Global(self, node):
+        self.stack[0].names.update(node.names)
+
+    def visit_MatchAs(self, node):
+        if node.name:
+            self.bind(node.name)
+        self.generic_visit(node)
+
+    visit_MatchStar = visit_MatchAs
+
+    def visit_MatchMapping(self, node):
+        if node.rest:
+            self.bind(node.rest)
+        self.generic_visit(node)
+
+
+class SymbolAnalyzer:
+    """按顶层语句把文档分块，用 ast 分析每块的作用域；块的文本没有变化时直接复用上次的结果"""
+
+    # 这些行不会开始新的顶层语句：缩进行、空行、注释、右括号和 else / except 等子句
+    CONTINUATION_PATTERN = re.compile(r'[\s#)\]}]|(?:else|elif|except|finally)\b|$')
+    TRIPLE_QUOTE_PATTERN = re.compile(r"'''|\"\"\"")
+    # 一块无法解析时，最多把出错的行替换为 pass 的次数
+    MAX_REPAIRS = 3
+
+    def __init__(self):
+        # 块文本 -> 作用域（行号相对于块）
+        self.chunk_cache = {}
+        # 上一次分析的 (起始行, 作用域)，用于暂时无法解析的块
+        self.previous_chunks = []
+
+    @classmethod
+    def split_chunks(cls, lines):
+        """返回每个顶层语句块的起始行（从0开始）"""
+        starts = [0]
+        quote = None
+        joined = False
+        for i, line in enumerate(lines):
+            if i and quote is None and not joined and not cls.CONTINUATION_PATTERN.match(line):
+                starts.append(i)
+
+            for delimiter in cls.TRIPLE_QUOTE_PATTERN.findall(line):
+                if quote is None:
+                    quote = delimiter
+                elif quote == delimiter:
+                    quote = None
+            # 装饰器和反斜杠续行与下一行属于同一语句
+            joined = line.startswith('@') or line.endswith('\\')
+        return starts
+
+    def parse_chunk(self, source):
+        lines = source.split('\n')
+        for _ in range(self.MAX_REPAIRS + 1):
+            try:
+                tree = ast.parse('\n'.join(lines))
+            except SyntaxError as e:
+                # 正在输入的行通常不完整，替换为 pass 后再试
+                if not e.lineno or e.lineno > len(lines):
+                    return None
+                line = lines[e.lineno - 1]
+                repaired = line[:len(line) - len(line.lstrip())] + 'pass'
+                if line == repaired:
+                    return None
+                lines[e.lineno - 1] = repaired
+                continue
+            except ValueError:
+                return None
+
+            scope = Scope('module', '', 1, len(lines))
+            ScopeBuilder(scope, lines).visit(tree)
+            return scope
+        return None
+
+    def previous_chunk(self, start):
+        # 取起始行最接近的上一次结果
+        starts = [s for s, _ in self.previous_chunks]
+        i = bisect.bisect_right(starts, start) - 1
+        # 之前没有块从这里或更前面开始：不能拿无关语句的结果顶替
+        return self.previous_chunks[i] if i >= 0 else None
+
+    def analyze(self, text, cancelled=lambda: False):
+        """返回模块作用域；分析被取消时返回 None"""
+        lines = text.split('\n')
+        starts = self.split_chunks(lines)
+        module = Scope('module', '', 1, len(lines))
+        chunk_cache = {}
+        chunks = []
+
+        for i, start in enumerate(starts):
+            if cancelled():
+                return None
+
+            end = starts[i + 1] if i + 1 < len(starts) else len(lines)
+            source = '\n'.join(lines[start:end])
+            if source in self.chunk_cache:
+                scope = self.chunk_cache[source]
+            else:
+                scope = self.parse_chunk(source)
+            if scope is not None:
+                chunk_cache[source] = scope
+            else:
+                previous = self.previous_chunk(start)
+                if previous is None:
+                    continue
+                scope = previous[1]
+            chunks.append((start, scope))
+
+            module.names |= scope.names
+            module.children.extend(child.shifted(start) for child in scope.children)
+
+        self.chunk_cache = chunk_cache
+        self.previous_chunks = chunks
+        return module
+
+
+class SyntaxChecker:
+    """按顶层语句分块检查语法错误；块的文本没有变化时直接复用上次的结果
+
+    分块是按缩进的近似划分，顶格书写的括号续行会被错误地切开。相邻的出错块先合并后再检查，
+    中间最多隔 MERGE_GAP 个正常块，合并后没有错误就说明是切分造成的。
+    """
+
+    MERGE_GAP = 2
+
+    def __init__(self):
+        # 块文本 -> 语法错误 (行, 列, 结束行, 结束列, 信息)，行列相对于块；没有错误时为 None
+        self.chunk_cache = {}
+        # 没有语法错误的块文本 -> 编译阶段的错误，格式同上
+        self.compile_cache = {}
+
+    def check_source(self, source, cache):
+        if source in self.chunk_cache:
+            error = self.chunk_cache[source]
+        else:
+            error = self.parse_error(source)
+        cache[source] = error
+        return error
+
+    def check_compile(self, source, cache):
+        if source in self.compile_cache:
+            error = self.compile_cache[source]
+        else:
+            error = self.compile_error(source)
+        cache[source] = error
+        return error
+
+    @staticmethod
+    def error_position(e, source):
+        if not e.lineno:
+            # 例如源码中有空字符，没有位置信息
+            line = source.count('\n', 0, max(source.find('\0'), 0)) + 1
+            return line, 0, line, 0, e.msg
+        # offset 从 1 开始按字符计；结束位置可能缺失或不在开始位置之后
+        column = max((e.offset or 1) - 1, 0)
+        end_line = e.end_lineno or e.lineno
+        end_column = max((e.end_offset or 0) - 1, 0)
+        if (end_line, end_column) <= (e.lineno, column):
+            end_line, end_column = e.lineno, column + 1
+        return e.lineno, column, end_line, end_column, e.msg
+
+    @classmethod
+    def parse_error(cls, source):
+        try:
+            ast.parse(source)
+        except SyntaxError as e:
+            return cls.error_position(e, source)
+        except ValueError as e:
+            return 1, 0, 1, 0, str(e)
+        return None
+
+    @classmethod
+    def compile_error(cls, source):
+        """只做语法分析发现不了的错误，如 'return' outside function，与运行时一样编译才能发现"""
+        try:
+            # 编译时的警告不属于诊断，也不要打印出来
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                compile(source, '<editor>', 'exec', dont_inherit=True)
+        except SyntaxError as e:
+            return cls.error_position(e, source)
+        except ValueError as e:
+            return 1, 0, 1, 0, str(e)
+        return None
+
+    def analyze(self, text, cancelled=lambda: False):
+        """返回按位置排序的诊断列表 [(行, 列, 结束行, 结束列, 信息)]，行从 1、列从 0 开始；被取消时返回 None"""
+        lines = text.split('\n')
+        starts = SymbolAnalyzer.split_chunks(lines) + [len(lines)]
+        cache = {}
+        errors = []
+        for i in range(len(starts) - 1):
+            if cancelled():
+                return None
+            errors.append(self.check_source('\n'.join(lines[starts[i]:starts[i + 1]]), cache))
+
+        diagnostics = []
+        # 没有语法错误的块范围 (第一块, 最后一块)，之后再编译检查
+        clean = []
+        i = 0
+        while i < len(errors):
+            if errors[i] is None:
+                clean.append((i, i))
+                i += 1
+                continue
+            # 合并连续的出错块，以及间隔不超过 MERGE_GAP 的下一段出错块
+            last = i
+            while True:
+                while last + 1 < len(errors) and errors[last + 1] is not None:
+                    last += 1
+                if cancelled():
+                    return None
+                error = self.check_source('\n'.join(lines[starts[i]:starts[last + 1]]), cache)
+                following = [j for j in range(last + 1, min(last + 2 + self.MERGE_GAP, len(errors)))
+                             if errors[j] is not None]
+                if error is None or not following:
+                    break
+                merged = self.check_source('\n'.join(lines[starts[i]:starts[following[0] + 1]]), cache)
+                if merged is not None:
+                    break
+                error, last = None, following[0]
+            if error is None:
+                clean.append((i, last))
+                i = last + 1
+                continue
+            line, column, end_line, end_column, message = error
+            diagnostics.append((starts[i] + line, column, starts[i] + end_line, end_column, message))
+            # 合并进来的后续块可能本身没有错误，从出错位置所在块的下一块继续检查
+            i = max(bisect.bisect_right(starts, starts[i] + line - 1), i + 1)
+
+        # 编译阶段的错误不按位置先后报告，合并检查会漏掉，只在分好的块上逐个编译
+        compile_cache = {}
+        for first, last in clean:
+            if cancelled():
+                return None
+            error = self.check_compile('\n'.join(lines[starts[first]:starts[last + 1]]), compile_cache)
+            if error is not None:
+                line, column, end_line, end_column, message = error
+                diagnostics.append((starts[first] + line, column, starts[first] + end_line, end_column, message))
+        diagnostics.sort()
+
+        self.chunk_cache = cache
+        self.compile_cache = compile_cache
+        return diagnostics
+
+
+class DocumentAnalysisService(QObject):
+    """停止输入一段时间后在后台线程中用 analyzer 分析文档；新的输入会取消正在进行的分析
+
+    analyzer.analyze(text, cancelled) 返回结果，被取消时返回 None。
+    """
+
+    analysis_ready = pyqtSignal(object)
+    # 后台线程把 (编号, 结果) 交回界面线程，过期的结果在那里丢弃
+    result_ready = pyqtSignal(int, object)
+
+    DEBOUNCE_MS = 300
+
+    def __init__(self, document, analyzer, parent=None):
+        super().__init__(parent)
+        self.document = document
+        self.analyzer = analyzer
+        # 每次文本变化加一，后台线程发现编号过期就放弃当前分析
+        self.generation = 0
+        self.pending = None
+        self.condition = threading.Condition()
+        self.result_ready.connect(self.deliver)
+
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.timeout.connect(self.submit)
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def schedule(self):
+        self.generation += 1
+        self.debounce_timer.start(self.DEBOUNCE_MS)
+
+    def submit(self):
+        with self.condition:
+            self.pending = (self.generation, self.document.toPlainText())
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                generation, text = self.pending
+                self.pending = None
+
+            result = self.analyzer.analyze(text, lambda: generation != self.generation)
+            if result is None or generation != self.generation:
+                continue
+            try:
+                # 跨线程发射，结果通过排队连接在界面线程中处理
+                self.result_ready.emit(generation, result)
+            except RuntimeError:
+                return
+
+    def deliver(self, generation, result):
+        if generation == self.generation:
+            self.analysis_ready.emit(result)
+
+
+def scan_path_entry(path):
+    """不导入任何模块，列出 sys.path 中一项下的顶层模块及其一级子模块"""
+    modules = {}
+    for info in pkgutil.iter_modules([path]):
+        submodules = []
+        package_path = os.path.join(path, info.name)
+        if info.ispkg and os.path.isdir(package_path):
+            submodules = sorted(sub.name for sub in pkgutil.iter_modules([package_path])
+                                if not sub.name.startswith('_'))
+        modules[info.name] = submodules
+    return modules
+
+
+def path_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class ModuleCatalog(QObject):
+    """当前解释器可导入的模块目录：后台扫描 sys.path，缓存到磁盘，只重新扫描有变化的目录"""
+
+    catalog_changed = pyqtSignal()
+    # 扫描线程把结果交回GUI线程
+    scan_finished = pyqtSignal(object)
+
+    RESCAN_DELAY_MS = 1000
+
+    def __init__(self, cache_path=None, parent=None):
+        super().__init__(parent)
+        self.cache_path = cache_path or os.path.join(CONFIG_DIR, "module_catalog.json")
+        data = read_json(self.cache_path, {})
+        # sys.path 项 -> {"mtime", "modules": {顶层模块: [子模块]}}
+        self.entries = data.get('paths', {}) if data.get('executable') == sys.executable else {}
+        self.modules = {}
+        self.rebuild_modules()
+
+        self.scanning = False
+        self.changed_paths = set()
+        self.scan_finished.connect(self.apply_scan)
+
+        # site-packages 等目录变化（如 pip install）时增量重新扫描
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.on_directory_changed)
+        self.rescan_timer = QTimer(self)
+        self.rescan_timer.setSingleShot(True)
+        self.rescan_timer.timeout.connect(self.rescan_changed)
+
+        self.refresh(self.search_paths())
+
+    def search_paths(self):
+        ide_directory = os.path.dirname(WORKER_SCRIPT)
+        paths = []
+        for path in sys.path:
+            path = os.path.abspath(path or os.getcwd())
+            if path != ide_directory and path not in paths:
+                paths.append(path)
+        return paths
+
+    def rebuild_modules(self):
+        modules = {name: set() for name in sys.builtin_module_names}
+        for path in self.search_paths():
+            for name, submodules in self.entries.get(path, {}).get('modules', {}).items():
+                modules.setdefault(name, set()).update(submodules)
+        self.modules = modules
+
+    def top_level_names(self):
+        return list(self.modules)
+
+    def submodules(self, module_name):
+        return sorted(self.modules.get(module_name, ()))
+
+    def refresh(self, paths):
+        if self.scanning:
+            self.changed_paths.update(paths)
+            return
+        self.scanning = True
+        known = {path: self.entries.get(path, {}).get('mtime') for path in paths}
+        threading.Thread(target=self.scan, args=(known,), daemon=True).start()
+
+    def scan(self, known):
+        # 在后台线程中运行，只扫描修改时间变化的目录
+        changed = {}
+        for path, mtime in known.items():
+            current = path_mtime(path)
+            if current != mtime:
+                modules = scan_path_entry(path) if current is not None else {}
+                changed[path] = {'mtime': current, 'modules': modules}
+        self.scan_finished.emit(changed)
+
+    def apply_scan(self, changed):
+        self.scanning = False
+        watched = set(self.watcher.directories())
+        new_paths = [path for path in self.search_paths() if path not in watched and os.path.isdir(path)]
+        if new_paths:
+            self.watcher.addPaths(new_paths)
+
+        if changed:
+            self.entries.update(changed)
+            self.rebuild_modules()
+            try:
+                write_json_atomic(self.cache_path, {'executable': sys.executable, 'paths': self.entries})
+            except OSError:
+                pass
+            self.catalog_changed.emit()
+
+        if self.changed_paths:
+            paths, self.changed_paths = self.changed_paths, set()
+            self.refresh(paths)
+
+    def on_directory_changed(self, path):
+        self.changed_paths.add(path)
+        self.rescan_timer.start(self.RESCAN_DELAY_MS)
+
+    def rescan_changed(self):
+        if self.changed_paths and not self.scanning:
+            paths, self.changed_paths = self.changed_paths, set()
+            self.refresh(paths)
+
+
+class ModuleIntrospector(QObject):
+    """在子进程池中导入模块并列出成员，结果按 (模块名, 版本, 文件修改时间) 缓存到磁盘"""
+
+    members_ready = pyqtSignal(str)
+
+    POOL_SIZE = 2
+    TIMEOUT_MS = 10000
+    SAVE_DELAY_MS = 1000
+
+    def __init__(self, cache_path=None, parent=None):
+        super().__init__(parent)
+        self.cache_path = cache_path or os.path.join(CONFIG_DIR, "module_cache.json")
+        # 模块名 -> {"version", "mtime", "members"}
+        self.cache = read_json(self.cache_path, {})
+        # 本次运行中已经确认过缓存有效（或确认失败）的模块
+        self.validated = set()
+        self.pending = deque()
+        self.workers = []
+        self.enabled = os.path.exists(WORKER_SCRIPT) and not getattr(sys, 'frozen', False)
+
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.timeout.connect(self.save_cache)
+
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.shutdown)
+
+    def members(self, module_name):
+        """立即返回缓存的成员（可能为 None），需要时在后台获取或校验"""
+        entry = self.cache.get(module_name)
+        if module_name not in self.validated:
+            self.request(module_name)
+        return entry['members'] if entry else None
+
+    def request(self, module_name):
+        if not self.enabled:
+            return
+        if module_name in self.pending or any(w.module == module_name for w in self.workers):
+            return
+        self.pending.append(module_name)
+        self.dispatch()
+
+    def dispatch(self):
+        while self.pending:
+            worker = next((w for w in self.workers if w.module is None), None)
+            if worker is None:
+                if len(self.workers) >= self.POOL_SIZE:
+                    return
+                worker = self.start_worker()
+
+            module_name = self.pending.popleft()
+            entry = self.cache.get(module_name, {})
+            request = {'module': module_name, 'version': entry.get('version'), 'mtime': entry.get('mtime')}
+            worker.module = module_name
+            worker.write((json.dumps(request) + '\n').encode('utf-8'))
+            worker.timer.start(self.TIMEOUT_MS)
+
+    def start_worker(self):
+        worker = QProcess(self)
+        worker.setProcessChannelMode(QProcess.ProcessChannelMode.SeparateChannels)
+        worker.setStandardErrorFile(QProcess.nullDevice())
+        worker.readyReadStandardOutput.connect(lambda: self.read_replies(worker))
+        worker.finished.connect(lambda *args: self.discard_worker(worker))
+
+        worker.module = None
+        worker.timer = QTimer(self)
+        worker.timer.setSingleShot(True)
+        worker.timer.timeout.connect(lambda: self.discard_worker(worker))
+
+        worker.start(sys.executable, [WORKER_SCRIPT, "introspect"])
+        self.workers.append(worker)
+        return worker
+
+    def read_replies(self, worker):
+        while worker.canReadLine():
+            line = bytes(worker.readLine()).decode('utf-8', errors='replace')
+            try:
+                reply = json.loads(line)
+            except ValueError:
+                continue
+            worker.timer.stop()
+            worker.module = None
+            self.handle_reply(reply)
+        self.dispatch()
+
+    def handle_reply(self, reply):
+        module_name = reply['module']
+        self.validated.add(module_name)
+        if reply.get('unchanged'):
+            return
+
+        if 'members' in reply:
+            self.cache[module_name] = {
+                'version': reply.get('version'),
+                'mtime': reply.get('mtime'),
+                'members': reply['members'],
+            }
+        else:
+            self.cache.pop(module_name, None)
+        self.save_timer.start(self.SAVE_DELAY_MS)
+        self.members_ready.emit(module_name)
+
+    def discard_worker(self, worker):
+        """超时或意外退出：结束进程，当前模块本次运行不再尝试"""
+        if worker not in self.workers:
+            return
+        self.workers.remove(worker)
+        worker.timer.stop()
+        if worker.module:
+            self.validated.add(worker.module)
+        worker.kill()
+        worker.deleteLater()
+        self.dispatch()
+
+    def save_cache(self):
+        try:
+            write_json_atomic(self.cache_path, self.cache)
+        except OSError:
+            pass
+
+    def shutdown(self):
+        # 关闭标准输入让工作进程自行退出，超时再强制结束
+        for worker in self.workers:
+            worker.finished.disconnect()
+            worker.timer.stop()
+            worker.closeWriteChannel()
+            if not worker.waitForFinished(500):
+                worker.kill()
+                worker.waitForFinished(500)
+        self.workers.clear()
+        self.pending.clear()
+
+        if self.save_timer.isActive():
+            self.save_timer.stop()
+            self.save_cache()
+
+
 class CodeCompleter:
+    # 光标前的行内容：import a, b, / from
+    IMPORT_CONTEXT_PATTERN = re.compile(r'^\s*(?:import\s+(?:[\w.]+\s*,\s*)*|from\s+)$')
+    # 光标前的行内容：from x import / from x import (a, b,
+    FROM_IMPORT_PATTERN = re.compile(r'^\s*from\s+([\w.]+)\s+import\s+\(?\s*(?:\w+\s*,\s*)*$')
+
     def __init__(self):
         self.keywords = set(keyword.kwlist)
         self.builtins = set(dir(builtins))
-        self.common_modules = {
-            'os', 'sys', 're', 'json', 'time', 'datetime', 'math',
-            'random', 'requests', 'numpy', 'pandas', 'matplotlib'
-        }
-        self.user_definitions = set()
+        # 用户定义和导入模块索引，由编辑器按变化的块增量更新
+        self.user_definitions = UserDefinitionIndex()
+        self.imports = ImportIndex()
+        # 关键字和内置名称的前缀索引只需构建一次
+        self.static_index = CompletionIndex(self.keywords | self.builtins)
+        self.member_indexes = {}
+        self.max_completions = 15
+
+        # 已安装模块目录，用于 import / from 补全和包的子模块
+        self.module_catalog = ModuleCatalog()
+        self.catalog_index = CompletionIndex(self.module_catalog.top_level_names())
+        self.module_catalog.catalog_changed.connect(self.on_catalog_changed)
+
+        # 模块成员在子进程中获取，结果到达后清除对应的缓存
+        self.introspector = ModuleIntrospector()
+        self.introspector.members_ready.connect(self.forget_module_members)
 
         # 模块成员缓存
         self.module_members = {}
 
-    def get_completions(self, text, prefix):
+        # 后台作用域分析的结果；没有结果时退回到按行扫描的用户定义
+        self.scope_tree = None
+        # 最内层作用域 -> (可见名称, 前缀索引)
+        self.scope_indexes = {}
+        self.visible_names = set()
+
+    def get_completions(self, prefix, line_prefix='', line=None):
         if not prefix:
             return []
-
-        completions = []
+        indexes, head, member_prefix = self.completion_sources(prefix, line_prefix, line)
+        return [head + name for name in self.rank_matches(indexes, member_prefix)]
+
+    def start_session(self, prefix, line_prefix='', line=None):
+        """开始一次补全：取出与 prefix 首字母相同的全部候选，之后继续输入时只在其中筛选"""
+        indexes, head, member_prefix = self.completion_sources(prefix, line_prefix, line)
+        return CompletionSession(self, indexes, head, member_prefix)
+
+    def completion_sources(self, prefix, line_prefix='', line=None):
+        """返回 (候选索引列表, 补全结果的固定前缀, 用于匹配的部分)"""
+        # import x / from x：只补全模块名
+        if self.IMPORT_CONTEXT_PATTERN.match(line_prefix):
+            if '.' in prefix:
+                package, _, sub_prefix = prefix.rpartition('.')
+                return [CompletionIndex(self.module_catalog.submodules(package))], package + '.', sub_prefix
+            return [self.catalog_index], '', prefix
+
+        # from x import y：补全模块 x 的成员和子模块
+        from_match = self.FROM_IMPORT_PATTERN.match(line_prefix)
+        if from_match:
+            return [self.get_member_index(from_match.group(1), is_module=True)], '', prefix
 
         # 检查是否在模块访问中 (如 time.sleep)
         if '.' in prefix:
-            parts = prefix.split('.')
-            if len(parts) == 2:
-                module_prefix, member_prefix = parts
-                members = self.get_module_members(module_prefix, text)
-                completions.extend([f"{module_prefix}.{m}" for m in members if m.startswith(member_prefix)])
-                return completions[:15]
-
-        # 普通补全
-        completions.extend([kw for kw in self.keywords if kw.lower().startswith(prefix.lower())])
-        completions.extend([func for func in self.builtins if func.lower().startswith(prefix.lower())])
-        completions.extend([mod for mod in self.common_modules if mod.lower().startswith(prefix.lower())])
-        completions.extend([defn for defn in self.user_definitions if defn.lower().startswith(prefix.lower())])
-
-        # 从导入语句中获取模块
-        import_pattern = r'import\s+(\w+)|\s+from\s+(\w+)'
-        imports = re.findall(import_pattern, text)
-        for imp in imports:
-            module_name = imp[0] or imp[1]
-            if module_name and module_name.lower().startswith(prefix.lower()):
-                completions.append(module_name)
-
-        return list(set(completions))[:15]
-
-    def get_module_members(self, module_name, text):
+            module_prefix, _, member_prefix = prefix.rpartition('.')
+            index = self.get_attribute_index(module_prefix, line)
+            if index is None:
+                index = self.get_member_index(module_prefix)
+            return [index], module_prefix + '.', member_prefix
+
+        # 普通补全：有作用域分析结果时只提供光标处可见的名称
+        if self.scope_tree is not None and line is not None:
+            return [self.get_scope_index(line), self.static_index], '', prefix
+        return [self.user_definitions.sorted_names, self.static_index, self.imports.sorted_names], '', prefix
+
+    def rank_matches(self, indexes, prefix):
+        """合并各索引的匹配结果，先排序再截断"""
+        best = {}
+        for index in indexes:
+            for level, name in index.search(prefix):
+                if name not in best or level < best[name]:
+                    best[name] = level
+
+        # 模糊匹配排在前缀匹配之后，前缀匹配已经足够时不再查找
+        if len(best) < self.max_completions:
+            for index in indexes:
+                for level, name in index.fuzzy_search(prefix):
+                    if name not in best:
+                        best[name] = level
+
+        # 排序：匹配等级 > 来源（用户定义 > 关键字 > 内置 > 模块） > 长度
+        def sort_key(name):
+            return best[name], self.source_rank(name), len(name), name.lower()
+
+        return heapq.nsmallest(self.max_completions, best, key=sort_key)
+
+    def source_rank(self, name):
+        if name in self.visible_names or name in self.user_definitions:
+            return 0
+        if name in self.keywords:
+            return 1
+        if name in self.builtins:
+            return 2
+        return 3
+
+    def set_scope_tree(self, tree):
+        self.scope_tree = tree
+        self.scope_indexes = {}
+
+    def get_scope_index(self, line):
+        path = self.scope_tree.path_at(line)
+        key = id(path[-1])
+        if key not in self.scope_indexes:
+            names = Scope.visible_names(path)
+            self.scope_indexes[key] = (names, CompletionIndex(names))
+        self.visible_names, index = self.scope_indexes[key]
+        return index
+
+    def get_attribute_index(self, receiver, line):
+        """方法内 self. 补全所在类的方法和属性，不是这种情况时返回 None"""
+        if self.scope_tree is None or line is None or '.' in receiver:
+            return None
+        path = self.scope_tree.path_at(line)
+        for i in range(len(path) - 1, 0, -1):
+            if path[i].kind == 'function' and path[i - 1].kind == 'class':
+                if receiver not in ('self', 'cls'):
+                    return None
+                cls = path[i - 1]
+                key = ('attributes', id(cls))
+                if key not in self.scope_indexes:
+                    self.scope_indexes[key] = CompletionIndex(cls.names | cls.attributes)
+                return self.scope_indexes[key]
+        return None
+
+    def get_member_index(self, module_name, is_module=False):
+        if module_name not in self.member_indexes:
+            self.member_indexes[module_name] = CompletionIndex(self.get_module_members(module_name, is_module))
+        return self.member_indexes[module_name]
+
+    def get_module_members(self, module_name, is_module=False):
         if module_name in self.module_members:
             return self.module_members[module_name]
 
-        members = []
-        try:
-            # 检查是否是已导入的模块
-            import_pattern = rf'import\s+{module_name}|\s+from\s+{module_name}\s+import'
-            if re.search(import_pattern, text):
-                try:
-                    module = __import__(module_name)
-                    members = [attr for attr in dir(module) if not attr.startswith('_')]
-                except:
-                    pass
-        except:
-            pass
-
-        # 为常见模块添加默认成员
-        if module_name == 'time' and not members:
-            members = ['sleep', 'time', 'ctime', 'gmtime', 'localtime', 'mktime', 'strftime', 'strptime']
-        elif module_name == 'os' and not members:
-            members = ['path', 'listdir', 'mkdir', 'remove', 'rename', 'system']
-        elif module_name == 'sys' and not members:
-            members = ['argv', 'exit', 'path', 'stdout', 'stderr', 'stdin']
+        # 包的子模块直接来自模块目录；已导入模块的成员在子进程中获取，尚未获取到时为空
+        members = set(self.module_catalog.submodules(module_name))
+        if is_module or module_name.split('.')[0] in self.imports:
+            members.update(self.introspector.members(module_name) or [])
 
         self.module_members[module_name] = members
         return members
 
+    def forget_module_members(self, module_name):
+        self.module_members.pop(module_name, None)
+        self.member_indexes.pop(module_name, None)
+
+    def on_catalog_changed(self):
+        self.catalog_index = CompletionIndex(self.module_catalog.top_level_names())
+        self.module_members.clear()
+        self.member_indexes.clear()
+
     def update_user_definitions(self, text):
-        self.user_definitions.clear()
+        self.user_definitions.rebuild(text)
+        self.imports.rebuild(text)
+
+    def update_user_definition_blocks(self, first, last, lines):
+        self.user_definitions.replace_blocks(first, last, lines)
+        self.imports.replace_blocks(first, last, lines)
+
+
+class CompletionSession:
+    """一次补全过程的候选集合
+
+    所有匹配方式（前缀、驼峰、子序列）都要求首字母相同，所以开始时取出首字母相同的全部候选，
+    之后继续输入的字符只在这个小索引中筛选，不再查询作用域和模块索引。
+    排序键中除匹配等级外的部分（来源、长度、名称）在一次补全中不变，开始时排好一次，
+    之后按匹配等级分桶即可得到与 CodeCompleter.rank_matches 相同的顺序。
+    """
 
-        func_pattern = r'def\s+(\w+)\s*\('
-        functions = re.findall(func_pattern, text)
-        self.user_definitions.update(functions)
+    LEVELS = 4
+
+    def __init__(self, completer, indexes, head, member_prefix):
+        self.completer = completer
+        self.head = head
+        self.first = member_prefix[:1].lower()
+        names = set()
+        for index in indexes:
+            names.update(name for _, name in index.search(self.first))
+        self.index = CompletionIndex(names)
+        self.ordered = sorted(names, key=lambda name: (completer.source_rank(name), len(name), name.lower()))
+
+    def accepts(self, head, member_prefix):
+        return head == self.head and (not self.first or member_prefix[:1].lower() == self.first)
+
+    def completions(self, member_prefix):
+        """返回全部匹配（包括模糊匹配），已排好序"""
+        best = self.index.match_levels(member_prefix)
+        buckets = [[] for _ in range(self.LEVELS)]
+        for name in self.ordered:
+            level = best.get(name)
+            if level is not None:
+                buckets[level].append(self.head + name)
+        return [completion for bucket in buckets for completion in bucket]
+
+
+class CompletionModel(QStringListModel):
+    """补全弹窗的数据；视图只向模型获取可见的行
+
+    rowCount/data 留在 C++ 中实现，视图布局时逐行查询行数不会回调到 Python。
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
 
-        class_pattern = r'class\s+(\w+)'
-        classes = re.findall(class_pattern, text)
-        self.user_definitions.update(classes)
+    def set_rows(self, rows):
+        self.rows = rows
+        self.setStringList(rows)
 
-        var_pattern = r'^(\w+)\s*='
-        variables = re.findall(var_pattern, text, re.MULTILINE)
-        self.user_definitions.update(variables)
 
+class CompletionPopup(QListView):
+    completion_chosen = pyqtSignal(str)
 
-class CompletionPopup(QListWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowFlags(Qt.WindowType.Popup | Qt.WindowType.FramelessWindowHint | Qt.WindowType.Tool)
@@ -261,28 +1511,51 @@ class CompletionPopup(QListWidget):
         self.setFixedWidth(300)
         self.setFixedHeight(200)
 
+        # 行高相同，视图不需要逐行测量，长列表也只绘制可见的行
+        self.setUniformItemSizes(True)
+        self.completion_model = CompletionModel(self)
+        self.setModel(self.completion_model)
+        self.clicked.connect(lambda index: self.completion_chosen.emit(self.completion_model.rows[index.row()]))
+
         # 暗黑主题样式
         self.setStyleSheet("""
-            QListWidget {
+            QListView {
                 background-color: #2b2b2b;
                 border: 1px solid #444;
                 font-family: Consolas;
                 font-size: 11pt;
                 color: #e0e0e0;
             }
-            QListWidget::item {
+            QListView::item {
                 padding: 4px;
                 border-bottom: 1px solid #444;
             }
-            QListWidget::item:selected {
+            QListView::item:selected {
                 background-color: #3c3c3c;
                 color: #ffffff;
             }
-            QListWidget::item:hover {
+            QListView::item:hover {
                 background-color: #3a3a3a;
             }
         """)
 
+    def count(self):
+        return len(self.completion_model.rows)
+
+    def set_completions(self, completions):
+        self.completion_model.set_rows(completions)
+        if completions:
+            self.setCurrentIndex(self.completion_model.index(0))
+
+    def current_completion(self):
+        index = self.currentIndex()
+        return self.completion_model.rows[index.row()] if index.isValid() else None
+
+    def move_selection(self, delta):
+        row = self.currentIndex().row() + delta
+        if 0 <= row < self.count():
+            self.setCurrentIndex(self.completion_model.index(row))
+
     def showEvent(self, event):
         super().showEvent(event)
         self.clearFocus()
@@ -291,22 +1564,276 @@ class CompletionPopup(QListWidget):
         pass
 
 
+class CursorContext:
+    """光标处的编辑上下文，只读取光标所在的块和上一块的词法状态，代价与文档大小无关"""
+
+    CLOSED_STRING_PATTERN = re.compile(
+        r"""[rRbBuUfF]{0,2}(?:'[^'\\]*(?:\\.[^'\\]*)*'|"[^"\\]*(?:\\.[^"\\]*)*")""")
+
+    def __init__(self, cursor, tokenizer):
+        self.cursor = cursor
+        self.block = cursor.block()
+        self.line = self.block.text()
+        self.tokenizer = tokenizer
+        # positionInBlock 以 UTF-16 单元计，行中有 BMP 以外的字符时要换算成下标
+        units = cursor.positionInBlock()
+        if len(self.line) != utf16_length(self.line):
+            units = len(self.line.encode('utf-16-le', 'surrogatepass')[:units * 2].decode('utf-16-le', 'surrogatepass'))
+        self.column = units
+        self.line_prefix = self.line[:self.column]
+        self.line_suffix = self.line[self.column:]
+
+    def word_start(self):
+        """光标前由字母、数字、下划线和点组成的单词在行中的起始下标"""
+        start = self.column
+        while start > 0 and (self.line[start - 1].isalnum() or self.line[start - 1] in '_.'):
+            start -= 1
+        return start
+
+    def word(self):
+        return self.line[self.word_start():self.column]
+
+    def indent(self):
+        prefix = self.line_prefix
+        return prefix[:len(prefix) - len(prefix.lstrip(' \t'))]
+
+    def in_string_or_comment(self):
+        # 从上一块结束时的词法状态开始，只分析本行光标前的部分
+        state = self.block.previous().userState()
+        if state < 0:
+            state = PythonTokenizer.STATE_NORMAL
+        tokens, end_state = self.tokenizer.tokenize(self.line_prefix, state)
+        if end_state != PythonTokenizer.STATE_NORMAL:
+            return True
+        if not tokens:
+            return False
+        start, length, token_type = tokens[-1]
+        if start + length != self.column:
+            return False
+        if token_type == 'comment':
+            return True
+        if token_type == 'string':
+            return not self.CLOSED_STRING_PATTERN.fullmatch(self.line_prefix, start)
+        return False
+
+
+class BlockHashIndex:
+    """按块记录内容哈希，判断文档相对上次保存是否有修改，不需要比较整个文本
+
+    各块哈希之和随修改增量更新，和与保存时不同就一定有修改；
+    相同时再按顺序比较哈希列表，排除交换行之类和相同的修改。
+    """
+
+    MASK = (1 << 64) - 1
+
+    def __init__(self):
+        self.block_hashes = [self.hash_line("")]
+        self.total = self.block_hashes[0]
+        # 保存时的 (哈希之和, 哈希列表)，从未保存时为 None
+        self.saved = None
+
+    @staticmethod
+    def hash_line(line):
+        digest = hashlib.blake2b(line.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+
+    def replace_blocks(self, first, last, lines):
+        new_hashes = [self.hash_line(line) for line in lines]
+        self.total = (self.total - sum(self.block_hashes[first:last + 1]) + sum(new_hashes)) & self.MASK
+        self.block_hashes[first:last + 1] = new_hashes
+
+    def snapshot(self):
+        return self.total, list(self.block_hashes)
+
+    def mark_saved(self, snapshot=None):
+        self.saved = snapshot or self.snapshot()
+
+    def is_modified(self):
+        if self.saved is None:
+            return True
+        total, hashes = self.saved
+        if total != self.total or len(hashes) != len(self.block_hashes):
+            return True
+        return hashes != self.block_hashes
+
+
+class EditorGutter(QWidget):
+    """编辑器左侧按行绘制的栏，随编辑器滚动"""
+
+    def __init__(self, editor):
+        super().__init__(editor)
+        self.editor = editor
+
+    def on_update_request(self, rect, dy):
+        if dy:
+            self.scroll(0, dy)
+        else:
+            self.update(0, rect.y(), self.width(), rect.height())
+
+    def line_at(self, y):
+        return self.editor.cursorForPosition(QPoint(0, y)).blockNumber() + 1
+
+    def visible_lines(self, rect):
+        """产生与 rect 相交的可见块的 (行号, 块在本栏中的矩形)"""
+        block = self.editor.firstVisibleBlock()
+        top = self.editor.blockBoundingGeometry(block).translated(self.editor.contentOffset()).top()
+        while block.isValid() and top <= rect.bottom():
+            height = self.editor.blockBoundingRect(block).height()
+            if block.isVisible():
+                yield block.blockNumber() + 1, QRectF(0, top, self.width(), height)
+            top += height
+            block = block.next()
+
+
+class HeatGutter(EditorGutter):
+    """编辑器左侧的逐行热度栏：颜色深浅表示耗时，数字表示执行次数（只采样时为采样次数，带 ~）"""
+
+    def __init__(self, editor):
+        super().__init__(editor)
+        self.hits = {}
+        self.times = {}
+        self.exact = True
+        self.max_time = 0.0
+        self.block_count = 0
+
+    def gutter_width(self):
+        return self.fontMetrics().horizontalAdvance("~9999.9k") + 8
+
+    def set_heat(self, hits, times, exact=True):
+        self.hits = hits
+        self.times = times
+        self.exact = exact
+        self.max_time = max(times.values(), default=0.0)
+        self.block_count = self.editor.blockCount()
+        self.update()
+
+    @staticmethod
+    def format_count(count):
+        if count >= 1000000:
+            return f"{count / 1000000:.1f}M"
+        if count >= 1000:
+            return f"{count / 1000:.1f}k"
+        return str(count)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(event.rect(), self.palette().color(QPalette.ColorRole.Base))
+        for line, rect in self.visible_lines(event.rect()):
+            if line not in self.hits:
+                continue
+            if self.max_time > 0:
+                # 平方根让少量耗时的行也能看出颜色
+                intensity = (self.times.get(line, 0.0) / self.max_time) ** 0.5
+                painter.fillRect(rect, QColor(255, 80, 0, int(40 + 200 * intensity)))
+            painter.setPen(self.palette().color(QPalette.ColorRole.Text))
+            painter.drawText(rect.adjusted(0, 0, -4, 0),
+                             Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter,
+                             ("" if self.exact else "~") + self.format_count(self.hits[line]))
+
+    def event(self, event):
+        if event.type() == QEvent.Type.ToolTip:
+            line = self.line_at(event.pos().y())
+            if line in self.hits:
+                count = f"执行 {self.hits[line]} 次" if self.exact else f"采样到 {self.hits[line]} 次（估计）"
+                QToolTip.showText(event.globalPos(),
+                                  f"第 {line} 行: {count}，约 {self.times.get(line, 0.0) * 1000:.1f} ms", self)
+            else:
+                QToolTip.hideText()
+            return True
+        return super().event(event)
+
+
+class DiagnosticGutter(EditorGutter):
+    """编辑器最左侧的语法错误标记栏，悬停显示错误信息"""
+
+    MARKER_COLOR = QColor("#FF4040")
+
+    def gutter_width(self):
+        return self.fontMetrics().height()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(event.rect(), self.palette().color(QPalette.ColorRole.Base))
+        lines = self.editor.diagnostic_lines()
+        if not lines:
+            return
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(self.MARKER_COLOR)
+        for line, rect in self.visible_lines(event.rect()):
+            if line in lines:
+                size = min(rect.height(), self.width()) * 0.5
+                painter.drawEllipse(QRectF(rect.center().x() - size / 2, rect.center().y() - size / 2, size, size))
+
+    def event(self, event):
+        if event.type() == QEvent.Type.ToolTip:
+            messages = self.editor.diagnostic_lines().get(self.line_at(event.pos().y()))
+            if messages:
+                QToolTip.showText(event.globalPos(), '\n'.join(messages), self)
+            else:
+                QToolTip.hideText()
+            return True
+        return super().event(event)
+
+
 class CodeEditor(QPlainTextEdit):
+    # 文档相对上次保存是否有修改，只在状态变化时发出
+    modification_changed = pyqtSignal(bool)
+    # 文本修改：位置、删除的字符数、插入的文本（位置和字符数以 UTF-16 单元计，与 QTextDocument 一致）
+    text_edited = pyqtSignal(int, int, str)
+
+    # 超过该行数的粘贴和 setPlainText 自动作为批量编辑：延迟高亮，索引在修改结束后分批追赶
+    BULK_EDIT_THRESHOLD = 5000
+    # 追赶索引时每批处理的块数和每次定时器触发最多占用的时间（秒）
+    INDEX_BATCH_BLOCKS = 500
+    INDEX_TIME_SLICE = 0.01
+    # 可见区域上下额外立即高亮的行数
+    VIEWPORT_MARGIN = 100
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent = parent
         self.setFont(QFont("Consolas", 11))
         self.highlighter = PythonSyntaxHighlighter(self.document())
 
+        # 大文件先高亮可见区域，其余部分在事件循环空闲时分批高亮
+        self.lazy_highlighting = True
+        self.verticalScrollBar().valueChanged.connect(self.highlight_viewport)
+
         # 创建补全弹窗
         self.completion_popup = CompletionPopup(self)
-        self.completion_popup.itemClicked.connect(self.apply_completion)
+        self.completion_popup.completion_chosen.connect(self.apply_completion)
         self.completion_popup.hide()
+        # 当前补全过程：(光标所在块, 单词起始列, 单词前的文本, CompletionSession)
+        self.completion_session = None
 
         self.code_completer = CodeCompleter()
+        self.code_completer.introspector.members_ready.connect(self.on_module_members_ready)
+
+        # 作用域分析在后台线程中进行，结果到达后更新补全器
+        self.symbol_analysis = DocumentAnalysisService(self.document(), SymbolAnalyzer(), self)
+        self.symbol_analysis.analysis_ready.connect(self.code_completer.set_scope_tree)
+
+        # 语法检查同样在后台进行，错误显示为波浪线和最左侧的标记
+        self.syntax_check = DocumentAnalysisService(self.document(), SyntaxChecker(), self)
+        self.syntax_check.analysis_ready.connect(self.set_diagnostics)
+        # [(覆盖出错位置的 QTextCursor, 信息)]，光标随编辑移动，新结果到达前位置仍然对应
+        self.diagnostics = []
+        self.diagnostic_format = QTextCharFormat()
+        self.diagnostic_format.setUnderlineStyle(QTextCharFormat.UnderlineStyle.WaveUnderline)
+        self.diagnostic_format.setUnderlineColor(DiagnosticGutter.MARKER_COLOR)
+        self.diagnostic_gutter = DiagnosticGutter(self)
+        self.updateRequest.connect(self.diagnostic_gutter.on_update_request)
+
+        # 热度运行的逐行统计显示在错误标记右侧，没有结果时隐藏
+        self.heat_gutter = HeatGutter(self)
+        self.heat_gutter.hide()
+        self.updateRequest.connect(self.heat_gutter.on_update_request)
+        self.update_gutters()
 
         # 连接文本变化信号
         self.textChanged.connect(self.on_text_changed)
+        self.document().contentsChange.connect(self.on_contents_change)
 
         # 设置定时器用于延迟触发补全
         self.completion_timer = QTimer()
@@ -317,15 +1844,342 @@ class CodeEditor(QPlainTextEdit):
         self.tab_just_used = False
         # 防止重复缩进标志
         self.colon_just_processed = False
+        # 正在分块载入文件
+        self.loading = False
+        # 批量编辑的嵌套层数；批量编辑期间不逐次更新高亮和索引
+        self.bulk_depth = 0
+        # 索引尚未更新的块：(第一块, 其后未受影响的块数)，后面的块随修改移动时仍然有效
+        self.stale_blocks = None
+        # 追赶期间调用了 mark_saved，追赶完成后再记录保存状态
+        self.saved_after_catch_up = False
+        # 载入结束后等待索引追赶完成才取消只读
+        self.loading_read_only = False
+        self.index_timer = QTimer(self)
+        self.index_timer.setInterval(0)
+        self.index_timer.timeout.connect(lambda: self.catch_up_stale_blocks(self.INDEX_TIME_SLICE))
+        # 按块的内容哈希，用于判断是否有未保存的修改；启动时的空文档视为已保存
+        self.block_hashes = BlockHashIndex()
+        self.block_hashes.mark_saved()
+        self.modified = False
+
+    def setPlainText(self, text):
+        if text.count('\n') >= self.BULK_EDIT_THRESHOLD:
+            with self.bulk_edit():
+                super().setPlainText(text)
+        else:
+            self.highlighter.stop_lazy()
+            super().setPlainText(text)
+
+    def insertFromMimeData(self, source):
+        # 粘贴和拖放大段文本时走批量编辑
+        if source.hasText() and source.text().count('\n') >= self.BULK_EDIT_THRESHOLD:
+            with self.bulk_edit():
+                super().insertFromMimeData(source)
+        else:
+            super().insertFromMimeData(source)
+
+    @contextlib.contextmanager
+    def bulk_edit(self):
+        """批量编辑事务，可以嵌套：
+
+            with editor.bulk_edit():
+                ...  # 多次修改文档
+
+        期间只高亮已高亮过的块和可见区域，不更新补全索引和修改状态，也不触发补全；
+        结束后可见区域立即高亮，其余块的高亮和受影响范围的索引在事件循环空闲时分批完成。
+        text_edited 信号照常逐次发出。
+        """
+        self.begin_bulk_edit()
+        try:
+            yield
+        finally:
+            self.end_bulk_edit()
+
+    def begin_bulk_edit(self):
+        self.bulk_depth += 1
+        if self.bulk_depth > 1:
+            return
+        self.completion_timer.stop()
+        self.completion_popup.hide()
+        if self.lazy_highlighting and not self.highlighter.lazy_active:
+            self.highlighter.start_lazy()
+
+    def end_bulk_edit(self):
+        self.bulk_depth -= 1
+        if self.bulk_depth:
+            return
+        self.schedule_analysis()
+        if self.stale_blocks is not None:
+            self.index_timer.start()
+        if self.highlighter.lazy_active:
+            self.highlight_viewport()
+            self.highlighter.lazy_timer.start()
+
+    def mark_blocks_stale(self, first, last):
+        """记录第 first 到 last 块（修改后的块号）的索引需要更新，与尚未追赶的范围合并"""
+        tail = self.blockCount() - 1 - last
+        if self.stale_blocks is not None:
+            first = min(first, self.stale_blocks[0])
+            tail = min(tail, self.stale_blocks[1])
+        self.stale_blocks = (first, tail)
+
+    def catch_up_stale_blocks(self, time_slice=None):
+        """更新过期块的补全索引和内容哈希；time_slice 为 None 时一次做完"""
+        deadline = None if time_slice is None else time.perf_counter() + time_slice
+        while self.stale_blocks is not None:
+            first, tail = self.stale_blocks
+            # 索引中过期的旧条目数和文档中待扫描的块数
+            old_count = len(self.block_hashes.block_hashes) - tail - first
+            new_count = self.blockCount() - tail - first
+            if old_count <= 0 and new_count <= 0:
+                self.finish_catch_up()
+                return
+
+            # 每批用最多 INDEX_BATCH_BLOCKS 个新块替换同样多的旧条目，多出的旧条目最后删除
+            lines = []
+            block = self.document().findBlockByNumber(first)
+            while block.isValid() and len(lines) < min(new_count, self.INDEX_BATCH_BLOCKS):
+                lines.append(block.text())
+                block = block.next()
+            last = first + min(old_count, self.INDEX_BATCH_BLOCKS) - 1
+            self.code_completer.update_user_definition_blocks(first, last, lines)
+            self.block_hashes.replace_blocks(first, last, lines)
+            self.stale_blocks = (first + len(lines), tail)
+
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+
+    def finish_catch_up(self):
+        self.stale_blocks = None
+        self.index_timer.stop()
+        if self.saved_after_catch_up:
+            self.saved_after_catch_up = False
+            self.block_hashes.mark_saved()
+        if self.loading_read_only:
+            self.loading_read_only = False
+            self.setReadOnly(False)
+        self.update_modified()
+
+    def flush_stale_blocks(self):
+        """立即完成索引追赶，之后 block_hashes 和 modified 与文档一致"""
+        if self.stale_blocks is not None:
+            self.catch_up_stale_blocks()
+
+    def begin_load(self):
+        """开始分块载入：清空文档，载入期间只读、不记录撤销；整个载入是一次批量编辑"""
+        self.loading = True
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        self.clear_heat()
+        self.begin_bulk_edit()
+        QPlainTextEdit.setPlainText(self, "")
+
+    def restart_load(self):
+        """载入中途换用其他编码重新读取：清空已载入的部分，仍在同一次载入中"""
+        QPlainTextEdit.setPlainText(self, "")
+
+    def append_loaded_text(self, text):
+        cursor = QTextCursor(self.document())
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.insertText(text)
+        self.highlight_viewport()
+
+    def end_load(self):
+        self.loading = False
+        self.setUndoRedoEnabled(True)
+        self.moveCursor(QTextCursor.MoveOperation.Start)
+        self.end_bulk_edit()
+        # 索引追赶完成前保持只读，载入后的 mark_saved 才能在追赶完成时准确记录
+        if self.stale_blocks is None:
+            self.setReadOnly(False)
+        else:
+            self.loading_read_only = True
+
+    def highlight_viewport(self):
+        if not self.highlighter.lazy_active:
+            return
+
+        first = self.firstVisibleBlock().blockNumber()
+        visible = self.viewport().height() // max(1, self.fontMetrics().height())
+        start = max(0, first - self.VIEWPORT_MARGIN)
+        end = first + visible + self.VIEWPORT_MARGIN
+        self.highlighter.visible_window = (start, end)
+        self.highlighter.highlight_range(start, end)
+
+    def set_heat(self, hits, times, exact=True):
+        """显示逐行热度，hits 和 times 以行号（从 1 开始）为键；exact 为假时 hits 是采样次数"""
+        self.heat_gutter.set_heat(hits, times, exact)
+        if self.heat_gutter.isHidden():
+            self.heat_gutter.show()
+            self.update_gutters()
+
+    def clear_heat(self):
+        if self.heat_gutter.isHidden():
+            return
+        self.heat_gutter.hide()
+        self.heat_gutter.set_heat({}, {})
+        self.update_gutters()
+
+    def update_gutters(self):
+        """左侧依次是错误标记栏和（有结果时）热度栏"""
+        rect = self.contentsRect()
+        left = rect.left()
+        for gutter in (self.diagnostic_gutter, self.heat_gutter):
+            if gutter.isHidden():
+                continue
+            gutter.setGeometry(QRect(left, rect.top(), gutter.gutter_width(), rect.height()))
+            left += gutter.gutter_width()
+        self.setViewportMargins(left - rect.left(), 0, 0, 0)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_gutters()
+
+    def schedule_analysis(self):
+        self.symbol_analysis.schedule()
+        self.syntax_check.schedule()
+
+    def set_diagnostics(self, diagnostics):
+        """显示 SyntaxChecker 的结果：出错位置加波浪线，所在行在标记栏中标出"""
+        doc = self.document()
+        self.diagnostics = []
+        selections = []
+        for line, column, end_line, end_column, message in diagnostics:
+            start = self.document_position(line, column)
+            end = self.document_position(end_line, end_column)
+            if start is None:
+                continue
+            cursor = QTextCursor(doc)
+            cursor.setPosition(start)
+            block = cursor.block()
+            if end is None or end <= start:
+                end = start + 1
+            # 出错位置在行尾（如括号未闭合到文件末尾）时标出行尾前一个字符
+            block_end = block.position() + block.length() - 1
+            if start >= block_end:
+                start = max(block.position(), block_end - 1)
+            cursor.setPosition(start)
+            cursor.setPosition(min(end, max(block_end, start)), QTextCursor.MoveMode.KeepAnchor)
+            self.diagnostics.append((cursor, message))
+            if cursor.hasSelection():
+                selection = QTextEdit.ExtraSelection()
+                selection.cursor = cursor
+                selection.format = self.diagnostic_format
+                selections.append(selection)
+        self.setExtraSelections(selections)
+        self.diagnostic_gutter.update()
+
+    def document_position(self, line, column):
+        """行从 1、列从 0 开始（按 Python 字符计）转换为文档位置，行不存在时返回 None"""
+        block = self.document().findBlockByNumber(line - 1)
+        if not block.isValid():
+            return None
+        return block.position() + utf16_length(block.text()[:column])
+
+    def diagnostic_lines(self):
+        """行号（从 1 开始）-> 该行的错误信息列表"""
+        lines = {}
+        for cursor, message in self.diagnostics:
+            lines.setdefault(cursor.blockNumber() + 1, []).append(message)
+        return lines
+
+    def viewportEvent(self, event):
+        if event.type() == QEvent.Type.ToolTip and self.diagnostics:
+            position = self.cursorForPosition(event.pos()).position()
+            messages = [message for cursor, message in self.diagnostics
+                        if cursor.selectionStart() <= position <= cursor.selectionEnd()]
+            if messages:
+                QToolTip.showText(event.globalPos(), '\n'.join(messages), self.viewport())
+                return True
+        return super().viewportEvent(event)
 
     def on_text_changed(self):
+        # 延迟高亮和整体重新高亮只改变格式，文本没有变化
+        if self.highlighter.lazy_window is not None or self.highlighter.rehighlighting or self.bulk_depth:
+            return
+
         # 延迟触发补全检查
         self.completion_timer.stop()
         self.completion_timer.start(150)
 
-        # 更新用户定义的内容
-        text = self.toPlainText()
-        self.code_completer.update_user_definitions(text)
+    def on_contents_change(self, position, removed, added):
+        if self.highlighter.lazy_window is not None or self.highlighter.rehighlighting:
+            return
+        # 批量编辑期间作用域分析和语法检查在结束时做一次
+        if not self.bulk_depth:
+            self.schedule_analysis()
+        # 增删行后行号对不上，热度结果失效
+        if self.heat_gutter.isVisible() and self.blockCount() != self.heat_gutter.block_count:
+            self.clear_heat()
+
+        # 只重新扫描变化涉及的块来更新用户定义
+        doc = self.document()
+        first_block = doc.findBlock(position)
+        last_block = doc.findBlock(position + added)
+        if not last_block.isValid():
+            last_block = doc.lastBlock()
+
+        first = first_block.blockNumber()
+        last = last_block.blockNumber()
+        # 延迟高亮已经扫过的位置可能出现了未高亮的新块，从这里重新扫描
+        if self.highlighter.lazy_active and first < self.highlighter.lazy_next_block:
+            self.highlighter.lazy_next_block = first
+        if self.bulk_depth or self.stale_blocks is not None:
+            # 批量编辑或追赶尚未完成：只记录范围，之后统一更新
+            if self.saved_after_catch_up:
+                # 保存状态对应的内容已经被改掉，无法再准确记录，按有修改处理
+                self.saved_after_catch_up = False
+                self.block_hashes.saved = None
+            self.mark_blocks_stale(first, last)
+            if not self.bulk_depth:
+                self.index_timer.start()
+        else:
+            # 变化前对应的最后一块 = 变化后的最后一块 - 新增的块数
+            old_last = last - (doc.blockCount() - len(self.code_completer.user_definitions.block_names))
+
+            lines = []
+            block = first_block
+            while block.isValid() and block.blockNumber() <= last:
+                lines.append(block.text())
+                block = block.next()
+            self.code_completer.update_user_definition_blocks(first, old_last, lines)
+            self.block_hashes.replace_blocks(first, old_last, lines)
+            self.update_modified()
+        if not self.loading:
+            self.text_edited.emit(position, removed, self.text_range(position, added))
+
+    def text_range(self, position, length):
+        cursor = QTextCursor(self.document())
+        cursor.setPosition(position)
+        # 整个文档被替换时 Qt 报告的长度包括末尾的块结束符，超出文档
+        cursor.setPosition(min(position + length, self.document().characterCount() - 1),
+                           QTextCursor.MoveMode.KeepAnchor)
+        return cursor.selectedText().replace('\u2029', '\n')
+
+    def update_modified(self):
+        self.flush_stale_blocks()
+        modified = self.block_hashes.is_modified()
+        if modified != self.modified:
+            self.modified = modified
+            self.modification_changed.emit(modified)
+
+    def mark_saved(self, snapshot=None):
+        """记录保存时的内容；snapshot 为开始保存时 block_hashes.snapshot() 的结果"""
+        if snapshot is None and self.stale_blocks is not None:
+            # 内容哈希还在追赶，完成后再记录，期间显示为未修改
+            self.saved_after_catch_up = True
+            if self.modified:
+                self.modified = False
+                self.modification_changed.emit(False)
+            return
+        self.block_hashes.mark_saved(snapshot)
+        self.update_modified()
+
+    def on_module_members_ready(self, module_name):
+        # 后台获取到模块成员后刷新正在显示的补全，原来的候选集合已经过时
+        self.completion_session = None
+        if self.completion_popup.isVisible() or self.completion_timer.isActive():
+            self.check_for_completions()
 
     def check_for_completions(self):
         if not self.hasFocus():
@@ -336,62 +2190,32 @@ class CodeEditor(QPlainTextEdit):
             return
 
         cursor = self.textCursor()
-        text = self.toPlainText()
-        pos = cursor.position()
-
-        # 获取当前单词
-        line_start = text.rfind('\n', 0, pos) + 1
-        current_line = text[line_start:pos]
-
-        # 从当前位置向前找到单词开始
-        word_start = 0
-        for i in range(len(current_line) - 1, -1, -1):
-            ch = current_line[i]
-            if not (ch.isalnum() or ch == '_' or ch == '.'):
-                word_start = i + 1
-                break
-
-        current_word = current_line[word_start:] if word_start < len(current_line) else ""
+        context = self.cursor_context(cursor)
+        word_start = context.word_start()
+        current_word = context.line_prefix[word_start:]
 
         if len(current_word) > 0:
-            completions = self.code_completer.get_completions(text, current_word)
+            head, dot, member_prefix = current_word.rpartition('.')
+            head += dot
+            key = (cursor.blockNumber(), word_start, context.line_prefix[:word_start])
+            # 同一个单词继续输入时在已有候选中筛选，否则重新取候选
+            if (self.completion_session is None or not self.completion_popup.isVisible()
+                    or self.completion_session[:3] != key
+                    or not self.completion_session[3].accepts(head, member_prefix)):
+                session = self.code_completer.start_session(current_word, context.line_prefix[:word_start],
+                                                            cursor.blockNumber() + 1)
+                self.completion_session = key + (session,)
+            completions = self.completion_session[3].completions(member_prefix)
             if completions:
-                self.show_completions(completions, cursor, current_word)
+                self.show_completions(completions, cursor)
             else:
                 self.completion_popup.hide()
         else:
             self.completion_popup.hide()
 
-    def show_completions(self, completions, cursor, current_word):
-        self.completion_popup.clear()
-
-        filtered_completions = []
-        for item in completions:
-            if item.lower().startswith(current_word.lower()):
-                filtered_completions.append(item)
-
-        if not filtered_completions:
-            self.completion_popup.hide()
-            return
-
-        # 排序：用户定义 > 关键字 > 内置 > 模块
-        def sort_key(x):
-            score = 0
-            if x in self.code_completer.user_definitions:
-                score += 1000
-            if x in self.code_completer.keywords:
-                score += 500
-            if x in self.code_completer.builtins:
-                score += 300
-            if '.' in x:  # 模块成员
-                score += 200
-            return (-score, len(x), x.lower())
-
-        filtered_completions.sort(key=sort_key)
-
-        # 显示建议
-        for item in filtered_completions[:10]:
-            self.completion_popup.addItem(item)
+    def show_completions(self, completions, cursor):
+        # 补全结果已由 CodeCompleter 排好序（包括模糊匹配），全部交给模型，视图只绘制可见的行
+        self.completion_popup.set_completions(completions)
 
         if self.completion_popup.count() > 0:
             cursor_rect = self.cursorRect(cursor)
@@ -408,37 +2232,20 @@ class CodeEditor(QPlainTextEdit):
 
             self.completion_popup.move(global_pos)
             self.completion_popup.show()
-            self.completion_popup.setCurrentRow(0)
             self.setFocus()
         else:
             self.completion_popup.hide()
 
-    def apply_completion(self, item):
-        if not item:
+    def apply_completion(self, completion):
+        if not completion:
             return
 
-        completion = item.text()
         cursor = self.textCursor()
 
-        text = self.toPlainText()
-        pos = cursor.position()
-
-        line_start = text.rfind('\n', 0, pos) + 1
-        current_line = text[line_start:pos]
-
-        # 找到当前单词的开始位置
-        word_start = 0
-        for i in range(len(current_line) - 1, -1, -1):
-            ch = current_line[i]
-            if not (ch.isalnum() or ch == '_' or ch == '.'):
-                word_start = i + 1
-                break
-
-        chars_to_delete = len(current_line) - word_start
-
-        if chars_to_delete > 0:
-            cursor.movePosition(QTextCursor.MoveOperation.Left, QTextCursor.MoveMode.MoveAnchor, chars_to_delete)
-            cursor.movePosition(QTextCursor.MoveOperation.Right, QTextCursor.MoveMode.KeepAnchor, chars_to_delete)
+        # 选中光标前的当前单词，用补全结果替换
+        current_word = self.cursor_context(cursor).word()
+        if current_word:
+            cursor.setPosition(cursor.position() - utf16_length(current_word), QTextCursor.MoveMode.KeepAnchor)
 
         cursor.insertText(completion)
         self.setTextCursor(cursor)
@@ -451,13 +2258,7 @@ class CodeEditor(QPlainTextEdit):
         # 处理Tab键
         if event.key() == Qt.Key.Key_Tab:
             cursor = self.textCursor()
-            text = self.toPlainText()
-            pos = cursor.position()
-
-            line_start = text.rfind('\n', 0, pos) + 1
-            current_line = text[line_start:pos]
-
-            if current_line.strip() == "":
+            if self.cursor_context(cursor).line_prefix.strip() == "":
                 cursor.insertText("    ")
                 self.tab_just_used = True
                 event.accept()
@@ -466,19 +2267,15 @@ class CodeEditor(QPlainTextEdit):
         # 检查补全弹窗
         if self.completion_popup.isVisible():
             if event.key() == Qt.Key.Key_Down:
-                current_row = self.completion_popup.currentRow()
-                if current_row < self.completion_popup.count() - 1:
-                    self.completion_popup.setCurrentRow(current_row + 1)
+                self.completion_popup.move_selection(1)
                 event.accept()
                 return
             elif event.key() == Qt.Key.Key_Up:
-                current_row = self.completion_popup.currentRow()
-                if current_row > 0:
-                    self.completion_popup.setCurrentRow(current_row - 1)
+                self.completion_popup.move_selection(-1)
                 event.accept()
                 return
             elif event.key() == Qt.Key.Key_Enter or event.key() == Qt.Key.Key_Return:
-                current_item = self.completion_popup.currentItem()
+                current_item = self.completion_popup.current_completion()
                 if current_item:
                     self.apply_completion(current_item)
                 event.accept()
@@ -489,7 +2286,7 @@ class CodeEditor(QPlainTextEdit):
                 event.accept()
                 return
             elif event.key() == Qt.Key.Key_Tab:
-                current_item = self.completion_popup.currentItem()
+                current_item = self.completion_popup.current_completion()
                 if current_item:
                     self.apply_completion(current_item)
                     self.tab_just_used = True
@@ -498,12 +2295,8 @@ class CodeEditor(QPlainTextEdit):
 
         # 处理冒号自动缩进
         if event.text() == ":" and not self.colon_just_processed:
-            cursor = self.textCursor()
-            text = self.toPlainText()
-            pos = cursor.position()
-
             # 检查是否在字符串或注释内
-            if not self.is_in_string_or_comment(text[:pos]):
+            if not self.cursor_context().in_string_or_comment():
                 super().keyPressEvent(event)
                 # 设置标志防止重复处理
                 self.colon_just_processed = True
@@ -515,105 +2308,28 @@ class CodeEditor(QPlainTextEdit):
         # 处理普通按键
         super().keyPressEvent(event)
 
-        if event.text() and (event.text().isalnum() or event.text() == '_' or event.text() == '.'):
+        is_word_char = event.text() and (event.text().isalnum() or event.text() == '_' or event.text() == '.')
+        if self.completion_popup.isVisible() and (is_word_char or event.key() == Qt.Key.Key_Backspace):
+            # 弹窗已显示时在现有候选中筛选，代价很小，不需要等待定时器
+            self.completion_timer.stop()
+            self.check_for_completions()
+        elif is_word_char:
             self.completion_timer.stop()
             self.completion_timer.start(150)
 
-    def is_in_string_or_comment(self, text_before):
-        """检查当前位置是否在字符串或注释内"""
-
-        # 检查是否在注释内
-        if '#' in text_before:
-            last_comment = text_before.rfind('#')
-            last_newline = text_before.rfind('\n')
-            if last_comment > last_newline:
-                return True
-
-        # 检查是否在单引号字符串内
-        single_quotes = text_before.count("'")
-        triple_single = text_before.count("'''")
-
-        # 检查是否在双引号字符串内
-        double_quotes = text_before.count('"')
-        triple_double = text_before.count('"""')
-
-        # 计算有效引号数（考虑转义和三引号）
-        single_quotes -= triple_single * 3
-        double_quotes -= triple_double * 3
-
-        # 检查是否在三引号字符串内
-        if triple_single % 2 == 1 or triple_double % 2 == 1:
-            return True
-
-        # 检查是否在普通字符串内
-        if single_quotes % 2 == 1 or double_quotes % 2 == 1:
-            # 检查转义字符
-            if single_quotes % 2 == 1:
-                # 检查最后一个单引号是否被转义
-                last_single = text_before.rfind("'")
-                if last_single > 0 and text_before[last_single - 1] == '\\':
-                    # 检查转义字符是否被转义
-                    escape_count = 0
-                    i = last_single - 1
-                    while i >= 0 and text_before[i] == '\\':
-                        escape_count += 1
-                        i -= 1
-                    if escape_count % 2 == 0:  # 偶数个转义字符，引号有效
-                        return True
-                    else:  # 奇数个转义字符，引号被转义
-                        return False
-                else:
-                    return True
-
-            if double_quotes % 2 == 1:
-                # 检查最后一个双引号是否被转义
-                last_double = text_before.rfind('"')
-                if last_double > 0 and text_before[last_double - 1] == '\\':
-                    escape_count = 0
-                    i = last_double - 1
-                    while i >= 0 and text_before[i] == '\\':
-                        escape_count += 1
-                        i -= 1
-                    if escape_count % 2 == 0:
-                        return True
-                    else:
-                        return False
-                else:
-                    return True
-
-        return False
+    def cursor_context(self, cursor=None):
+        return CursorContext(cursor or self.textCursor(), self.highlighter.tokenizer)
 
     def handle_colon_indent(self):
         cursor = self.textCursor()
-        text = self.toPlainText()
-        pos = cursor.position()
-
-        if pos > 0 and text[pos - 1] == ":":
-            # 检查当前行是否已经有缩进（避免重复缩进）
-            line_start = text.rfind('\n', 0, pos - 1) + 1
-            current_line = text[line_start:pos - 1]
-
-            # 检查下一行是否已经有缩进
-            next_line_start = pos
-            if next_line_start < len(text):
-                # 找到下一行的开始
-                next_newline = text.find('\n', next_line_start)
-                if next_newline == -1:
-                    next_newline = len(text)
-                next_line = text[next_line_start:next_newline]
-
-                # 如果下一行已经有非空白内容，不添加缩进
-                if next_line.strip() != "":
-                    return
+        context = self.cursor_context(cursor)
 
-            indent = ""
-            for char in current_line:
-                if char in [' ', '\t']:
-                    indent += char
-                else:
-                    break
+        if context.line_prefix.endswith(":"):
+            # 冒号后面已经有内容时不添加缩进
+            if context.line_suffix.strip() != "":
+                return
 
-            indent += "    "
+            indent = context.indent() + "    "
 
             # 只插入一次新行和缩进
             cursor.insertText(f"\n{indent}")
@@ -629,62 +2345,1101 @@ class CodeEditor(QPlainTextEdit):
         super().focusOutEvent(event)
 
 
-class TerminalManager:
-    def __init__(self):
-        self.current_directory = self.get_home_directory()
+class OutputConsole(QPlainTextEdit):
+    """纯文本输出控制台：只保留最近的若干行，追加的文本每帧合并一次，超出的部分可写入临时文件"""
 
-    def get_home_directory(self):
-        system = platform.system().lower()
-        if system == "windows":
-            return os.path.expanduser("~")
-        elif system == "darwin":
-            return os.path.expanduser("~")
+    spill_started = pyqtSignal(str)
+
+    DEFAULT_SCROLLBACK = 10000
+    FRAME_INTERVAL_MS = 16
+    MAX_FRAME_INTERVAL_MS = 250
+
+    def __init__(self, parent=None, scrollback=DEFAULT_SCROLLBACK, spill_to_file=True):
+        super().__init__(parent)
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        self.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        self.spill_to_file = spill_to_file
+        self.spill_file = None
+        self.spill_path = None
+        self.set_scrollback(scrollback)
+
+        # [(是否为错误输出, [文本])]，等待下一帧写入
+        self.pending = []
+        # 写入耗时较长时拉长间隔，让更多输出在写入前合并（超出保留行数的部分直接截掉）
+        self.frame_interval = self.FRAME_INTERVAL_MS
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.timeout.connect(self.flush)
+
+        self.normal_format = QTextCharFormat()
+        self.error_format = QTextCharFormat()
+        self.error_format.setForeground(QColor("#ff6b6b"))
+
+        QCoreApplication.instance().aboutToQuit.connect(self.close_spill)
+
+    def set_scrollback(self, lines):
+        self.scrollback = lines
+        self.trim_head()
+
+    def trim_head(self):
+        # 和 maximumBlockCount 效果相同，但一次删除所有超出的行，而不是逐块删除
+        document = self.document()
+        excess = document.blockCount() - self.scrollback
+        if excess <= 0:
+            return
+        cursor = QTextCursor(document)
+        cursor.setPosition(document.findBlockByNumber(excess).position(), QTextCursor.MoveMode.KeepAnchor)
+        cursor.removeSelectedText()
+
+    def append_text(self, text, is_error=False):
+        if not text:
+            return
+        if self.pending and self.pending[-1][0] == is_error:
+            self.pending[-1][1].append(text)
         else:
-            return "/data/data/com.example.python/files" if os.path.exists("/data/data") else os.path.expanduser("~")
+            self.pending.append((is_error, [text]))
+        if not self.frame_timer.isActive():
+            self.frame_timer.start(self.frame_interval)
+
+    def flush(self):
+        self.frame_timer.stop()
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        started = time.perf_counter()
+
+        scrollbar = self.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum()
+        cursor = QTextCursor(self.document())
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+
+        for is_error, parts in pending:
+            text = ''.join(parts)
+            self.spill(text)
+            tail = self.tail_lines(text)
+            if len(tail) < len(text):
+                # 这一批已经超过保留行数，原有内容都会被挤掉
+                QPlainTextEdit.clear(self)
+                cursor = QTextCursor(self.document())
+            cursor.insertText(tail, self.error_format if is_error else self.normal_format)
+        self.trim_head()
+
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.frame_interval = int(min(self.MAX_FRAME_INTERVAL_MS, max(self.FRAME_INTERVAL_MS, elapsed_ms * 2)))
+
+    def tail_lines(self, text):
+        # 一次追加超过保留行数时，前面的行插入后也会被立即丢弃，直接截掉
+        if text.count('\n') < self.scrollback:
+            return text
+        position = len(text)
+        for _ in range(self.scrollback):
+            position = text.rfind('\n', 0, position)
+        return text[position + 1:]
+
+    def spill(self, text):
+        if not self.spill_to_file:
+            return
+        if self.spill_file is None:
+            if self.document().blockCount() + text.count('\n') <= self.scrollback:
+                return
+            # 第一次超出保留行数：先写入控制台中现有的内容，之后的输出全部写入文件
+            fd, self.spill_path = tempfile.mkstemp(prefix="pyedit-output-", suffix=".log")
+            self.spill_file = open(fd, 'w', encoding='utf-8')
+            self.spill_file.write(self.toPlainText())
+            self.spill_started.emit(self.spill_path)
+        self.spill_file.write(text)
+
+    def open_spill_file(self):
+        if self.spill_file is None:
+            return
+        self.flush()
+        self.spill_file.flush()
+        QDesktopServices.openUrl(QUrl.fromLocalFile(self.spill_path))
 
-    def execute_command(self, command):
+    def close_spill(self):
+        if self.spill_file is None:
+            return
+        self.spill_file.close()
         try:
-            if command.strip() == "clear":
-                return "", ""
-
-            if command.startswith("cd "):
-                new_dir = command[3:].strip()
-                if new_dir == "..":
-                    self.current_directory = os.path.dirname(self.current_directory)
-                elif os.path.isdir(new_dir):
-                    self.current_directory = new_dir
-                elif os.path.isdir(os.path.join(self.current_directory, new_dir)):
-                    self.current_directory = os.path.join(self.current_directory, new_dir)
-                else:
-                    return f"cd: {new_dir}: 目录不存在\n", ""
-                return f"切换到目录: {self.current_directory}\n", ""
+            os.remove(self.spill_path)
+        except OSError:
+            pass
+        self.spill_file = None
+        self.spill_path = None
+
+    def clear(self):
+        self.pending = []
+        self.frame_timer.stop()
+        self.close_spill()
+        super().clear()
+
+    def contextMenuEvent(self, event):
+        menu = self.createStandardContextMenu()
+        menu.addSeparator()
+        action = menu.addAction("打开完整输出", self.open_spill_file)
+        action.setEnabled(self.spill_file is not None)
+        menu.exec(event.globalPos())
+
+
+class InterpreterWorker(QObject):
+    """解释器进程：收到代码后运行，输出解码后逐块送出"""
+
+    output_ready = pyqtSignal(str, bool)
+    exited = pyqtSignal(int)
+
+    # 被信号结束但不知道是哪个信号时的退出码（QProcess 不报告信号编号）
+    UNKNOWN_SIGNAL = -1000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.decoders = {False: codecs.getincrementaldecoder('utf-8')('replace'),
+                         True: codecs.getincrementaldecoder('utf-8')('replace')}
+        # 退出后的资源用量 {'user', 'sys', 'max_rss'}，得不到时为 None
+        self.usage = None
+
+    def decode(self, data, is_error):
+        text = self.decoders[is_error].decode(data)
+        if text:
+            self.output_ready.emit(text, is_error)
+
+    def encode_request(self, source, filename, working_directory, options=None):
+        # options 中的其他字段（如 profile）原样放进请求头
+        header = json.dumps({'filename': filename, 'cwd': working_directory, **(options or {})})
+        return (header + '\n' + source).encode('utf-8')
+
+
+class ProcessWorker(InterpreterWorker):
+    """用 QProcess 启动的解释器，预先导入模块后等待代码"""
+
+    def __init__(self, modules, parent=None):
+        super().__init__(parent)
+        self.process = QProcess(self)
+        environment = QProcessEnvironment.systemEnvironment()
+        environment.insert("PYTHONIOENCODING", "utf-8")
+        environment.insert("PYTHONUNBUFFERED", "1")
+        self.process.setProcessEnvironment(environment)
+        self.process.readyReadStandardOutput.connect(
+            lambda: self.decode(bytes(self.process.readAllStandardOutput()), False))
+        self.process.readyReadStandardError.connect(
+            lambda: self.decode(bytes(self.process.readAllStandardError()), True))
+        self.process.finished.connect(self.on_finished)
+        self.process.errorOccurred.connect(self.on_error)
+        # 解释器写出自己运行期间资源用量的文件
+        self.usage_path = None
+        self.process.start(sys.executable, [WORKER_SCRIPT, "warm", *modules])
+
+    def run(self, source, filename, working_directory, options=None):
+        # QProcess 自己回收子进程，得不到单个子进程的用量，由解释器运行结束时写到文件中
+        if resource:
+            fd, self.usage_path = tempfile.mkstemp(prefix="pyedit-usage-", suffix=".json")
+            os.close(fd)
+            options = {**(options or {}), 'usage': self.usage_path}
+        self.process.write(self.encode_request(source, filename, working_directory, options))
+        self.process.closeWriteChannel()
+
+    def read_usage(self):
+        """被信号结束时解释器来不及写出用量，返回 None"""
+        path, self.usage_path = self.usage_path, None
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+        finally:
+            for leftover in (path, path + '.tmp'):
+                try:
+                    os.remove(leftover)
+                except OSError:
+                    pass
+
+    def kill(self):
+        if self.process.state() != QProcess.ProcessState.NotRunning:
+            self.process.kill()
+            self.process.waitForFinished(1000)
+
+    def close(self):
+        self.kill()
+
+    def on_finished(self, exit_code, exit_status):
+        self.decode(bytes(self.process.readAllStandardOutput()), False)
+        self.decode(bytes(self.process.readAllStandardError()), True)
+        self.usage = self.read_usage()
+        self.exited.emit(exit_code if exit_status == QProcess.ExitStatus.NormalExit else self.UNKNOWN_SIGNAL)
+
+    def on_error(self, error):
+        if error != QProcess.ProcessError.FailedToStart:
+            return
+        message = f"无法启动解释器: {self.process.errorString()}\n"
+        # 可能在构造函数中就已失败，推迟到调用方连接信号之后再通知
+        QTimer.singleShot(0, lambda: (self.output_ready.emit(message, True),
+                                     self.exited.emit(self.UNKNOWN_SIGNAL)))
+
+
+class ForkedWorker(InterpreterWorker):
+    """由 fork 服务器分出的解释器，通过 IDE 创建的管道通信"""
+
+    def __init__(self, stdin_fd, stdout_fd, stderr_fd, parent=None):
+        super().__init__(parent)
+        self.stdin_fd = stdin_fd
+        self.pid = None
+        self.exit_code = None
+        self.kill_requested = False
+        self.notifiers = {}
+        for fd, is_error in ((stdout_fd, False), (stderr_fd, True)):
+            os.set_blocking(fd, False)
+            notifier = QSocketNotifier(fd, QSocketNotifier.Type.Read, self)
+            notifier.activated.connect(lambda _, fd=fd, is_error=is_error: self.read_stream(fd, is_error))
+            self.notifiers[fd] = notifier
+
+    def run(self, source, filename, working_directory, options=None):
+        data = self.encode_request(source, filename, working_directory, options)
+        try:
+            # 子进程已经在等待读取，写入不会长时间阻塞
+            while data:
+                data = data[os.write(self.stdin_fd, data):]
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        if self.stdin_fd is not None:
+            os.close(self.stdin_fd)
+            self.stdin_fd = None
+
+    def kill(self):
+        if self.pid is None:
+            self.kill_requested = True
+            return
+        try:
+            # 子进程是新会话的首进程，连同它启动的进程一起结束
+            os.killpg(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            # 子进程可能还没来得及调用 setsid()，进程组尚不存在
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        except OSError:
+            pass
+
+    def read_stream(self, fd, is_error):
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if data:
+            self.decode(data, is_error)
+            return
+
+        self.notifiers.pop(fd).setEnabled(False)
+        os.close(fd)
+        self.check_exited()
 
-            if command.startswith("pip "):
-                return self.execute_pip_command(command)
+    def set_pid(self, pid):
+        self.pid = pid
+        if self.kill_requested:
+            self.kill()
 
-            if platform.system().lower() == "windows":
-                result = subprocess.run(f"cd /d {self.current_directory} && {command}",
-                                        shell=True, capture_output=True, text=True, cwd=self.current_directory)
+    def set_exit_code(self, exit_code, usage=None):
+        self.exit_code = exit_code
+        self.usage = usage
+        self.check_exited()
+
+    def check_exited(self):
+        # 退出码和两个管道的结束都到达后才算运行结束
+        if self.exit_code is not None and not self.notifiers:
+            self.exited.emit(self.exit_code)
+
+
+class ForkServer(QObject):
+    """预先导入模块的 fork 服务器，新解释器从它 fork 出来，不需要重新启动和导入"""
+
+    def __init__(self, modules, parent=None):
+        super().__init__(parent)
+        # SOCK_SEQPACKET 保留消息边界，IDE 退出时服务器能读到结束
+        socket_type = getattr(socket, "SOCK_SEQPACKET", socket.SOCK_DGRAM)
+        try:
+            self.control, remote = socket.socketpair(socket.AF_UNIX, socket_type)
+        except OSError:
+            self.control, remote = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+        environment = dict(os.environ, PYTHONIOENCODING="utf-8", PYTHONUNBUFFERED="1")
+        self.process = subprocess.Popen([sys.executable, WORKER_SCRIPT, "zygote", str(remote.fileno()), *modules],
+                                        pass_fds=[remote.fileno()], stdin=subprocess.DEVNULL, env=environment,
+                                        start_new_session=True)
+        remote.close()
+
+        self.control.setblocking(False)
+        self.notifier = QSocketNotifier(self.control.fileno(), QSocketNotifier.Type.Read, self)
+        self.notifier.activated.connect(self.read_messages)
+        self.alive = True
+        self.next_id = 0
+        # 请求编号 -> 等待 pid 的工作进程；pid -> 运行中的工作进程
+        self.requested = {}
+        self.workers = {}
+
+    def spawn(self):
+        stdin_read, stdin_write = os.pipe()
+        stdout_read, stdout_write = os.pipe()
+        stderr_read, stderr_write = os.pipe()
+        worker = ForkedWorker(stdin_write, stdout_read, stderr_read, self)
+
+        self.next_id += 1
+        self.requested[self.next_id] = worker
+        try:
+            socket.send_fds(self.control, [json.dumps({'id': self.next_id}).encode()],
+                            [stdin_read, stdout_write, stderr_write])
+        finally:
+            for fd in (stdin_read, stdout_write, stderr_write):
+                os.close(fd)
+        return worker
+
+    def read_messages(self):
+        while True:
+            try:
+                data = self.control.recv(4096)
+            except BlockingIOError:
+                return
+            except OSError:
+                data = b""
+            if not data:
+                self.on_server_exited()
+                return
+
+            message = json.loads(data)
+            if 'id' in message:
+                worker = self.requested.pop(message['id'])
+                self.workers[message['pid']] = worker
+                worker.set_pid(message['pid'])
+            elif message['pid'] in self.workers:
+                self.workers.pop(message['pid']).set_exit_code(message['exit'], message.get('usage'))
+
+    def on_server_exited(self):
+        self.alive = False
+        self.notifier.setEnabled(False)
+        # 服务器不在了，得不到退出码
+        workers = list(self.requested.values()) + list(self.workers.values())
+        self.requested.clear()
+        self.workers.clear()
+        for worker in workers:
+            worker.set_exit_code(worker.UNKNOWN_SIGNAL)
+
+    def shutdown(self):
+        self.notifier.setEnabled(False)
+        self.control.close()
+        self.process.terminate()
+
+
+class InterpreterPool(QObject):
+    """预热解释器池：预先启动解释器并导入设置中的模块，每次运行取走一个，运行结束后在后台补充"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        settings = load_settings()
+        self.modules = list(settings["run_preload_modules"])
+        self.size = int(settings["run_pool_size"])
+        self.idle = []
+
+        # 支持 fork 的平台上从已导入模块的服务器 fork，否则启动新的解释器
+        self.fork_server = None
+        if self.size > 0 and hasattr(os, "fork") and hasattr(socket, "send_fds"):
+            try:
+                self.fork_server = ForkServer(self.modules, self)
+            except OSError:
+                self.fork_server = None
+
+        QCoreApplication.instance().aboutToQuit.connect(self.shutdown)
+        self.replenish()
+
+    def create_worker(self, modules):
+        if self.fork_server is not None and self.fork_server.alive:
+            return self.fork_server.spawn()
+        return ProcessWorker(modules, self)
+
+    def replenish(self):
+        while len(self.idle) < self.size:
+            worker = self.create_worker(self.modules)
+            # 等待中的解释器意外退出时从池中移除
+            worker.exited.connect(lambda exit_code, worker=worker: self.discard(worker))
+            self.idle.append(worker)
+
+    def discard(self, worker):
+        if worker in self.idle:
+            self.idle.remove(worker)
+            worker.deleteLater()
+
+    def take(self):
+        """返回 (解释器, 是否预热)；池为空时启动新的解释器"""
+        if self.idle:
+            return self.idle.pop(0), True
+        return self.create_worker([]), False
+
+    def shutdown(self):
+        for worker in self.idle:
+            worker.close()
+        self.idle = []
+        if self.fork_server is not None:
+            self.fork_server.shutdown()
+
+
+class RunEngine(QObject):
+    """在子解释器中运行代码，标准输出和标准错误通过管道分块送回界面"""
+
+    output_ready = pyqtSignal(str, bool)
+    # 退出码（被停止或被信号结束时为 -1），运行报告 {'exit', 'usage', 'limit'}
+    run_finished = pyqtSignal(int, object)
+    # 从开始运行到第一次输出的秒数，是否使用了预热的解释器
+    first_output = pyqtSignal(float, bool)
+
+    # 输出在这段时间内合并后一次送出，避免大量打印时塞满事件循环
+    FLUSH_INTERVAL_MS = 30
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = InterpreterPool(self)
+        self.worker = None
+        self.warm = False
+        self.started_at = 0.0
+        self.output_seen = False
+        self.stopped = False
+        # 因超出哪项限制而结束：'wall' 或 None
+        self.limit_exceeded = None
+        # [(是否为标准错误, [文本])]，等待下一次合并送出
+        self.pending = []
+
+        # 运行时间上限由 IDE 计时，到时结束子进程
+        self.wall_timer = QTimer(self)
+        self.wall_timer.setSingleShot(True)
+        self.wall_timer.timeout.connect(self.on_wall_limit)
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.timeout.connect(self.flush)
+
+        QCoreApplication.instance().aboutToQuit.connect(self.stop)
+
+    def is_running(self):
+        return self.worker is not None
+
+    def start(self, source, filename, working_directory, options=None):
+        if self.worker is not None:
+            return
+
+        self.worker, self.warm = self.pool.take()
+        self.worker.output_ready.connect(self.on_output)
+        self.worker.exited.connect(self.on_exited)
+        self.started_at = time.perf_counter()
+        self.output_seen = False
+        self.stopped = False
+        self.limit_exceeded = None
+        wall_limit = (options or {}).get('limits', {}).get('wall')
+        if wall_limit:
+            self.wall_timer.start(int(wall_limit * 1000))
+        self.worker.run(source, filename, working_directory, options)
+
+    def stop(self):
+        if self.worker is None:
+            return
+        self.stopped = True
+        self.worker.kill()
+
+    def on_wall_limit(self):
+        if self.worker is None:
+            return
+        self.limit_exceeded = 'wall'
+        self.worker.kill()
+
+    def on_output(self, text, is_error):
+        if not self.output_seen:
+            self.output_seen = True
+            self.first_output.emit(time.perf_counter() - self.started_at, self.warm)
+
+        if self.pending and self.pending[-1][0] == is_error:
+            self.pending[-1][1].append(text)
+        else:
+            self.pending.append((is_error, [text]))
+        if not self.flush_timer.isActive():
+            self.flush_timer.start(self.FLUSH_INTERVAL_MS)
+
+    def flush(self):
+        self.flush_timer.stop()
+        pending, self.pending = self.pending, []
+        for is_error, parts in pending:
+            self.output_ready.emit(''.join(parts), is_error)
+
+    def on_exited(self, exit_code):
+        self.flush()
+        self.wall_timer.stop()
+        worker, self.worker = self.worker, None
+        worker.deleteLater()
+        report = {'exit': exit_code, 'usage': worker.usage, 'limit': self.limit_exceeded}
+        # 被停止或被信号结束时退出码记为 -1
+        if self.stopped or self.limit_exceeded or exit_code < 0:
+            exit_code = -1
+        self.run_finished.emit(exit_code, report)
+        self.pool.replenish()
+
+
+class ProfileReport:
+    """读取运行进程写出的性能分析结果"""
+
+    # 函数表最多显示的行数（按累计时间）
+    MAX_FUNCTIONS = 500
+    # 生成折叠栈时调用链的最大深度
+    MAX_STACK_DEPTH = 64
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.pstats_path = os.path.join(directory, "profile.pstats")
+        try:
+            self.stats = pstats.Stats(self.pstats_path).stats
+        except (OSError, TypeError, ValueError, EOFError):
+            self.stats = {}
+        self.memory = read_json(os.path.join(directory, "memory.json"), None)
+
+    @staticmethod
+    def function_label(function):
+        filename, line, name = function
+        if filename == '~':
+            # 内置函数
+            return name
+        return f"{name} ({os.path.basename(filename)}:{line})"
+
+    def function_rows(self):
+        """[(函数, 文件, 行, 调用次数, 原始调用次数, 总时间, 累计时间)]，按累计时间排序"""
+        rows = [(name, filename, line, calls, primitive_calls, total, cumulative)
+                for (filename, line, name), (primitive_calls, calls, total, cumulative, _) in self.stats.items()]
+        return heapq.nlargest(self.MAX_FUNCTIONS, rows, key=lambda row: row[6])
+
+    def collapsed_stacks(self):
+        """把调用图展开为 flamegraph 工具使用的折叠栈文本，时间单位为微秒
+
+        cProfile 只记录调用者和被调用者之间的边，一个函数在各条调用链上的时间按边上的累计时间比例分配。
+        """
+        callees = {}
+        for function, (_, _, _, _, callers) in self.stats.items():
+            for caller, edge in callers.items():
+                callees.setdefault(caller, []).append((function, edge[3]))
+
+        totals = {}
+        path = []
+        on_path = set()
+
+        def visit(function, scale):
+            path.append(self.function_label(function).replace(';', ','))
+            on_path.add(function)
+            key = ';'.join(path)
+            totals[key] = totals.get(key, 0.0) + self.stats[function][2] * scale
+
+            if len(path) < self.MAX_STACK_DEPTH:
+                for callee, edge_cumulative in callees.get(function, ()):
+                    callee_cumulative = self.stats[callee][3]
+                    share = edge_cumulative * scale
+                    # 递归调用和可以忽略的分支不再展开
+                    if callee in on_path or callee_cumulative <= 0 or share < 1e-6:
+                        continue
+                    visit(callee, share / callee_cumulative)
+
+            on_path.discard(function)
+            path.pop()
+
+        for function, (_, _, _, _, callers) in self.stats.items():
+            if not callers:
+                visit(function, 1.0)
+
+        return [f"{key} {round(seconds * 1e6)}" for key, seconds in totals.items() if seconds >= 1e-6]
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class ProfileDialog(QDialog):
+    """性能分析结果：可排序的函数表、按行统计的内存分配，可导出"""
+
+    location_activated = pyqtSignal(str, int)
+
+    def __init__(self, report, parent=None):
+        super().__init__(parent)
+        self.report = report
+        self.setWindowTitle("性能分析结果")
+        self.resize(900, 500)
+        layout = QVBoxLayout(self)
+
+        tabs = QTabWidget()
+        tabs.addTab(self.create_function_table(), "函数")
+        if report.memory is not None:
+            tabs.addTab(self.create_memory_tab(), "内存")
+        layout.addWidget(tabs)
+
+        button_layout = QHBoxLayout()
+        pstats_btn = QPushButton("导出 pstats")
+        pstats_btn.clicked.connect(self.export_pstats)
+        button_layout.addWidget(pstats_btn)
+        collapsed_btn = QPushButton("导出折叠栈")
+        collapsed_btn.clicked.connect(self.export_collapsed)
+        button_layout.addWidget(collapsed_btn)
+        button_layout.addStretch()
+        close_btn = QPushButton("关闭")
+        close_btn.clicked.connect(self.close)
+        button_layout.addWidget(close_btn)
+        layout.addLayout(button_layout)
+
+    def create_table(self, headers, rows):
+        table = QTableWidget(len(rows), len(headers))
+        table.setHorizontalHeaderLabels(headers)
+        table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        table.verticalHeader().setVisible(False)
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                item = QTableWidgetItem()
+                # 数值按数值排序
+                item.setData(Qt.ItemDataRole.DisplayRole, value)
+                table.setItem(row, column, item)
+        table.setSortingEnabled(True)
+        table.resizeColumnsToContents()
+        table.cellDoubleClicked.connect(lambda row, column: self.activate_row(table, row))
+        return table
+
+    def create_function_table(self):
+        rows = [(name, filename, line, calls, round(total, 6), round(cumulative, 6),
+                 round(cumulative / calls, 6) if calls else 0.0)
+                for name, filename, line, calls, _, total, cumulative in self.report.function_rows()]
+        table = self.create_table(["函数", "文件", "行", "调用次数", "总时间(秒)", "累计时间(秒)", "每次累计(秒)"], rows)
+        table.sortByColumn(5, Qt.SortOrder.DescendingOrder)
+        return table
+
+    def create_memory_tab(self):
+        memory = self.report.memory
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        layout.addWidget(QLabel(f"内存峰值: {memory['peak'] / 1024 / 1024:.2f} MB，"
+                                f"以下为 {memory['snapshot_size'] / 1024 / 1024:.2f} MB 时的快照"))
+        rows = [(os.path.basename(filename), filename, line, round(size / 1024, 1), count)
+                for filename, line, size, count in memory['lines']]
+        table = self.create_table(["文件", "路径", "行", "大小(KB)", "对象数"], rows)
+        table.sortByColumn(3, Qt.SortOrder.DescendingOrder)
+        layout.addWidget(table)
+        return widget
+
+    def activate_row(self, table, row):
+        # 两个表的第2、3列分别是文件和行
+        self.location_activated.emit(table.item(row, 1).text(), int(table.item(row, 2).data(Qt.ItemDataRole.DisplayRole)))
+
+    def export_pstats(self):
+        path, _ = QFileDialog.getSaveFileName(self, "导出 pstats", "profile.pstats", "pstats (*.pstats *.prof)")
+        if path:
+            shutil.copyfile(self.report.pstats_path, path)
+
+    def export_collapsed(self):
+        path, _ = QFileDialog.getSaveFileName(self, "导出折叠栈", "profile.folded", "折叠栈 (*.folded *.txt)")
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(self.report.collapsed_stacks()) + '\n')
+
+    def closeEvent(self, event):
+        self.report.cleanup()
+        super().closeEvent(event)
+
+
+class Cell:
+    """以 # %% 分隔的单元格；start 为第一行的行号（从0开始）"""
+
+    __slots__ = ('index', 'start', 'source', 'digest')
+
+    MARKER_PATTERN = re.compile(r'#\s*%%')
+
+    def __init__(self, index, start, source):
+        self.index = index
+        self.start = start
+        self.source = source
+        self.digest = hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def split(cls, text):
+        lines = text.split('\n')
+        starts = [0] + [i for i, line in enumerate(lines) if i and cls.MARKER_PATTERN.match(line)]
+        cells = []
+        for index, start in enumerate(starts):
+            end = starts[index + 1] if index + 1 < len(starts) else len(lines)
+            cells.append(cls(index, start, '\n'.join(lines[start:end])))
+        return cells
+
+    @staticmethod
+    def index_at(cells, line):
+        starts = [cell.start for cell in cells]
+        return max(0, bisect.bisect_right(starts, line) - 1)
+
+
+class CellSession:
+    """记录内核命名空间中已经生效的单元格（按内容哈希），计划需要重新运行的单元格"""
+
+    def __init__(self):
+        self.executed = set()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=512)
+    def cell_names(source):
+        """返回 (单元格在模块级绑定的名称, 单元格读取的名称)"""
+        try:
+            tree = ast.parse(source)
+        except (SyntaxError, ValueError):
+            return frozenset(), frozenset()
+        module = Scope('module', '', 1, source.count('\n') + 1)
+        ScopeBuilder(module, source.split('\n')).visit(tree)
+        uses = {node.id for node in ast.walk(tree)
+                if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)}
+        return frozenset(module.names), frozenset(uses)
+
+    def plan(self, cells, current):
+        """当前单元格、它之前内容有变化的单元格，以及读取了这些单元格所定义名称的单元格"""
+        stale = []
+        redefined = set()
+        up_to_date = set()
+        for cell in cells:
+            defines, uses = self.cell_names(cell.source)
+            changed = cell.digest not in self.executed
+            if cell.index == current or (changed and cell.index < current) or uses & redefined:
+                stale.append(cell)
+                redefined |= defines
+            elif not changed:
+                up_to_date.add(cell.digest)
+        # 不再出现在文档中的旧版本不算生效，改回旧内容时会重新运行
+        self.executed = up_to_date
+        return stale
+
+    def mark_executed(self, cell):
+        self.executed.add(cell.digest)
+
+    def reset(self):
+        self.executed = set()
+
+
+class KernelClient(QObject):
+    """常驻的内核进程，命名空间在多次运行之间保留"""
+
+    output_ready = pyqtSignal(str, bool)
+    cell_finished = pyqtSignal(int, bool)
+    kernel_exited = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.process = None
+        self.buffer = b""
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        QCoreApplication.instance().aboutToQuit.connect(self.shutdown)
+
+    def is_alive(self):
+        return self.process is not None
+
+    def start(self, working_directory):
+        process = QProcess(self)
+        environment = QProcessEnvironment.systemEnvironment()
+        environment.insert("PYTHONIOENCODING", "utf-8")
+        environment.insert("PYTHONUNBUFFERED", "1")
+        process.setProcessEnvironment(environment)
+        process.setWorkingDirectory(working_directory)
+        process.readyReadStandardOutput.connect(self.read_messages)
+        # 标准错误只有扩展模块等绕过 sys.stdout 直接写文件描述符的输出
+        process.readyReadStandardError.connect(
+            lambda: self.output_ready.emit(self.decoder.decode(bytes(process.readAllStandardError())), True))
+        process.finished.connect(self.on_finished)
+        self.process = process
+        self.buffer = b""
+        process.start(sys.executable, [WORKER_SCRIPT, "kernel"])
+
+    def execute(self, request_id, source, filename, first_line, working_directory):
+        if self.process is None:
+            self.start(working_directory)
+        request = {'id': request_id, 'source': source, 'filename': filename, 'line': first_line}
+        self.process.write((json.dumps(request) + '\n').encode('utf-8'))
+
+    def read_messages(self):
+        self.buffer += bytes(self.process.readAllStandardOutput())
+        *lines, self.buffer = self.buffer.split(b'\n')
+        for line in lines:
+            message = json.loads(line)
+            if 'stream' in message:
+                self.output_ready.emit(message['text'], message['stream'] == 'stderr')
             else:
-                result = subprocess.run(command, shell=True, capture_output=True, text=True, cwd=self.current_directory)
+                self.cell_finished.emit(message['id'], message['ok'])
+
+    def interrupt(self):
+        if self.process is None:
+            return
+        # 在单元格中引发 KeyboardInterrupt，命名空间保留；不支持时只能重启
+        if os.name == "posix":
+            os.kill(self.process.processId(), signal.SIGINT)
+        else:
+            self.shutdown()
+
+    def on_finished(self):
+        process, self.process = self.process, None
+        process.deleteLater()
+        self.kernel_exited.emit()
+
+    def shutdown(self):
+        if self.process is None:
+            return
+        self.process.finished.disconnect(self.on_finished)
+        self.process.kill()
+        self.process.waitForFinished(1000)
+        self.process = None
+        self.kernel_exited.emit()
+
+
+class CellRunner(QObject):
+    """单元格模式：只运行有变化的单元格和依赖它们的单元格"""
+
+    output_ready = pyqtSignal(str, bool)
+    cell_started = pyqtSignal(object)
+    run_finished = pyqtSignal(bool)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.session = CellSession()
+        self.kernel = KernelClient(self)
+        self.kernel.output_ready.connect(self.output_ready)
+        self.kernel.cell_finished.connect(self.on_cell_finished)
+        self.kernel.kernel_exited.connect(self.on_kernel_exited)
+        self.queue = deque()
+        self.current = None
+        self.filename = "<editor>"
+        self.working_directory = os.getcwd()
+
+    def is_running(self):
+        return self.current is not None
+
+    def run(self, text, line, filename, working_directory):
+        """运行光标所在行的单元格，返回计划运行的单元格"""
+        cells = Cell.split(text)
+        plan = self.session.plan(cells, Cell.index_at(cells, line))
+        self.queue = deque(plan)
+        self.filename = filename
+        self.working_directory = working_directory
+        self.run_next()
+        return plan
+
+    def run_next(self):
+        if not self.queue:
+            self.current = None
+            self.run_finished.emit(True)
+            return
+        self.current = self.queue.popleft()
+        self.cell_started.emit(self.current)
+        self.kernel.execute(self.current.index, self.current.source, self.filename, self.current.start,
+                            self.working_directory)
+
+    def on_cell_finished(self, index, ok):
+        if self.current is None or index != self.current.index:
+            return
+        if not ok:
+            # 出错后不再运行后面依赖它的单元格
+            self.queue.clear()
+            self.current = None
+            self.run_finished.emit(False)
+            return
+        self.session.mark_executed(self.current)
+        self.run_next()
+
+    def stop(self):
+        self.queue.clear()
+        self.kernel.interrupt()
+
+    def restart(self):
+        self.queue.clear()
+        self.kernel.shutdown()
+
+    def on_kernel_exited(self):
+        # 命名空间随内核一起丢失
+        self.session.reset()
+        if self.current is not None:
+            self.queue.clear()
+            self.current = None
+            self.run_finished.emit(False)
 
-            return result.stdout, result.stderr
 
-        except Exception as e:
-            return "", f"命令执行错误: {str(e)}\n"
+class TerminalManager(QObject):
+    """终端后端：命令按提交顺序排队逐个执行，输出边运行边送出，可以中断"""
 
-    def execute_pip_command(self, command):
+    output_ready = pyqtSignal(str, bool)
+    command_started = pyqtSignal(str)
+    command_finished = pyqtSignal(str, int, float)
+    # 内部信号：读取线程有新输出 / 进程已退出
+    chunks_available = pyqtSignal()
+    process_exited = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.current_directory = self.get_home_directory()
+        self.is_windows = platform.system().lower() == "windows"
+
+        self.queue = deque()
+        self.process = None
+        self.command = None
+        self.started_at = 0.0
+        self.interrupted = False
+
+        # 读取线程放入输出块，界面线程一次取完；队列原本为空时才发信号，输出多时自然合并
+        self.chunks = deque()
+        self.chunks_lock = threading.Lock()
+        self.chunks_available.connect(self.drain_chunks)
+        self.process_exited.connect(self.on_process_exited)
+
+        QCoreApplication.instance().aboutToQuit.connect(self.shutdown)
+
+    def get_home_directory(self):
+        system = platform.system().lower()
+        if system == "windows":
+            return os.path.expanduser("~")
+        elif system == "darwin":
+            return os.path.expanduser("~")
+        else:
+            return "/data/data/com.example.python/files" if os.path.exists("/data/data") else os.path.expanduser("~")
+
+    def is_busy(self):
+        return self.command is not None
+
+    def is_idle(self):
+        return not self.is_busy() and not self.queue
+
+    def submit(self, command):
+        """提交命令；正在执行其他命令时排队，返回排在前面的命令数"""
+        self.queue.append(command)
+        waiting = len(self.queue) - 1 + self.is_busy()
+        if not self.is_busy():
+            self.start_next()
+        return waiting
+
+    def start_next(self):
+        while self.queue and not self.is_busy():
+            command = self.queue.popleft()
+            self.command = command
+            self.started_at = time.perf_counter()
+            self.interrupted = False
+            self.command_started.emit(command)
+
+            try:
+                self.start_process(command)
+            except Exception as e:
+                self.output_ready.emit(f"命令执行错误: {str(e)}\n", True)
+                self.finish(1)
+
+    def change_directory(self, new_dir):
+        if new_dir == "..":
+            self.current_directory = os.path.dirname(self.current_directory)
+        elif os.path.isdir(new_dir):
+            self.current_directory = new_dir
+        elif os.path.isdir(os.path.join(self.current_directory, new_dir)):
+            self.current_directory = os.path.join(self.current_directory, new_dir)
+        else:
+            self.output_ready.emit(f"cd: {new_dir}: 目录不存在\n", True)
+            self.finish(1)
+            return
+        self.output_ready.emit(f"切换到目录: {self.current_directory}\n", False)
+        self.finish(0)
+
+    def pip_command(self, command):
+        if platform.system().lower() == "linux" and os.path.exists("/data/data"):
+            return f"python -m {command}"
+        return command
+
+    def start_process(self, command):
+        if command.startswith("cd "):
+            self.change_directory(command[3:].strip())
+            return
+        if command.startswith("pip "):
+            command = self.pip_command(command)
+
+        environment = dict(os.environ, PYTHONUNBUFFERED="1")
+        # 命令在新的进程组中运行，中断时信号能送到 shell 启动的所有子进程
+        if self.is_windows:
+            group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            group = {'start_new_session': True}
+        self.process = subprocess.Popen(command, shell=True, cwd=self.current_directory, env=environment,
+                                        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        **group)
+
+        readers = [threading.Thread(target=self.read_stream, args=(self.process.stdout, False), daemon=True),
+                   threading.Thread(target=self.read_stream, args=(self.process.stderr, True), daemon=True)]
+        for reader in readers:
+            reader.start()
+        threading.Thread(target=self.wait_process, args=(self.process, readers), daemon=True).start()
+
+    def read_stream(self, stream, is_error):
+        decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))('replace')
+        while True:
+            data = stream.read1(65536)
+            text = decoder.decode(data, final=not data)
+            if text:
+                with self.chunks_lock:
+                    notify = not self.chunks
+                    self.chunks.append((text, is_error))
+                if notify:
+                    self.chunks_available.emit()
+            if not data:
+                break
+
+    def wait_process(self, process, readers):
+        for reader in readers:
+            reader.join()
+        self.process_exited.emit(process.wait())
+
+    def drain_chunks(self):
+        with self.chunks_lock:
+            chunks, self.chunks = self.chunks, deque()
+        for text, is_error in chunks:
+            self.output_ready.emit(text, is_error)
+
+    def on_process_exited(self, exit_code):
+        self.drain_chunks()
+        self.process = None
+        self.finish(exit_code)
+
+    def finish(self, exit_code):
+        command, self.command = self.command, None
+        self.command_finished.emit(command, exit_code, time.perf_counter() - self.started_at)
+        self.start_next()
+
+    def interrupt(self):
+        """向正在执行的命令发送 Ctrl-C；已经中断过一次时强制结束"""
+        if self.process is None:
+            return
+        if self.interrupted:
+            self.kill()
+            return
+        self.interrupted = True
         try:
-            if platform.system().lower() == "linux" and os.path.exists("/data/data"):
-                pip_command = f"python -m {command}"
+            if self.is_windows:
+                self.process.send_signal(signal.CTRL_BREAK_EVENT)
             else:
-                pip_command = command
+                os.killpg(self.process.pid, signal.SIGINT)
+        except OSError:
+            pass
 
-            result = subprocess.run(pip_command, shell=True, capture_output=True, text=True, cwd=self.current_directory)
-            return result.stdout, result.stderr
+    def kill(self):
+        if self.process is None:
+            return
+        try:
+            if self.is_windows:
+                self.process.kill()
+            else:
+                os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
 
-        except Exception as e:
-            return "", f"pip命令执行错误: {str(e)}\n"
+    def shutdown(self):
+        self.queue.clear()
+        self.kill()
 
     def get_prompt(self):
         system = platform.system().lower()
@@ -697,18 +3452,648 @@ class TerminalManager:
             return f"user@{platform.node()}:{dir_name}$ "
 
 
+class PtyTerminalManager(TerminalManager):
+    """终端后端：每个终端面板一个常驻的 bash，连接在伪终端上
+
+    命令直接写入 shell，cd、环境变量和虚拟环境在命令之间保留。每次显示提示符前
+    PROMPT_COMMAND 输出一个标记，带上一条命令的退出码和当前目录，据此判断命令结束。
+    """
+
+    SHELL = "/bin/bash"
+    MARKER = "\x1b]777;pyedit;"
+    MARKER_PATTERN = re.compile("\x1b]777;pyedit;(\\d+);([^\x07]*)\x07")
+    # 输出中的颜色等控制序列在纯文本控制台中没有意义
+    ESCAPE_PATTERN = re.compile("\x1b\\[[0-?]*[ -/]*[@-~]|\x1b\\][^\x07]*\x07|\r(?=\n)")
+    SHELL_SETUP = ("set +H; PS1=''; PS2=''; "
+                   "PROMPT_COMMAND='printf \"\\033]777;pyedit;%d;%s\\007\" $? \"$PWD\"'\n")
+
+    @classmethod
+    def available(cls):
+        return pty is not None and os.path.exists(cls.SHELL)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.shell = None
+        self.master_fd = None
+        self.notifier = None
+        self.pending_output = ""
+        self.decoder = None
+        self.start_shell()
+
+    def start_shell(self):
+        master_fd, slave_fd = pty.openpty()
+        # 关闭回显和 \n -> \r\n 转换，输出直接就是命令的输出
+        attributes = termios.tcgetattr(slave_fd)
+        attributes[1] &= ~termios.ONLCR
+        attributes[3] &= ~termios.ECHO
+        termios.tcsetattr(slave_fd, termios.TCSANOW, attributes)
+
+        environment = dict(os.environ, TERM="dumb", PYTHONUNBUFFERED="1")
+        self.shell = subprocess.Popen([self.SHELL, "--noprofile", "--norc", "--noediting", "-i"],
+                                      stdin=slave_fd, stdout=slave_fd, stderr=slave_fd,
+                                      cwd=self.current_directory, env=environment,
+                                      start_new_session=True, preexec_fn=self.set_controlling_terminal)
+        os.close(slave_fd)
+
+        self.master_fd = master_fd
+        # 设置完成（收到第一个标记）之前的输出是 bash 默认的提示符，不显示
+        self.ready = False
+        self.pending_output = ""
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.notifier = QSocketNotifier(master_fd, QSocketNotifier.Type.Read, self)
+        self.notifier.activated.connect(self.read_shell)
+        os.write(master_fd, self.SHELL_SETUP.encode())
+
+    @staticmethod
+    def set_controlling_terminal():
+        # 在子进程中执行：让伪终端成为新会话的控制终端，Ctrl-C 才能送到前台进程组
+        fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+    def submit(self, command):
+        # 命令执行中输入的内容作为该命令的标准输入，和真正的终端一样
+        if self.is_busy():
+            os.write(self.master_fd, (command + "\n").encode('utf-8'))
+            return 0
+        return super().submit(command)
+
+    def start_process(self, command):
+        if command.startswith("pip "):
+            command = self.pip_command(command)
+        os.write(self.master_fd, (command + "\n").encode('utf-8'))
+
+    def read_shell(self):
+        try:
+            data = os.read(self.master_fd, 65536)
+        except OSError:
+            data = b""
+        if not data:
+            self.on_shell_exited()
+            return
+
+        text = self.pending_output + self.decoder.decode(data)
+        # 标记可能被分在两次读取中，末尾不完整的控制序列留到下一次
+        escape = text.rfind("\x1b")
+        if escape != -1 and "\x07" not in text[escape:] and len(text) - escape < 512:
+            text, self.pending_output = text[:escape], text[escape:]
+        else:
+            self.pending_output = ""
+
+        position = 0
+        for match in self.MARKER_PATTERN.finditer(text):
+            if not self.ready:
+                # 第一个标记来自设置命令本身
+                self.ready = True
+                position = match.end()
+                continue
+            self.emit_output(text[position:match.start()])
+            position = match.end()
+            self.current_directory = match.group(2)
+            if self.is_busy():
+                self.finish(int(match.group(1)))
+        if self.ready:
+            self.emit_output(text[position:])
+
+    def emit_output(self, text):
+        text = self.ESCAPE_PATTERN.sub("", text)
+        if text:
+            self.output_ready.emit(text, False)
+
+    def on_shell_exited(self):
+        self.notifier.setEnabled(False)
+        self.notifier.deleteLater()
+        os.close(self.master_fd)
+        exit_code = self.shell.wait()
+        self.output_ready.emit("shell 已退出，正在重新启动\n", True)
+        self.start_shell()
+        if self.is_busy():
+            self.finish(exit_code)
+
+    def interrupt(self):
+        if not self.is_busy():
+            return
+        if self.interrupted:
+            self.kill()
+            return
+        self.interrupted = True
+        # 由伪终端把 SIGINT 发给前台进程组
+        os.write(self.master_fd, b"\x03")
+
+    def kill(self):
+        if not self.is_busy():
+            return
+        try:
+            group = os.tcgetpgrp(self.master_fd)
+            # 前台是 shell 自己时只能结束 shell，随后会重新启动
+            os.killpg(group, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def shutdown(self):
+        self.queue.clear()
+        if self.shell is None:
+            return
+        self.notifier.setEnabled(False)
+        try:
+            os.killpg(self.shell.pid, signal.SIGHUP)
+        except OSError:
+            pass
+        self.shell = None
+
+
+def detect_encoding(sample, preferred="utf-8"):
+    """根据文件开头的字节判断编码：先看 BOM，再依次尝试 utf-8、首选编码和 gbk"""
+    for bom, encoding in ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"),
+                          (codecs.BOM_UTF16_BE, "utf-16")):
+        if sample.startswith(bom):
+            return encoding
+
+    # 没有 BOM 的 utf-16 文本中，ASCII 字符的一半字节是 0
+    if sample.count(b"\0") > len(sample) // 4:
+        return "utf-16-le" if sample[1::2].count(0) > sample[0::2].count(0) else "utf-16-be"
+
+    # utf-8 的字节结构很容易校验，放在最前面；utf-16 几乎能解码任意字节，不参与尝试
+    for encoding in dict.fromkeys(["utf-8", preferred, "gbk"]):
+        if encoding.startswith("utf-16"):
+            continue
+        try:
+            # 样本末尾可能截断了多字节字符
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return "latin-1"
+
+
+def known_encoding(encoding):
+    try:
+        codecs.lookup(encoding)
+        return True
+    except LookupError:
+        return False
+
+
+class FileLoader(QObject):
+    """后台线程分块读取并解码文件，界面线程按时间片把文本追加到编辑器"""
+
+    # 已读取的百分比
+    progress = pyqtSignal(int)
+    # 是否完整载入；出错时的错误信息（否则为空）
+    finished = pyqtSignal(bool, str)
+
+    SAMPLE_BYTES = 64 * 1024
+    CHUNK_CHARS = 64 * 1024
+    # 读取线程最多领先界面这么多块，避免整个文件堆在内存中
+    QUEUE_CHUNKS = 8
+    INSERT_INTERVAL_MS = 10
+    INSERT_TIME_SLICE = 0.03
+
+    def __init__(self, editor, parent=None):
+        super().__init__(parent)
+        self.editor = editor
+        self.queue = None
+        self.cancelled = threading.Event()
+        self.path = None
+        self.size = 0
+        # 当前使用的编码，样本之后出现解码错误时依次换用 candidates 中的编码重新载入
+        self.encoding = None
+        self.candidates = []
+        self.newline = "\n"
+        self.insert_timer = QTimer(self)
+        self.insert_timer.setInterval(self.INSERT_INTERVAL_MS)
+        self.insert_timer.timeout.connect(self.insert_pending)
+
+    def is_loading(self):
+        return self.queue is not None
+
+    def start(self, path, preferred_encoding):
+        """开始载入，返回根据样本检测到的编码；文件打不开时抛出 OSError
+
+        编码只根据开头的样本检测，之后的内容解码失败时换用下一个候选编码重新载入，
+        最终使用的编码和换行符在载入完成后见 encoding 和 newline。
+        """
+        with open(path, 'rb') as f:
+            sample = f.read(self.SAMPLE_BYTES)
+        self.encoding = detect_encoding(sample, preferred_encoding)
+        # latin-1 能解码任意字节，保存时原样写回，作为最后的候选
+        self.candidates = [encoding for encoding in dict.fromkeys(["utf-8", preferred_encoding, "gbk", "latin-1"])
+                           if encoding != self.encoding and not encoding.startswith("utf-16") and known_encoding(encoding)]
+        # 载入时统一为 \n，保存时换回文件原来的换行符；读完整个文件后按实际出现的换行符更新
+        self.newline = "\r\n" if "\r\n" in sample.decode(self.encoding, errors='ignore') else "\n"
+        self.path = path
+        self.size = os.path.getsize(path)
+
+        self.editor.begin_load()
+        self.start_reading()
+        self.insert_timer.start()
+        return self.encoding
+
+    def start_reading(self):
+        self.cancelled = threading.Event()
+        self.queue = queue.Queue(self.QUEUE_CHUNKS)
+        threading.Thread(target=self.read, args=(self.path, self.encoding, self.queue, self.cancelled),
+                         daemon=True).start()
+
+    def read(self, path, encoding, chunks, cancelled):
+        def put(item):
+            while not cancelled.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        try:
+            # newline=None 统一换行符，跨块的 \r\n 也能正确处理；严格解码，不把读不懂的字节替换掉
+            with open(path, 'r', encoding=encoding, newline=None) as f:
+                while not cancelled.is_set():
+                    text = f.read(self.CHUNK_CHARS)
+                    if not text:
+                        break
+                    put((text, f.buffer.tell()))
+                # 文本为 None 表示读完，附带文件中出现过的换行符
+                put((None, f.newlines))
+        except (OSError, UnicodeDecodeError) as e:
+            put(e)
+        put(None)
+
+    def insert_pending(self):
+        deadline = time.perf_counter() + self.INSERT_TIME_SLICE
+        while time.perf_counter() < deadline:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is None:
+                self.finish(True, "")
+                return
+            if isinstance(item, UnicodeDecodeError) and self.candidates:
+                self.retry()
+                return
+            if isinstance(item, (OSError, UnicodeDecodeError)):
+                self.finish(False, str(item))
+                return
+            text, position = item
+            if text is None:
+                newlines = position or ()
+                self.newline = "\r\n" if "\r\n" in newlines else "\n"
+                continue
+            self.editor.append_loaded_text(text)
+            self.progress.emit(int(position * 100 / max(1, self.size)))
+
+    def retry(self):
+        """当前编码解码失败，丢弃已载入的部分，换用下一个候选编码"""
+        self.cancelled.set()
+        self.encoding = self.candidates.pop(0)
+        self.editor.restart_load()
+        self.progress.emit(0)
+        self.start_reading()
+
+    def cancel(self):
+        if self.is_loading():
+            self.finish(False, "")
+
+    def finish(self, completed, error):
+        self.insert_timer.stop()
+        self.cancelled.set()
+        self.queue = None
+        self.editor.end_load()
+        self.finished.emit(completed, error)
+
+
+class FileSaver(QObject):
+    """后台线程编码并写入临时文件，fsync 后原子替换目标文件，写到一半失败不会损坏原文件"""
+
+    # 目标路径，错误信息（成功时为空）
+    finished = pyqtSignal(str, str)
+    # 后台线程完成后转到界面线程
+    done = pyqtSignal(str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.saving = False
+        self.done.connect(self.on_done)
+
+    def is_saving(self):
+        return self.saving
+
+    def start(self, path, text, encoding, newline="\n"):
+        self.saving = True
+        threading.Thread(target=self.write, args=(path, text, encoding, newline), daemon=True).start()
+
+    def write(self, path, text, encoding, newline):
+        try:
+            if newline != "\n":
+                text = text.replace("\n", newline)
+            data = text.encode(encoding)
+            self.write_atomic(path, data)
+            self.done.emit(path, "")
+        except UnicodeEncodeError as e:
+            self.done.emit(path, f"第 {text.count(chr(10), 0, e.start) + 1} 行的字符 {text[e.start]!r} 无法用 {encoding} 编码")
+        except (OSError, LookupError) as e:
+            self.done.emit(path, str(e))
+
+    @staticmethod
+    def write_atomic(path, data):
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            # 保留原文件的权限
+            try:
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # 目录项也写入磁盘，断电后不会丢失这次重命名（Windows 上不能打开目录）
+        if hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def on_done(self, path, error):
+        self.saving = False
+        self.finished.emit(path, error)
+
+
+def utf16_length(text):
+    return len(text.encode('utf-16-le', 'surrogatepass')) // 2
+
+
+class EditJournal(QObject):
+    """恢复日志：把文档的增量修改追加写入文件，程序崩溃后重启时回放，恢复未保存的内容
+
+    日志第一行是基准（磁盘上的文件或一段文本），之后每行一条 [位置, 删除数, 插入文本]。
+    修改先在内存中合并，定时交给后台线程追加写入，按键时不做文件操作；
+    日志比基准大时，后台线程把日志中的修改回放到内存中保存的基准文本上，以结果为新的基准重写日志。
+    """
+
+    DIRECTORY = os.path.join(CONFIG_DIR, "recovery")
+    FLUSH_INTERVAL_MS = 1000
+    COMPACT_MIN_BYTES = 1024 * 1024
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.path = os.path.join(self.DIRECTORY, f"journal-{os.getpid()}.jsonl")
+        # [[位置, 删除数, 插入文本]]，等待写入
+        self.pending = []
+        # 已记录的修改数，用来判断保存期间是否有新的修改
+        self.sequence = 0
+        self.requests = queue.Queue()
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.timeout.connect(self.flush)
+
+    @staticmethod
+    def file_base(path, encoding, newline):
+        stat = os.stat(path)
+        return {'kind': 'file', 'file': os.path.abspath(path), 'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns, 'encoding': encoding, 'newline': newline}
+
+    @staticmethod
+    def text_base(text, path, encoding, newline):
+        return {'kind': 'text', 'text': text, 'file': path, 'encoding': encoding, 'newline': newline}
+
+    def record(self, position, removed, text):
+        self.sequence += 1
+        if self.pending:
+            last = self.pending[-1]
+            # 连续输入和连续退格合并成一条
+            if removed == 0 and position == self.pending_end:
+                last[2] += text
+                self.pending_end += utf16_length(text)
+                return
+            if not text and not last[2] and position + removed == last[0]:
+                last[0] = position
+                last[1] += removed
+                self.pending_end = position
+                return
+        self.pending.append([position, removed, text])
+        # 最后一条插入文本之后的位置，大段粘贴后继续输入时不必重新计算
+        self.pending_end = position + utf16_length(text)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start(self.FLUSH_INTERVAL_MS)
+
+    def flush(self):
+        self.flush_timer.stop()
+        if self.pending:
+            self.requests.put(('edits', self.pending))
+            self.pending = []
+
+    def reset(self, base):
+        """以 base 为新的基准重写日志，之前的修改都已包含在基准中"""
+        self.flush_timer.stop()
+        self.pending = []
+        self.requests.put(('base', base))
+
+    def discard(self):
+        """正常退出时删除日志，等待后台线程完成"""
+        self.flush_timer.stop()
+        self.pending = []
+        self.requests.put(('discard', None))
+        self.writer.join(2)
+
+    def write_loop(self):
+        journal = None
+        base_bytes = edit_bytes = 0
+        # 当前基准的文本；基准文件读不出来时为 None，不压缩，只追加
+        base_text = None
+        while True:
+            kind, data = self.requests.get()
+            try:
+                if kind == 'edits':
+                    if journal is None:
+                        continue
+                    lines = ''.join(json.dumps(edit, ensure_ascii=False) + '\n' for edit in data)
+                    journal.write(lines)
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                    edit_bytes += len(lines)
+                    if edit_bytes > max(self.COMPACT_MIN_BYTES, base_bytes) and base_text is not None:
+                        try:
+                            journal, base_bytes, base_text = self.compact(journal, base_text)
+                            edit_bytes = 0
+                        except (OSError, ValueError) as e:
+                            # 压缩失败时原日志仍然完整，继续追加
+                            sys.stderr.write(f"恢复日志压缩失败: {e}\n")
+                            base_text = None
+                elif kind == 'base':
+                    if journal is not None:
+                        journal.close()
+                    journal, base_bytes = self.write_base(data)
+                    # 基准是磁盘文件时按文件大小判断是否需要压缩
+                    base_bytes = data.get('size', base_bytes)
+                    edit_bytes = 0
+                    try:
+                        base_text = self.base_text(data)
+                    except (OSError, ValueError, LookupError):
+                        base_text = None
+                else:
+                    if journal is not None:
+                        journal.close()
+                    if os.path.exists(self.path):
+                        os.remove(self.path)
+                    return
+            except (OSError, ValueError) as e:
+                # 日志写不了时不影响编辑，只是无法恢复
+                sys.stderr.write(f"恢复日志写入失败: {e}\n")
+                journal = None
+
+    def compact(self, journal, base_text):
+        """把日志中的修改回放到 base_text 上，以结果为新的基准重写日志，返回 (日志, 基准字节数, 新的基准文本)"""
+        # 基准文件之后可能在磁盘上被修改，用写基准时读入内存的文本回放
+        with open(self.path, 'r', encoding='utf-8', errors='surrogatepass') as f:
+            base = json.loads(f.readline())['base']
+            text = self.apply_edits(base_text, f)
+        new_journal, base_bytes = self.write_base(self.text_base(text, base['file'], base['encoding'], base['newline']))
+        journal.close()
+        return new_journal, base_bytes, text
+
+    def write_base(self, base):
+        os.makedirs(self.DIRECTORY, exist_ok=True)
+        line = json.dumps({'base': base}, ensure_ascii=False) + '\n'
+        tmp_path = self.path + '.tmp'
+        # 编辑中可能出现被拆开的代理对，按原样写入
+        with open(tmp_path, 'w', encoding='utf-8', errors='surrogatepass') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        return open(self.path, 'a', encoding='utf-8', errors='surrogatepass'), len(line)
+
+    @staticmethod
+    def base_text(base):
+        """基准对应的文本；基准文件在之后被修改过时抛出 ValueError"""
+        if base['kind'] != 'file':
+            return base['text']
+        stat = os.stat(base['file'])
+        if (stat.st_size, stat.st_mtime_ns) != (base['size'], base['mtime_ns']):
+            raise ValueError(f"{base['file']} 在日志记录之后被修改过")
+        with open(base['file'], 'r', encoding=base['encoding'], errors='replace', newline=None) as source:
+            return source.read()
+
+    @staticmethod
+    def apply_edits(text, lines):
+        """在 text 上依次回放日志中的修改行，返回结果"""
+        # 位置以 UTF-16 单元计，在 UTF-16 字节上回放
+        units = bytearray(text.encode('utf-16-le', 'surrogatepass'))
+        for line in lines:
+            try:
+                position, removed, inserted = json.loads(line)
+            except ValueError:
+                # 崩溃时最后一行可能只写了一半
+                break
+            start = min(position * 2, len(units))
+            units[start:start + removed * 2] = inserted.encode('utf-16-le', 'surrogatepass')
+        return units.decode('utf-16-le', 'surrogatepass')
+
+    @classmethod
+    def replay(cls, path):
+        """回放日志，返回 (基准, 恢复的文本)；基准文件在之后被修改过时抛出 ValueError"""
+        with open(path, 'r', encoding='utf-8', errors='surrogatepass') as f:
+            base = json.loads(f.readline())['base']
+            return base, cls.apply_edits(cls.base_text(base), f)
+
+    @classmethod
+    def orphaned_journals(cls):
+        """其他 PyEdit 进程留下且进程已不存在的日志"""
+        try:
+            names = os.listdir(cls.DIRECTORY)
+        except OSError:
+            return []
+        paths = []
+        for name in names:
+            match = re.fullmatch(r'journal-(\d+)\.jsonl', name)
+            if match and int(match.group(1)) != os.getpid() and not process_alive(int(match.group(1))):
+                paths.append(os.path.join(cls.DIRECTORY, name))
+        return paths
+
+
+def process_alive(pid):
+    if os.name != 'posix':
+        # Windows 上 os.kill 会结束进程，无法用来探测
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
 class PyEditIDE(QMainWindow):
     def __init__(self):
         super().__init__()
         self.current_file = None
         self.current_encoding = "utf-8"
-        self.is_running = False
+        self.current_newline = "\n"
         self.terminal_expanded = False
-        self.terminal_manager = TerminalManager()
+        # 有 bash 的 POSIX 系统上使用常驻 shell，否则每条命令启动一个进程
+        if PtyTerminalManager.available():
+            self.terminal_manager = PtyTerminalManager(self)
+        else:
+            self.terminal_manager = TerminalManager(self)
+        self.terminal_manager.output_ready.connect(self.append_terminal_output)
+        self.terminal_manager.command_started.connect(self.on_terminal_command_started)
+        self.terminal_manager.command_finished.connect(self.on_terminal_command_finished)
         self.terminal_history = []
         self.current_platform = self.detect_platform()
+
+        # 代码在子进程中运行，输出边运行边显示
+        self.run_engine = RunEngine(self)
+        self.run_engine.output_ready.connect(self.append_output)
+        self.run_engine.run_finished.connect(self.on_run_finished)
+        self.run_engine.first_output.connect(self.on_run_first_output)
+
+        # 单元格模式：在常驻内核中只运行有变化的单元格
+        self.cell_runner = CellRunner(self)
+        self.cell_runner.output_ready.connect(self.append_output)
+        self.cell_runner.cell_started.connect(self.on_cell_started)
+        self.cell_runner.run_finished.connect(self.on_cells_finished)
+        self.run_has_output = False
+        self.run_options = None
+
+        # 热度运行期间定时读取子进程写出的逐行统计
+        self.heat_timer = QTimer(self)
+        self.heat_timer.setInterval(250)
+        self.heat_timer.timeout.connect(self.refresh_heat)
+        self.heat_mtime = None
+
         self.init_ui()
 
+        # 大文件分块载入，不阻塞界面
+        self.file_loader = FileLoader(self.code_editor, self)
+        self.file_loader.progress.connect(self.load_progress.setValue)
+        self.file_loader.finished.connect(self.on_file_loaded)
+
+        # 保存在后台线程中编码和写入
+        self.file_saver = FileSaver(self)
+        self.file_saver.finished.connect(self.on_file_saved)
+        self.save_snapshot = None
+        self.close_after_save = False
+        self.code_editor.modification_changed.connect(self.setWindowModified)
+        self.save_sequence = 0
+        self.update_status()
+
+        # 恢复日志：记录未保存的修改，崩溃后重启时恢复
+        self.edit_journal = EditJournal(self)
+        self.code_editor.text_edited.connect(self.edit_journal.record)
+        self.reset_journal()
+        QTimer.singleShot(0, self.recover_from_journals)
+
     def detect_platform(self):
         system = platform.system().lower()
         if system == "windows":
@@ -738,7 +4123,23 @@ class PyEditIDE(QMainWindow):
 
         toolbar.addAction("新建", self.open_new_file_dialog)
         toolbar.addAction("打开", self.open_file)
+        save_action = toolbar.addAction("保存", self.save_file)
+        save_action.setShortcut(QKeySequence.StandardKey.Save)
+        save_as_action = toolbar.addAction("另存为", self.save_file_as)
+        save_as_action.setShortcut(QKeySequence("Ctrl+Shift+S"))
         toolbar.addAction("运行", self.run_code)
+        toolbar.addAction("性能分析", self.run_profiled)
+        toolbar.addAction("热度运行", self.run_heat)
+        self.profile_memory_action = toolbar.addAction("记录内存")
+        self.profile_memory_action.setCheckable(True)
+        # 热度运行默认只采样；精确计数要处理每个行事件，运行会慢数倍
+        self.heat_exact_action = toolbar.addAction("精确计数")
+        self.heat_exact_action.setCheckable(True)
+        run_cell_action = toolbar.addAction("运行单元格", self.run_cells)
+        run_cell_action.setShortcut(QKeySequence("Ctrl+Return"))
+        toolbar.addAction("重启内核", self.restart_kernel)
+        self.stop_action = toolbar.addAction("停止", self.stop_code)
+        self.stop_action.setEnabled(False)
         toolbar.addAction("终端", self.toggle_terminal)
 
     def create_code_editor(self, parent_layout):
@@ -755,9 +4156,9 @@ class PyEditIDE(QMainWindow):
         output_group = QGroupBox("输出结果")
         output_layout = QVBoxLayout()
 
-        self.output_area = QTextEdit()
-        self.output_area.setReadOnly(True)
+        self.output_area = OutputConsole()
         self.output_area.setFont(QFont("Consolas", 10))
+        self.output_area.spill_started.connect(self.on_output_spilled)
 
         output_layout.addWidget(self.output_area)
         output_group.setLayout(output_layout)
@@ -767,11 +4168,11 @@ class PyEditIDE(QMainWindow):
         self.terminal_group = QGroupBox("终端")
         terminal_layout = QVBoxLayout()
 
-        self.terminal_output = QTextEdit()
-        self.terminal_output.setReadOnly(True)
+        self.terminal_output = OutputConsole()
         self.terminal_output.setFont(QFont("Consolas", 10))
         self.terminal_output.setStyleSheet("background-color: black; color: white;")
-        self.terminal_output.setText(self.terminal_manager.get_prompt())
+        self.terminal_output.append_text(self.terminal_manager.get_prompt())
+        self.terminal_prompt_shown = True
 
         terminal_layout.addWidget(self.terminal_output)
 
@@ -784,6 +4185,14 @@ class PyEditIDE(QMainWindow):
         send_btn.clicked.connect(self.execute_terminal_command)
         input_layout.addWidget(send_btn)
 
+        # 中断正在执行的命令，再按一次强制结束
+        interrupt_btn = QPushButton("中断")
+        interrupt_btn.clicked.connect(self.terminal_manager.interrupt)
+        input_layout.addWidget(interrupt_btn)
+        interrupt_shortcut = QShortcut(QKeySequence("Ctrl+C"), self.terminal_input)
+        interrupt_shortcut.setContext(Qt.ShortcutContext.WidgetShortcut)
+        interrupt_shortcut.activated.connect(self.interrupt_terminal)
+
         clear_btn = QPushButton("清空")
         clear_btn.clicked.connect(self.clear_terminal)
         input_layout.addWidget(clear_btn)
@@ -796,6 +4205,17 @@ class PyEditIDE(QMainWindow):
     def create_status_bar(self):
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
+
+        # 载入文件的进度和取消按钮，只在载入期间显示
+        self.load_progress = QProgressBar()
+        self.load_progress.setRange(0, 100)
+        self.load_progress.setMaximumWidth(200)
+        self.load_progress.hide()
+        self.status_bar.addPermanentWidget(self.load_progress)
+        self.cancel_load_button = QPushButton("取消载入")
+        self.cancel_load_button.clicked.connect(lambda: self.file_loader.cancel())
+        self.cancel_load_button.hide()
+        self.status_bar.addPermanentWidget(self.cancel_load_button)
         self.status_bar.showMessage(
             f"平台: {self.current_platform} | 编码: {self.current_encoding} | 文件: {self.current_file or '未打开文件'}")
 
@@ -831,87 +4251,359 @@ class PyEditIDE(QMainWindow):
             QMessageBox.warning(self, "提示", "请输入文件名")
             return
 
+        self.file_loader.cancel()
         self.current_file = filename
         self.current_encoding = encoding
+        self.current_newline = "\n"
         self.code_editor.setPlainText("# 新建文件\nprint('Hello PyEdit!')\n")
         self.output_area.clear()
         dialog.accept()
         self.update_status()
+        self.reset_journal()
 
     def open_file(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "打开文件", "", "Python Files (*.py);;All Files (*)")
 
-        if file_path:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-
-                self.current_file = file_path
-                self.code_editor.setPlainText(content)
-                self.output_area.clear()
-                self.update_status()
-                QMessageBox.information(self, "提示", f"已打开文件: {file_path}")
-            except Exception as e:
-                QMessageBox.critical(self, "错误", f"打开文件失败: {e}")
-
-    def run_code(self):
-        if self.is_running:
-            QMessageBox.warning(self, "提示", "代码正在执行中，请稍候...")
+        if not file_path:
+            return
+        self.file_loader.cancel()
+        try:
+            encoding = self.file_loader.start(file_path, self.current_encoding)
+        except OSError as e:
+            QMessageBox.critical(self, "错误", f"打开文件失败: {e}")
             return
 
-        code = self.code_editor.toPlainText()
-        if not code:
-            QMessageBox.warning(self, "提示", "没有代码可执行")
+        self.current_file = file_path
+        self.current_encoding = encoding
+        self.current_newline = self.file_loader.newline
+        self.output_area.clear()
+        self.update_status()
+        self.load_progress.setValue(0)
+        self.load_progress.show()
+        self.cancel_load_button.show()
+
+    def on_file_loaded(self, completed, error):
+        self.load_progress.hide()
+        self.cancel_load_button.hide()
+        # 样本之后的内容可能需要换用其他编码，换行符也在读完整个文件后才确定
+        self.current_encoding = self.file_loader.encoding
+        self.current_newline = self.file_loader.newline
+        if completed:
+            self.code_editor.mark_saved()
+            self.update_status()
+            self.reset_journal()
+            QMessageBox.information(self, "提示", f"已打开文件: {self.current_file}")
             return
 
-        self.is_running = True
-        self.output_area.setText("代码执行中...\n")
+        # 只载入了一部分，不再关联原文件，避免保存时截断它
+        file_path, self.current_file = self.current_file, None
+        self.update_status()
+        self.reset_journal()
+        if error:
+            QMessageBox.critical(self, "错误", f"打开文件失败: {error}")
+        else:
+            self.status_bar.showMessage(f"已取消载入 {file_path}，只显示了已载入的部分", 10000)
 
-        def execute_code():
+    def reset_journal(self):
+        """当前内容作为恢复日志的新基准；文件已保存且未修改时只记录文件位置"""
+        if self.current_file and not self.code_editor.modified:
             try:
-                import io
-                import sys
-                from contextlib import redirect_stdout, redirect_stderr
+                base = EditJournal.file_base(self.current_file, self.current_encoding, self.current_newline)
+            except OSError:
+                base = None
+            if base is not None:
+                self.edit_journal.reset(base)
+                return
+        self.edit_journal.reset(EditJournal.text_base(self.code_editor.toPlainText(), self.current_file,
+                                                      self.current_encoding, self.current_newline))
 
-                old_stdout = sys.stdout
-                old_stderr = sys.stderr
-                sys.stdout = io.StringIO()
-                sys.stderr = io.StringIO()
+    def recover_from_journals(self):
+        for path in EditJournal.orphaned_journals():
+            try:
+                base, text = EditJournal.replay(path)
+            except (OSError, ValueError, KeyError, LookupError) as e:
+                QMessageBox.warning(self, "提示", f"无法从恢复日志 {path} 恢复: {e}")
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+                continue
+
+            # 与磁盘上的文件（未命名时为空文档）相同，说明崩溃时没有未保存的修改
+            original = "" if base['file'] is None else None
+            if base['file'] and os.path.exists(base['file']):
+                try:
+                    with open(base['file'], 'r', encoding=base['encoding'], errors='replace', newline=None) as f:
+                        original = f.read()
+                except (OSError, LookupError, UnicodeError):
+                    # 读不出来时按内容不同处理，交给用户决定
+                    original = None
+            if text == original:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+                continue
+
+            name = base['file'] or "未命名文件"
+            answer = QMessageBox.question(self, "恢复", f"PyEdit 上次没有正常退出，{name} 有未保存的修改，是否恢复？")
+            if answer == QMessageBox.StandardButton.Yes:
+                self.file_loader.cancel()
+                self.current_file = base['file']
+                self.current_encoding = base['encoding']
+                self.current_newline = base['newline']
+                self.code_editor.setPlainText(text)
+                self.code_editor.update_modified()
+                self.update_status()
+                self.reset_journal()
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            if answer == QMessageBox.StandardButton.Yes:
+                # 编辑器只有一个缓冲区，只恢复一份
+                return
 
-                compiled_code = compile(code, '<string>', 'exec')
-                exec(compiled_code, {})
+    def save_file(self):
+        if self.current_file is None:
+            return self.save_file_as()
+        return self.start_save(self.current_file)
+
+    def save_file_as(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "另存为", self.current_file or "",
+                                                   "Python Files (*.py);;All Files (*)")
+        if not file_path:
+            return False
+        return self.start_save(file_path)
+
+    def start_save(self, file_path):
+        if self.file_loader.is_loading():
+            self.status_bar.showMessage("文件正在载入，载入完成后才能保存", 5000)
+            return False
+        if self.file_saver.is_saving():
+            self.status_bar.showMessage("正在保存，请稍候", 5000)
+            return False
+
+        # 记录开始保存时的内容，保存期间的修改在保存完成后仍算未保存
+        self.code_editor.flush_stale_blocks()
+        self.save_snapshot = self.code_editor.block_hashes.snapshot()
+        self.save_sequence = self.edit_journal.sequence
+        self.file_saver.start(file_path, self.code_editor.toPlainText(), self.current_encoding, self.current_newline)
+        self.status_bar.showMessage(f"正在保存 {file_path}...")
+        return True
+
+    def on_file_saved(self, file_path, error):
+        snapshot, self.save_snapshot = self.save_snapshot, None
+        if error:
+            self.close_after_save = False
+            QMessageBox.critical(self, "错误", f"保存文件失败: {error}")
+            return
 
-                output = sys.stdout.getvalue()
-                error = sys.stderr.getvalue()
+        self.current_file = file_path
+        self.code_editor.mark_saved(snapshot)
+        self.update_status()
+        # 保存期间没有新的修改时，日志改为以刚保存的文件为基准
+        if self.edit_journal.sequence == self.save_sequence:
+            self.reset_journal()
+        self.status_bar.showMessage(f"已保存 {file_path}（{self.current_encoding}）", 5000)
+        if self.close_after_save:
+            self.close()
+
+    def closeEvent(self, event):
+        self.code_editor.flush_stale_blocks()
+        if not self.code_editor.modified or self.close_after_save and not self.file_saver.is_saving():
+            self.edit_journal.discard()
+            event.accept()
+            return
 
-                sys.stdout = old_stdout
-                sys.stderr = old_stderr
+        answer = QMessageBox.question(
+            self, "提示", "文件有未保存的修改，是否保存？",
+            QMessageBox.StandardButton.Save | QMessageBox.StandardButton.Discard | QMessageBox.StandardButton.Cancel)
+        if answer == QMessageBox.StandardButton.Discard:
+            self.edit_journal.discard()
+            event.accept()
+            return
+        # 保存在后台进行，完成后再关闭窗口
+        if answer == QMessageBox.StandardButton.Save and self.save_file():
+            self.close_after_save = True
+        event.ignore()
 
-                result = ""
-                if output:
-                    result += f"输出:\n{output}\n"
-                if error:
-                    result += f"错误:\n{error}\n"
-                if not output and not error:
-                    result = "代码执行完成，无输出"
+    def run_code(self):
+        self.start_run()
+
+    def run_profiled(self):
+        # 在子进程中用 cProfile 运行，结果写入临时目录，运行结束后显示
+        directory = tempfile.mkdtemp(prefix="pyedit-profile-")
+        options = {'profile': {'directory': directory, 'memory': self.profile_memory_action.isChecked()}}
+        if not self.start_run(options):
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def run_heat(self):
+        # 子进程统计每行的执行次数和耗时，运行中不断写入临时目录
+        directory = tempfile.mkdtemp(prefix="pyedit-heat-")
+        if not self.start_run({'heat': {'directory': directory, 'exact': self.heat_exact_action.isChecked()}}):
+            shutil.rmtree(directory, ignore_errors=True)
+            return
+        self.heat_mtime = None
+        self.code_editor.clear_heat()
+        self.heat_timer.start()
 
-                QMetaObject.invokeMethod(self, "update_output", Qt.ConnectionType.QueuedConnection, Q_ARG(str, result))
+    def refresh_heat(self):
+        options = self.run_options or {}
+        if 'heat' not in options:
+            return
+        path = os.path.join(options['heat']['directory'], 'heat.json')
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self.heat_mtime:
+            return
+        self.heat_mtime = mtime
+        report = read_json(path, None)
+        if report:
+            self.code_editor.set_heat({int(line): count for line, count in report['hits'].items()},
+                                      {int(line): seconds for line, seconds in report['times'].items()},
+                                      report.get('exact', True))
+
+    def start_run(self, options=None):
+        if self.run_engine.is_running() or self.cell_runner.is_running():
+            QMessageBox.warning(self, "提示", "代码正在执行中，请稍候...")
+            return False
 
-            except SyntaxError as e:
-                error_msg = f"语法错误: {e.msg}\n位于第{e.lineno}行，第{e.offset}列"
-                QMetaObject.invokeMethod(self, "update_output", Qt.ConnectionType.QueuedConnection,
-                                         Q_ARG(str, error_msg))
-            except Exception as ex:
-                QMetaObject.invokeMethod(self, "update_output", Qt.ConnectionType.QueuedConnection,
-                                         Q_ARG(str, f"执行错误: {ex}"))
-            finally:
-                self.is_running = False
+        code = self.code_editor.toPlainText()
+        if not code:
+            QMessageBox.warning(self, "提示", "没有代码可执行")
+            return False
 
-        threading.Thread(target=execute_code, daemon=True).start()
+        limits = self.run_limits()
+        if limits:
+            options = {**(options or {}), 'limits': limits}
 
-    @pyqtSlot(str)
-    def update_output(self, text):
-        self.output_area.setText(text)
+        filename, working_directory = self.run_location()
+        self.run_has_output = False
+        self.run_options = options
+        self.output_area.clear()
+        self.output_area.append_text("代码执行中...\n")
+        self.stop_action.setEnabled(True)
+        self.run_engine.start(code, filename, working_directory, options)
+        return True
+
+    def run_limits(self):
+        """从设置中读取这次运行的资源上限，每次运行时读取，修改设置后不需要重启"""
+        settings = load_settings()
+        limits = {'cpu': settings["run_cpu_limit_seconds"],
+                  'wall': settings["run_wall_limit_seconds"],
+                  'memory': int(settings["run_memory_limit_mb"] * 1024 * 1024)}
+        return {name: value for name, value in limits.items() if value}
+
+    def run_location(self):
+        """返回运行代码时使用的 (文件名, 工作目录)"""
+        if self.current_file:
+            filename = os.path.abspath(self.current_file)
+            return filename, os.path.dirname(filename)
+        return "<editor>", os.getcwd()
+
+    def run_cells(self):
+        if self.run_engine.is_running() or self.cell_runner.is_running():
+            QMessageBox.warning(self, "提示", "代码正在执行中，请稍候...")
+            return
+
+        filename, working_directory = self.run_location()
+        line = self.code_editor.textCursor().blockNumber()
+        plan = self.cell_runner.run(self.code_editor.toPlainText(), line, filename, working_directory)
+        if plan:
+            self.stop_action.setEnabled(True)
+            self.status_bar.showMessage(f"运行 {len(plan)} 个单元格: " +
+                                        ", ".join(str(cell.index + 1) for cell in plan), 10000)
+
+    def restart_kernel(self):
+        self.cell_runner.restart()
+        self.output_area.append_text("内核已重启\n")
+
+    def on_cell_started(self, cell):
+        self.output_area.append_text(f"[单元格 {cell.index + 1}，第 {cell.start + 1} 行]\n")
+
+    def on_cells_finished(self, ok):
+        self.stop_action.setEnabled(False)
+        if not ok:
+            self.output_area.append_text("单元格运行未完成，后面的单元格没有运行\n", True)
+
+    def stop_code(self):
+        if self.cell_runner.is_running():
+            self.cell_runner.stop()
+        self.run_engine.stop()
+
+    def append_output(self, text, is_error=False):
+        self.run_has_output = True
+        self.output_area.append_text(text, is_error)
+
+    def on_output_spilled(self, path):
+        self.status_bar.showMessage(f"输出超过 {self.output_area.scrollback} 行，完整输出保存在 {path}（右键可打开）", 10000)
+
+    def on_run_first_output(self, seconds, warm):
+        source = "预热解释器" if warm else "新启动的解释器"
+        self.status_bar.showMessage(f"启动到首次输出: {seconds * 1000:.0f} ms（{source}）", 10000)
+
+    def on_run_finished(self, exit_code, report):
+        self.stop_action.setEnabled(False)
+        limits = (self.run_options or {}).get('limits', {})
+        if report['limit'] == 'wall':
+            self.append_output(f"\n超出运行时间限制 {limits['wall']} 秒，代码执行已停止\n", True)
+        elif hasattr(signal, 'SIGXCPU') and report['exit'] == -signal.SIGXCPU:
+            self.append_output(f"\n超出 CPU 时间限制 {limits.get('cpu')} 秒，代码执行已停止\n", True)
+        elif exit_code == -1:
+            self.append_output("\n代码执行已停止\n", True)
+        elif not self.run_has_output:
+            self.append_output("代码执行完成，无输出\n")
+        else:
+            self.append_output(f"\n代码执行完成，退出码 {exit_code}\n")
+        self.append_output(self.format_run_report(report))
+
+        if self.run_options and 'heat' in self.run_options:
+            self.heat_timer.stop()
+            self.refresh_heat()
+            shutil.rmtree(self.run_options['heat']['directory'], ignore_errors=True)
+
+        options, self.run_options = self.run_options, None
+        if options and 'profile' in options:
+            self.show_profile_report(options['profile']['directory'])
+
+    @staticmethod
+    def format_run_report(report):
+        status = report['exit']
+        if status < 0:
+            try:
+                status = f"信号 {signal.Signals(-status).name}"
+            except ValueError:
+                status = "异常结束"
+        else:
+            status = f"退出码 {status}"
+
+        usage = report['usage']
+        if usage is None:
+            return f"[{status}，资源用量不可用]\n"
+        max_rss = "未知" if usage['max_rss'] is None else f"{usage['max_rss'] / (1024 * 1024):.1f} MB"
+        return (f"[{status}，用户 CPU {usage['user']:.2f} 秒，系统 CPU {usage['sys']:.2f} 秒，"
+                f"最大内存 {max_rss}]\n")
+
+    def show_profile_report(self, directory):
+        report = ProfileReport(directory)
+        if not report.stats:
+            report.cleanup()
+            self.status_bar.showMessage("没有得到性能分析结果", 10000)
+            return
+        dialog = ProfileDialog(report, self)
+        dialog.location_activated.connect(self.go_to_location)
+        dialog.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        dialog.show()
+
+    def go_to_location(self, filename, line):
+        # 只能跳转到编辑器中正在编辑的文件
+        current, _ = self.run_location()
+        if filename != current or line < 1:
+            return
+        block = self.code_editor.document().findBlockByNumber(line - 1)
+        if block.isValid():
+            cursor = self.code_editor.textCursor()
+            cursor.setPosition(block.position())
+            self.code_editor.setTextCursor(cursor)
+            self.code_editor.centerCursor()
+            self.code_editor.setFocus()
 
     def toggle_terminal(self):
         self.terminal_expanded = not self.terminal_expanded
@@ -921,37 +4613,55 @@ class PyEditIDE(QMainWindow):
         command = self.terminal_input.text().strip()
         if not command:
             return
+        self.terminal_input.clear()
 
-        self.terminal_history.append(f"{self.terminal_manager.get_prompt()}{command}")
-
-        def run_command():
-            stdout, stderr = self.terminal_manager.execute_command(command)
-
-            output_lines = []
-            if stdout:
-                output_lines.append(stdout)
-            if stderr:
-                output_lines.append(stderr)
+        if command == "clear":
+            self.clear_terminal()
+            return
 
-            output_lines.append(self.terminal_manager.get_prompt())
+        self.terminal_history.append(f"{self.terminal_manager.get_prompt()}{command}")
+        waiting = self.terminal_manager.submit(command)
+        if waiting:
+            self.terminal_output.append_text(f"(排队中，前面还有 {waiting} 条命令) {command}\n")
+
+    def interrupt_terminal(self):
+        # 有选中文本时保持复制行为
+        if self.terminal_input.hasSelectedText():
+            self.terminal_input.copy()
+        else:
+            self.terminal_manager.interrupt()
 
-            output_text = f"{self.terminal_manager.get_prompt()}{command}\n" + "\n".join(output_lines)
+    def append_terminal_output(self, text, is_error):
+        self.terminal_output.append_text(text, is_error)
 
-            QMetaObject.invokeMethod(self.terminal_output, "append", Qt.ConnectionType.QueuedConnection,
-                                     Q_ARG(str, output_text))
-            QMetaObject.invokeMethod(self.terminal_input, "clear", Qt.ConnectionType.QueuedConnection)
+    def on_terminal_command_started(self, command):
+        # 空闲时提示符已经显示在最后一行
+        prompt = "" if self.terminal_prompt_shown else self.terminal_manager.get_prompt()
+        self.terminal_prompt_shown = False
+        self.terminal_output.append_text(f"{prompt}{command}\n")
 
-        threading.Thread(target=run_command, daemon=True).start()
+    def on_terminal_command_finished(self, command, exit_code, seconds):
+        self.terminal_output.append_text(f"[退出码 {exit_code}，用时 {seconds:.2f} 秒]\n", exit_code != 0)
+        if self.terminal_manager.is_idle():
+            self.terminal_output.append_text(self.terminal_manager.get_prompt())
+            self.terminal_prompt_shown = True
 
     def clear_terminal(self):
-        self.terminal_output.setText(self.terminal_manager.get_prompt())
+        self.terminal_output.clear()
+        if self.terminal_manager.is_idle():
+            self.terminal_output.append_text(self.terminal_manager.get_prompt())
+        self.terminal_prompt_shown = self.terminal_manager.is_idle()
 
     def update_status(self):
+        name = os.path.basename(self.current_file) if self.current_file else "未命名"
+        self.setWindowTitle(f"{name}[*] - PyEdit IDE - {self.current_platform.upper()}")
+        self.setWindowModified(self.code_editor.modified)
         self.status_bar.showMessage(
             f"平台: {self.current_platform} | 编码: {self.current_encoding} | 文件: {self.current_file or '未打开文件'}")
 
 
 def main():
+    from qt_material import apply_stylesheet
     app = QApplication(sys.argv)
     apply_stylesheet(app, theme='dark_teal.xml')
 
@@ -0,0 +1,932 @@
+"""PyEdit 子进程工作程序（不依赖Qt）
+
+用法:
+    python pyedit_worker.py introspect        从标准输入逐行读取 JSON 请求，导入模块并返回成员列表
+    python pyedit_worker.py run <文件名>      从标准输入读取源代码，作为 __main__ 运行
+    python pyedit_worker.py warm <模块...>    预先导入模块，然后从标准输入读取一行 JSON 头（filename, cwd）和源代码并运行；
+                                              头中有 profile 时在 cProfile / tracemalloc 下运行，结果写入指定目录；
+                                              头中有 heat 时统计每行的执行次数和耗时，运行中定时写入指定目录；
+                                              头中有 limits 时先设置 CPU 时间（秒）和地址空间（字节）上限
+    python pyedit_worker.py kernel            单元格内核：从标准输入逐行读取 JSON 请求，在同一个命名空间中运行代码
+    python pyedit_worker.py zygote <fd> <模块...>
+                                              预先导入模块后作为 fork 服务器：从 fd 上的 Unix 套接字接收
+                                              标准输入/输出/错误的管道，fork 出子进程按 warm 的方式运行代码；
+                                              子进程退出时报告退出码和资源用量
+    python pyedit_worker.py check <路径...> [-j N]
+                                              用进程池编译目录下所有 .py 文件，每个文件输出一行 JSON 检查结果；
+                                              有语法错误时退出码为 1
+    python pyedit_worker.py highlight <路径...> [--html] [-o 目录] [-j N]
+                                              用编辑器的分词器高亮文件，每个文件输出一行 JSON（token 列表）；
+                                              --html 时输出 HTML：只有一个文件且没有 -o 时直接写到标准输出
+check 和 highlight 也可以通过 python main.py check / highlight 使用，不会导入 Qt；
+结束时在标准错误输出文件数和每秒处理的文件数。
+"""
+import sys
+import os
+import re
+import json
+import io
+import ast
+import keyword
+import time
+import threading
+import platform
+import signal
+import select
+import socket
+import builtins
+import linecache
+import contextlib
+import functools
+import cProfile
+import tracemalloc
+import traceback
+import importlib
+import importlib.util
+try:
+    import resource
+except ImportError:
+    # Windows 上没有 resource，运行不受资源限制
+    resource = None
+
+
+def replace_script_path():
+    # sys.path[0] 是本文件所在目录，换成当前工作目录（用户项目目录）
+    sys.path[0] = os.getcwd()
+
+
+def protocol_stream():
+    """返回用于回复的标准输出副本，并把文件描述符1重定向到标准错误，防止被导入的模块打印内容破坏协议"""
+    stream = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    return stream
+
+
+_packages_distributions = None
+
+
+def module_version(module_name):
+    global _packages_distributions
+    top_level = module_name.split('.')[0]
+    try:
+        from importlib import metadata
+        if _packages_distributions is None:
+            _packages_distributions = metadata.packages_distributions()
+        distributions = _packages_distributions.get(top_level)
+        if distributions:
+            return metadata.version(distributions[0])
+    except Exception:
+        pass
+    # 标准库和未打包的模块以解释器版本为准
+    return platform.python_version()
+
+
+def module_signature(module_name):
+    """不导入模块，返回 (版本, 文件, 修改时间)"""
+    spec = importlib.util.find_spec(module_name)
+    if spec is None:
+        raise ImportError(f"No module named '{module_name}'")
+
+    origin = spec.origin if spec.has_location else None
+    mtime = os.path.getmtime(origin) if origin and os.path.exists(origin) else None
+    return module_version(module_name), origin, mtime
+
+
+def introspect(request):
+    module_name = request['module']
+    reply = {'module': module_name}
+    try:
+        version, origin, mtime = module_signature(module_name)
+        reply.update(version=version, file=origin, mtime=mtime)
+
+        # 缓存仍然有效时不再导入
+        if request.get('version') == version and request.get('mtime') == mtime:
+            reply['unchanged'] = True
+            return reply
+
+        module = importlib.import_module(module_name)
+        reply['members'] = sorted(attr for attr in dir(module) if not attr.startswith('_'))
+    except BaseException as e:
+        reply['error'] = f"{type(e).__name__}: {e}"
+    return reply
+
+
+def serve_introspect():
+    replace_script_path()
+    stream = protocol_stream()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        reply = introspect(json.loads(line))
+        stream.write(json.dumps(reply) + '\n')
+        stream.flush()
+
+
+class Profiling:
+    """在 cProfile（以及可选的 tracemalloc）下运行代码，结束后把结果写入目录
+
+    profile.pstats 为 pstats 格式的函数统计；memory.json 为内存峰值附近按行统计的分配。
+    后台线程定时检查已分配的内存，每增长一定比例拍一次快照，用最大的快照近似峰值时的分配。
+    """
+
+    SAMPLE_INTERVAL = 0.02
+    PEAK_GROWTH = 1.1
+    MIN_SNAPSHOT_SIZE = 1 << 20
+    TOP_LINES = 50
+
+    def __init__(self, options):
+        self.directory = options['directory']
+        self.memory = options.get('memory', False)
+        self.profiler = cProfile.Profile()
+        self.stopped = threading.Event()
+        self.snapshot = None
+        self.snapshot_size = 0
+
+    def __enter__(self):
+        if self.memory:
+            tracemalloc.start()
+            self.sampler = threading.Thread(target=self.sample_memory, daemon=True)
+            self.sampler.start()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        self.profiler.dump_stats(os.path.join(self.directory, 'profile.pstats'))
+        if self.memory:
+            self.stopped.set()
+            self.sampler.join()
+            _, peak = tracemalloc.get_traced_memory()
+            self.take_snapshot(tracemalloc.get_traced_memory()[0])
+            tracemalloc.stop()
+            self.write_memory_report(peak)
+        return False
+
+    def sample_memory(self):
+        while not self.stopped.wait(self.SAMPLE_INTERVAL):
+            current, _ = tracemalloc.get_traced_memory()
+            if current >= self.MIN_SNAPSHOT_SIZE and current > self.snapshot_size * self.PEAK_GROWTH:
+                self.take_snapshot(current)
+
+    def take_snapshot(self, size):
+        if size >= self.snapshot_size:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_size = size
+
+    def write_memory_report(self, peak):
+        lines = []
+        if self.snapshot is not None:
+            snapshot = self.snapshot.filter_traces([
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, threading.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            ])
+            for statistic in snapshot.statistics('lineno')[:self.TOP_LINES]:
+                frame = statistic.traceback[0]
+                lines.append([frame.filename, frame.lineno, statistic.size, statistic.count])
+        report = {'peak': peak, 'snapshot_size': self.snapshot_size, 'lines': lines}
+        with open(os.path.join(self.directory, 'memory.json'), 'w', encoding='utf-8') as f:
+            json.dump(report, f)
+
+
+class LineHeat:
+    """统计用户文件中每行的执行次数和耗时，运行中定时写入 heat.json
+
+    后台线程每毫秒采样一次主线程的调用栈，按最内层属于用户文件的行累计耗时和采样次数；
+    默认只采样，开销很小，次数是采样次数，只是估计。options 中 exact 为真时改由行事件精确计数：
+    有 sys.monitoring 时只为用户文件的代码对象打开局部行事件，否则用 settrace 且只给用户文件的帧
+    返回局部跟踪函数，每个行事件都要调用 Python 函数，运行会慢数倍。
+    """
+
+    SAMPLE_INTERVAL = 0.001
+    WRITE_INTERVAL = 0.2
+
+    def __init__(self, options, code):
+        self.path = os.path.join(options['directory'], 'heat.json')
+        self.exact = options.get('exact', False)
+        self.filename = code.co_filename
+        self.codes = self.nested_codes(code)
+        self.hits = {}
+        self.times = {}
+        self.stopped = threading.Event()
+        self.main_thread = threading.main_thread().ident
+        self.monitoring = getattr(sys, 'monitoring', None)
+        self.started_at = 0.0
+
+    @staticmethod
+    def nested_codes(code):
+        codes = [code]
+        for constant in code.co_consts:
+            if isinstance(constant, type(code)):
+                codes.extend(LineHeat.nested_codes(constant))
+        return codes
+
+    def __enter__(self):
+        if self.exact:
+            self.start_counting()
+        self.started_at = time.perf_counter()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.exact:
+            self.stop_counting()
+        self.stopped.set()
+        self.sampler.join()
+        self.write(done=True)
+        return False
+
+    def start_counting(self):
+        on_line, global_trace = self.make_counters()
+        if self.monitoring is not None:
+            tool = self.monitoring.COVERAGE_ID
+            try:
+                self.monitoring.use_tool_id(tool, 'pyedit')
+            except ValueError:
+                # 预加载的模块（如 coverage）已经占用了这个工具编号，改用 settrace
+                self.monitoring = None
+        if self.monitoring is not None:
+            self.monitoring.register_callback(tool, self.monitoring.events.LINE, on_line)
+            for code in self.codes:
+                self.monitoring.set_local_events(tool, code, self.monitoring.events.LINE)
+        else:
+            threading.settrace(global_trace)
+            sys.settrace(global_trace)
+
+    def stop_counting(self):
+        if self.monitoring is not None:
+            tool = self.monitoring.COVERAGE_ID
+            for code in self.codes:
+                self.monitoring.set_local_events(tool, code, 0)
+            self.monitoring.register_callback(tool, self.monitoring.events.LINE, None)
+            self.monitoring.free_tool_id(tool)
+        else:
+            sys.settrace(None)
+            threading.settrace(None)
+
+    def make_counters(self):
+        """返回行事件回调和 settrace 跟踪函数；用闭包减少每个行事件上的属性查找"""
+        hits = self.hits
+        get = hits.get
+        filename = self.filename
+
+        def on_line(code, line):
+            hits[line] = get(line, 0) + 1
+
+        def local_trace(frame, event, arg):
+            if event == 'line':
+                line = frame.f_lineno
+                hits[line] = get(line, 0) + 1
+            return local_trace
+
+        def global_trace(frame, event, arg):
+            if frame.f_code.co_filename == filename:
+                return local_trace
+            return None
+
+        return on_line, global_trace
+
+    def sample(self):
+        last_sample = last_write = time.perf_counter()
+        while not self.stopped.wait(self.SAMPLE_INTERVAL):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self.main_thread)
+            while frame is not None and frame.f_code.co_filename != self.filename:
+                frame = frame.f_back
+            if frame is not None:
+                line = frame.f_lineno
+                self.times[line] = self.times.get(line, 0.0) + (now - last_sample)
+                if not self.exact:
+                    self.hits[line] = self.hits.get(line, 0) + 1
+            last_sample = now
+            if now - last_write >= self.WRITE_INTERVAL:
+                self.write(done=False)
+                last_write = now
+
+    def write(self, done):
+        # 先写临时文件再替换，IDE 轮询时不会读到写了一半的结果
+        report = {'hits': dict(self.hits), 'times': dict(self.times), 'exact': self.exact,
+                  'elapsed': time.perf_counter() - self.started_at, 'done': done}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f)
+        os.replace(tmp_path, self.path)
+
+
+def run_source(source, filename, instrument=None):
+    """像 python 文件名 一样运行源代码，返回退出码
+
+    instrument(code) 返回包住用户代码运行过程的上下文管理器，用于性能分析和逐行统计。
+    """
+    # 未保存的代码不在磁盘上，登记到 linecache 以便异常信息显示源代码行
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    sys.argv = [filename]
+    namespace = {'__name__': '__main__', '__file__': filename, '__builtins__': builtins}
+
+    try:
+        code = compile(source, filename, 'exec')
+    except SyntaxError as e:
+        sys.stderr.write(syntax_error_message(e))
+        return 1
+
+    try:
+        with instrument(code) if instrument else contextlib.nullcontext():
+            exec(code, namespace)
+    except SystemExit:
+        raise
+    except BaseException as e:
+        # 去掉本文件的调用帧，只显示用户代码
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        return 1
+    return 0
+
+
+def syntax_error_message(e):
+    return f"语法错误: {e.msg}\n位于第{e.lineno}行，第{e.offset}列\n"
+
+
+def serve_run(filename='<editor>'):
+    replace_script_path()
+    source = sys.stdin.read()
+    # 源代码已读完，用户代码中的 input() 得到 EOF 而不是挂起
+    sys.stdin = open(os.devnull)
+    return run_source(source, filename)
+
+
+def preload(modules):
+    for module_name in modules:
+        try:
+            importlib.import_module(module_name)
+        except BaseException as e:
+            sys.stderr.write(f"预加载 {module_name} 失败: {type(e).__name__}: {e}\n")
+
+
+def exit_code(e):
+    """与解释器处理 SystemExit 的方式一致"""
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    sys.stderr.write(f"{e.code}\n")
+    return 1
+
+
+def apply_limits(limits):
+    """在操作系统层面限制本进程的 CPU 时间和地址空间，超出 CPU 时间时进程收到 SIGXCPU 结束"""
+    if resource is None:
+        sys.stderr.write("当前平台不支持资源限制，代码不受限制地运行\n")
+        return
+    if limits.get('cpu'):
+        # 预加载模块已经用掉的 CPU 时间不计入
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        # RLIMIT_CPU 以整秒计
+        seconds = max(1, round(usage.ru_utime + usage.ru_stime + limits['cpu']))
+        resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + 1))
+    if limits.get('memory'):
+        resource.setrlimit(resource.RLIMIT_AS, (limits['memory'], limits['memory']))
+
+
+def usage_report(usage):
+    """把 rusage 转成 IDE 使用的字典；Linux 上 ru_maxrss 以 KB 为单位，macOS 上以字节为单位"""
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {'user': usage.ru_utime, 'sys': usage.ru_stime, 'max_rss': usage.ru_maxrss * scale}
+
+
+def write_usage(path, before):
+    """把本进程从 before 起用掉的 CPU 时间和最大内存写到 path（JSON）"""
+    report = usage_report(resource.getrusage(resource.RUSAGE_SELF))
+    report['user'] -= before.ru_utime
+    report['sys'] -= before.ru_stime
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f)
+    os.replace(tmp_path, path)
+
+
+def run_with_header():
+    """读取 JSON 头和源代码并运行，返回退出码；标准输入在运行前已关闭时直接退出"""
+    line = sys.stdin.readline()
+    if not line.strip():
+        return 0
+    header = json.loads(line)
+    source = sys.stdin.read()
+    sys.stdin = open(os.devnull)
+
+    os.chdir(header['cwd'])
+    sys.path[0] = header['cwd']
+    if header.get('limits'):
+        apply_limits(header['limits'])
+    instrument = None
+    if header.get('profile'):
+        def instrument(code):
+            # 性能分析不需要代码对象
+            return Profiling(header['profile'])
+    elif header.get('heat'):
+        instrument = functools.partial(LineHeat, header['heat'])
+    # 用 QProcess 启动的解释器由 IDE 指定文件报告用量；预加载模块用掉的时间不计入
+    usage_path = header.get('usage')
+    before = resource.getrusage(resource.RUSAGE_SELF) if usage_path and resource else None
+    if before is not None:
+        def on_cpu_limit(signum, frame):
+            # 超出 CPU 时间时先写出用量，再按默认处理结束，退出状态不变
+            write_usage(usage_path, before)
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+        signal.signal(signal.SIGXCPU, on_cpu_limit)
+    try:
+        return run_source(source, header['filename'], instrument)
+    except SystemExit as e:
+        return exit_code(e)
+    finally:
+        if before is not None:
+            write_usage(usage_path, before)
+
+
+def serve_warm(*modules):
+    replace_script_path()
+    preload(modules)
+    return run_with_header()
+
+
+def serve_zygote(control_fd, *modules):
+    replace_script_path()
+    preload(modules)
+    control = socket.socket(fileno=int(control_fd))
+
+    # 子进程退出时通过唤醒管道让 select 返回
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_read, False)
+    os.set_blocking(wakeup_write, False)
+    signal.signal(signal.SIGCHLD, lambda *args: None)
+    signal.set_wakeup_fd(wakeup_write)
+
+    def send(message):
+        """发送失败（IDE 已关闭）时返回 False"""
+        try:
+            control.send(json.dumps(message).encode())
+        except OSError:
+            return False
+        return True
+
+    while True:
+        try:
+            readable, _, _ = select.select([control, wakeup_read], [], [])
+        except InterruptedError:
+            continue
+
+        if wakeup_read in readable:
+            while True:
+                try:
+                    if not os.read(wakeup_read, 512):
+                        break
+                except BlockingIOError:
+                    break
+            while True:
+                try:
+                    pid, status, usage = os.wait4(-1, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if not pid:
+                    break
+                # 被信号结束时退出码为负的信号编号
+                if not send({'pid': pid, 'exit': os.waitstatus_to_exitcode(status), 'usage': usage_report(usage)}):
+                    return 0
+
+        if control in readable:
+            try:
+                message, fds, _, _ = socket.recv_fds(control, 4096, 3)
+            except ConnectionError:
+                message = b''
+            if not message:
+                # IDE 已关闭
+                return 0
+            request = json.loads(message)
+            pid = os.fork()
+            if pid == 0:
+                # 子进程：恢复信号处理，换上 IDE 传来的管道
+                signal.set_wakeup_fd(-1)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                control.close()
+                os.close(wakeup_read)
+                os.close(wakeup_write)
+                for target, fd in enumerate(fds):
+                    os.dup2(fd, target)
+                    os.close(fd)
+                os.setsid()
+                return run_with_header()
+
+            for fd in fds:
+                os.close(fd)
+            if not send({'id': request['id'], 'pid': pid}):
+                return 0
+
+
+class StreamForwarder(io.TextIOBase):
+    """把 print 等写入的文本分批包装成 JSON 消息发给 IDE，由后台线程定时刷新"""
+
+    FLUSH_INTERVAL = 0.05
+    MAX_BUFFERED = 65536
+
+    def __init__(self, name, send):
+        self.name = name
+        self.send = send
+        self.parts = []
+        self.size = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.flush_periodically, daemon=True).start()
+
+    @property
+    def encoding(self):
+        return 'utf-8'
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        with self.lock:
+            self.parts.append(text)
+            self.size += len(text)
+            full = self.size >= self.MAX_BUFFERED
+        if full:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            text = ''.join(self.parts)
+            self.parts = []
+            self.size = 0
+        if text:
+            self.send({'stream': self.name, 'text': text})
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(self.FLUSH_INTERVAL)
+            self.flush()
+
+
+def run_cell(request, namespace):
+    """运行一个单元格，最后一个表达式的值会被打印；返回是否成功"""
+    filename = request['filename']
+    first_line = request['line']
+    source = request['source']
+    # 让异常信息中的行号和源代码行与编辑器一致
+    lines = ['\n'] * first_line + source.splitlines(True)
+    linecache.cache[filename] = (len(source), None, lines, filename)
+    namespace['__file__'] = filename
+
+    try:
+        tree = ast.parse(source, filename)
+        ast.increment_lineno(tree, first_line)
+        last_expression = None
+        if tree.body and isinstance(tree.body[-1], ast.Expr):
+            last_expression = ast.Expression(tree.body.pop().value)
+        code = compile(tree, filename, 'exec')
+        value_code = compile(last_expression, filename, 'eval') if last_expression else None
+    except SyntaxError as e:
+        sys.stderr.write(syntax_error_message(e))
+        return False
+
+    try:
+        exec(code, namespace)
+        if value_code is not None:
+            value = eval(value_code, namespace)
+            if value is not None:
+                print(repr(value))
+    except SystemExit as e:
+        sys.stderr.write(f"SystemExit: {e.code}\n")
+        return False
+    except BaseException as e:
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        return False
+    return True
+
+
+def serve_kernel():
+    replace_script_path()
+    stream = protocol_stream()
+    lock = threading.Lock()
+
+    def send(message):
+        with lock:
+            stream.write(json.dumps(message) + '\n')
+            stream.flush()
+
+    # 请求从原来的标准输入读取，用户代码中的 input() 得到 EOF
+    requests = sys.stdin
+    sys.stdin = open(os.devnull)
+    sys.stdout = StreamForwarder('stdout', send)
+    sys.stderr = StreamForwarder('stderr', send)
+    namespace = {'__name__': '__main__', '__builtins__': builtins}
+
+    while True:
+        try:
+            line = requests.readline()
+        except KeyboardInterrupt:
+            # 空闲时收到的中断没有要停止的代码
+            continue
+        if not line:
+            return 0
+        if not line.strip():
+            continue
+
+        request = json.loads(line)
+        ok = run_cell(request, namespace)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        send({'id': request['id'], 'ok': ok})
+
+
+class PythonTokenizer:
+    """单遍扫描的Python行分词器，不依赖Qt"""
+
+    TOKEN_PATTERN = re.compile('|'.join([
+        r"(?P<triple_string>[rRbBuUfF]{0,2}(?:'{3}(?:\\.|[^\\]|\\$)*?(?:'{3}|$)|\"{3}(?:\\.|[^\\]|\\$)*?(?:\"{3}|$)))",
+        r"""(?P<string>[rRbBuUfF]{0,2}(?:'[^'\\]*(?:\\.[^'\\]*)*'?|"[^"\\]*(?:\\.[^"\\]*)*"?))""",
+        r"(?P<comment>#.*)",
+        r"(?P<decorator>@\w+)",
+        r"(?P<number>\b\d+(?:\.\d+)?\b)",
+        r"(?P<name>\w+)",
+        r"(?P<operator>==|!=|<=|>=|\+=|-=|\*=|/=|%=|\+\+|--|[-+*/%=<>.,:;()\[\]{}])",
+    ]))
+
+    LOGIC_OPERATORS = frozenset(['and', 'or', 'not', 'in', 'is'])
+    BOOLS = frozenset(['True', 'False', 'None'])
+
+    # 行结束时的词法状态（对应 QTextBlock 的 userState）
+    STATE_NORMAL = 0
+    STATE_TRIPLE_SINGLE = 1
+    STATE_TRIPLE_DOUBLE = 2
+
+    # 跨行三引号字符串在后续行中的结束位置
+    TRIPLE_END_PATTERNS = {
+        STATE_TRIPLE_SINGLE: re.compile(r"(?:\\.|[^\\])*?'{3}"),
+        STATE_TRIPLE_DOUBLE: re.compile(r'(?:\\.|[^\\])*?"{3}'),
+    }
+
+    def __init__(self):
+        self.keywords = frozenset(keyword.kwlist)
+        self.builtins = frozenset(name for name in dir(builtins) if not name.startswith('_'))
+
+    def tokenize(self, text, state=STATE_NORMAL):
+        """返回 (tokens, end_state)，tokens 为 (start, length, token_type) 列表，未着色的标识符不输出"""
+        tokens = []
+        pos = 0
+
+        # 上一行留下的未闭合三引号字符串
+        if state in self.TRIPLE_END_PATTERNS:
+            end_match = self.TRIPLE_END_PATTERNS[state].match(text)
+            if not end_match:
+                if text:
+                    tokens.append((0, len(text), 'triple_string'))
+                return tokens, state
+            pos = end_match.end()
+            tokens.append((0, pos, 'triple_string'))
+        state = self.STATE_NORMAL
+
+        prev_word = None
+        for match in self.TOKEN_PATTERN.finditer(text, pos):
+            kind = match.lastgroup
+            start, end = match.span()
+            if kind == 'triple_string':
+                state = self.triple_string_end_state(match.group())
+            if kind != 'name':
+                prev_word = None
+                tokens.append((start, end - start, kind))
+                continue
+
+            word = match.group()
+            token_type = self.classify_name(word, prev_word, text[end:end + 1] == '(')
+            prev_word = word
+            if token_type:
+                tokens.append((start, end - start, token_type))
+        return tokens, state
+
+    def triple_string_end_state(self, token):
+        body = token.lstrip('rRbBuUfF')
+        state = self.STATE_TRIPLE_SINGLE if body[:3] == "'''" else self.STATE_TRIPLE_DOUBLE
+        end_match = self.TRIPLE_END_PATTERNS[state].match(body, 3)
+        if end_match and end_match.end() == len(body):
+            return self.STATE_NORMAL
+        return state
+
+    def classify_name(self, word, prev_word, is_call):
+        # 优先级与规则引擎一致（后匹配的规则覆盖先匹配的）
+        if word in self.LOGIC_OPERATORS:
+            return 'operator'
+        if prev_word == 'import' or prev_word == 'from':
+            return 'import'
+        if prev_word == 'class':
+            return 'class'
+        if is_call:
+            return 'function'
+        if word in self.BOOLS:
+            return 'bool'
+        if word in self.keywords:
+            return 'keyword'
+        if word in self.builtins:
+            return 'builtin'
+        return None
+
+
+# 各类 token 的 (颜色, 是否加粗)，与编辑器高亮器的格式一致，用于导出 HTML
+TOKEN_STYLES = {
+    'triple_string': ("#00AA00", False),
+    'string': ("#00AA00", False),
+    'comment': ("#888888", False),
+    'keyword': ("#FF6B9D", True),
+    'builtin': ("#6B8EFF", False),
+    'bool': ("#DC143C", False),
+    'number': ("#FF8C00", False),
+    'function': ("#32CD32", False),
+    'class': ("#FF1493", False),
+    'decorator': ("#FF4500", False),
+    'import': ("#9370DB", False),
+    'operator': ("#FFD700", False),
+}
+
+
+def python_files(paths):
+    """展开命令行中的路径：目录下的 .py 文件（跳过隐藏目录和 __pycache__）按名称排序，文件原样保留；
+    路径有重叠时同一个文件（按绝对路径）只产生一次"""
+    seen = set()
+
+    def first_time(path):
+        key = os.path.abspath(path)
+        if key in seen:
+            return False
+        seen.add(key)
+        return True
+
+    for path in paths:
+        if not os.path.isdir(path):
+            if first_time(path):
+                yield path
+            continue
+        for directory, subdirectories, files in os.walk(path):
+            subdirectories[:] = sorted(name for name in subdirectories
+                                       if not name.startswith('.') and name != '__pycache__')
+            for name in sorted(files):
+                if name.endswith('.py') and first_time(os.path.join(directory, name)):
+                    yield os.path.join(directory, name)
+
+
+def check_file(path):
+    """像运行代码时一样编译文件，返回 JSON 检查结果"""
+    try:
+        with open(path, 'rb') as f:
+            source = f.read()
+        # 按字节编译，编码声明和 BOM 的处理与解释器一致；SyntaxWarning 不是错误，不输出
+        import warnings
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            compile(source, path, 'exec', dont_inherit=True)
+    except SyntaxError as e:
+        return {'file': path, 'ok': False, 'line': e.lineno, 'column': e.offset, 'message': e.msg}
+    except (OSError, ValueError) as e:
+        return {'file': path, 'ok': False, 'line': None, 'column': None, 'message': str(e)}
+    return {'file': path, 'ok': True}
+
+
+def tokenize_lines(lines):
+    """逐行分词，行间传递三引号字符串状态，与编辑器的高亮结果一致"""
+    tokenizer = PythonTokenizer()
+    state = PythonTokenizer.STATE_NORMAL
+    for line in lines:
+        tokens, state = tokenizer.tokenize(line, state)
+        yield tokens
+
+
+def highlight_html(title, lines):
+    import html
+    styles = ''.join(f".{token_type} {{ color: {color};{' font-weight: bold;' if bold else ''} }}\n"
+                     for token_type, (color, bold) in TOKEN_STYLES.items())
+    body = []
+    for line, tokens in zip(lines, tokenize_lines(lines)):
+        pos = 0
+        for start, length, token_type in tokens:
+            body.append(html.escape(line[pos:start]))
+            body.append(f'<span class="{token_type}">{html.escape(line[start:start + length])}</span>')
+            pos = start + length
+        body.append(html.escape(line[pos:]) + '\n')
+    return (f'<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>{html.escape(title)}</title>\n'
+            f'<style>\nbody {{ background-color: #2b2b2b; color: #e0e0e0; }}\n'
+            f'pre {{ font-family: Consolas, monospace; font-size: 11pt; }}\n{styles}</style>\n</head>\n'
+            f'<body>\n<pre>{"".join(body)}</pre>\n</body>\n</html>\n')
+
+
+def highlight_file(path, html_directory=None, base_directory=''):
+    """返回 JSON 结果：html_directory 为 None 时包含 token 列表 [行, 列, 长度, 类型]（行从 1 开始），
+    否则把 HTML 按相对 base_directory 的路径写到该目录下，结果中包含输出文件"""
+    import tokenize
+    try:
+        # 与解释器一样按编码声明解码
+        with tokenize.open(path) as f:
+            lines = f.read().split('\n')
+        if html_directory is None:
+            return {'file': path, 'lines': len(lines),
+                    'tokens': [[number, start, length, token_type]
+                               for number, tokens in enumerate(tokenize_lines(lines), 1)
+                               for start, length, token_type in tokens]}
+        output = os.path.join(html_directory, os.path.relpath(os.path.abspath(path), base_directory) + '.html')
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(highlight_html(path, lines))
+        return {'file': path, 'output': output}
+    except (OSError, SyntaxError, UnicodeDecodeError) as e:
+        return {'file': path, 'error': str(e)}
+
+
+def run_batch(function, paths, jobs):
+    """在进程池中对每个文件调用 function，按完成顺序逐行输出 JSON，返回结果列表"""
+    start = time.perf_counter()
+    results = []
+
+    def emit(result):
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + '\n')
+        sys.stdout.flush()
+        results.append(result)
+
+    if jobs == 1:
+        for path in paths:
+            emit(function(path))
+    else:
+        import multiprocessing
+        # 每个进程一次领取一批文件，减少进程间通信
+        with multiprocessing.Pool(jobs) as pool:
+            for result in pool.imap_unordered(function, paths, chunksize=8):
+                emit(result)
+
+    seconds = time.perf_counter() - start
+    sys.stderr.write(f"处理了 {len(results)} 个文件，用时 {seconds:.2f} 秒，"
+                     f"{len(results) / max(seconds, 1e-9):.1f} 个文件/秒\n")
+    return results
+
+
+def batch_arguments(command, argv, html_option=False):
+    import argparse
+    parser = argparse.ArgumentParser(prog=f"main.py {command}")
+    parser.add_argument('paths', nargs='+', help="文件或目录（目录下的 .py 文件）")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="进程数，1 表示不使用进程池")
+    if html_option:
+        parser.add_argument('--html', action='store_true', help="输出 HTML 而不是 token 列表")
+        parser.add_argument('-o', '--output', help="HTML 的输出目录")
+    args = parser.parse_args(argv)
+    args.jobs = max(1, args.jobs)
+    return args
+
+
+def serve_check(*argv):
+    args = batch_arguments('check', argv)
+    results = run_batch(check_file, list(python_files(args.paths)), args.jobs)
+    return 0 if all(result['ok'] for result in results) else 1
+
+
+def serve_highlight(*argv):
+    args = batch_arguments('highlight', argv, html_option=True)
+    paths = list(python_files(args.paths))
+    if args.html and args.output is None:
+        import tokenize
+        if len(paths) != 1:
+            sys.stderr.write("高亮多个文件为 HTML 时需要用 -o 指定输出目录\n")
+            return 2
+        try:
+            with tokenize.open(paths[0]) as f:
+                lines = f.read().split('\n')
+        except (OSError, SyntaxError, UnicodeDecodeError) as e:
+            sys.stderr.write(f"{paths[0]}: {e}\n")
+            return 1
+        sys.stdout.write(highlight_html(paths[0], lines))
+        return 0
+    if args.html:
+        # 输出目录中保留文件相对于它们公共上级目录的结构
+        base_directory = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths]) if paths else ''
+        function = functools.partial(highlight_file, html_directory=args.output, base_directory=base_directory)
+    else:
+        function = highlight_file
+    results = run_batch(function, paths, args.jobs)
+    return 0 if not any('error' in result for result in results) else 1
+
+
+def main(argv):
+    commands = {
+        'introspect': serve_introspect,
+        'run': serve_run,
+        'warm': serve_warm,
+        'kernel': serve_kernel,
+        'zygote': serve_zygote,
+        'check': serve_check,
+        'highlight': serve_highlight,
+    }
+    if len(argv) < 2 or argv[1] not in commands:
+        sys.stderr.write(__doc__)
+        return 2
+    return commands[argv[1]](*argv[2:]) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))